@@ -29,6 +29,11 @@ def main(args=None):
     parser.add_argument('--cell', help='name of the cell to be analyzed '
                                        '(top cell by default)')
 
+    parser.add_argument('--report', action='append', metavar='REPORT[:CELL]',
+                        help='run a report (%s) on a cell (--cell by default);'
+                             ' may be repeated to run a batch of reports on '
+                             'one loaded netlist' % ', '.join(apps.REPORTS))
+
     arg_ns = parser.parse_args(args)
 
     #---------------------------------------------------------------------------
@@ -56,6 +61,16 @@ def main(args=None):
     #topcellnames = [cell.name for cell in ckt.get_topcells()]
     #print "Top cells: %s" % topcellnames
 
+    if arg_ns.report:
+        reports = []
+        for spec in arg_ns.report:
+            name, _, cellname = spec.partition(':')
+            reports.append((name, cellname or arg_ns.cell))
+        lib = arg_ns.lib.name if arg_ns.lib else ''
+        netlists = [f.name for f in arg_ns.spice_files]
+        apps.run_reports(ckt, reports, lib, netlists)
+        return ckt
+
     if arg_ns.cell:
         cell = ckt.get_cell(arg_ns.cell)
     else:
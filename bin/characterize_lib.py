@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+#-------------------------------------------------------------------------------
+import os
+import sys
+
+bin_dir = os.path.dirname(os.path.abspath(__file__))
+pkg_dir = os.path.abspath(os.path.join(bin_dir, ".."))
+sys.path.append(pkg_dir)
+
+#-------------------------------------------------------------------------------
+import argparse
+import json
+
+import cktapps
+from cktapps import apps
+
+#-------------------------------------------------------------------------------
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Report net capacitances "
+                                                 "and fanout of every cell "
+                                                 "in a library")
+
+    parser.add_argument('spice_files', metavar='file', nargs='+',
+                        type=argparse.FileType('r'), help='spice netlist file(s)')
+
+    parser.add_argument('--lib', type=argparse.FileType('r'),
+                        help='lib file(s) with model (e.g. nch, pch) defintions')
+
+    parser.add_argument('--cells', default='.*', metavar='REGEX',
+                        help='only characterize the cells matching REGEX')
+
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of processes (default: %(default)s)')
+
+    parser.add_argument('--cache', metavar='FILE',
+                        help='JSON file of results per cell structure hash, '
+                             'read if it exists and updated afterwards')
+
+    parser.add_argument('--format', choices=apps.OUTPUT_FORMATS, default='csv',
+                        help='output format (default: %(default)s)')
+
+    parser.add_argument('--output', metavar='FILE',
+                        help='output file (stdout by default)')
+
+    arg_ns = parser.parse_args(args)
+
+    #---------------------------------------------------------------------------
+
+    ckt = cktapps.Ckt()
+
+    if arg_ns.lib:
+        ckt.read_spice(arg_ns.lib)
+
+    for spice_file in arg_ns.spice_files:
+        ckt.read_spice(spice_file)
+
+    ckt.link()
+
+    cache = {}
+    if arg_ns.cache and os.path.exists(arg_ns.cache):
+        with open(arg_ns.cache) as f:
+            cache = dict((digest, [tuple(row) for row in rows])
+                         for digest, rows in json.load(f).items())
+
+    results = apps.characterize_cells(ckt, arg_ns.cells, jobs=arg_ns.jobs,
+                                      cache=cache)
+
+    if arg_ns.cache:
+        with open(arg_ns.cache, 'w') as f:
+            json.dump(cache, f)
+
+    output = open(arg_ns.output, 'wb') if arg_ns.output else sys.stdout
+    apps.write_rows(output, arg_ns.format, apps.LIBRARY_FIELDS,
+                    apps.library_rows(results))
+    if arg_ns.output:
+        output.close()
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    main()
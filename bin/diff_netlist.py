@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+#-------------------------------------------------------------------------------
+import os
+import sys
+
+bin_dir = os.path.dirname(os.path.abspath(__file__))
+pkg_dir = os.path.abspath(os.path.join(bin_dir, ".."))
+sys.path.append(pkg_dir)
+
+#-------------------------------------------------------------------------------
+import argparse
+
+import cktapps
+from cktapps import apps
+from cktapps import core
+
+#-------------------------------------------------------------------------------
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Report the differences "
+                                                 "between two netlists as "
+                                                 "JSON Lines")
+
+    parser.add_argument('old_file', type=argparse.FileType('r'),
+                        help='old spice netlist file')
+
+    parser.add_argument('new_file', type=argparse.FileType('r'),
+                        help='new spice netlist file')
+
+    parser.add_argument('--lib', type=argparse.FileType('r'),
+                        help='lib file with model (e.g. nch, pch) '
+                             'defintions, read before both netlists')
+
+    parser.add_argument('--output', metavar='FILE',
+                        help='output file (stdout by default)')
+
+    arg_ns = parser.parse_args(args)
+
+    #---------------------------------------------------------------------------
+
+    ckts = []
+    for spice_file in (arg_ns.old_file, arg_ns.new_file):
+        ckt = cktapps.Ckt()
+        if arg_ns.lib:
+            arg_ns.lib.seek(0)
+            ckt.read_spice(arg_ns.lib)
+        ckt.read_spice(spice_file)
+        try:
+            ckt.link(ignore_link_errors=True)
+        except core.LinkError, e:
+            # diff what could be linked, the rest compares by ref name
+            sys.stderr.write("Warning: %s (%s)\n" % (e, spice_file.name))
+        ckts.append(ckt)
+
+    output = open(arg_ns.output, 'w') if arg_ns.output else sys.stdout
+    apps.write_diffs(output, apps.diff_ckts(*ckts))
+    if arg_ns.output:
+        output.close()
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    main()
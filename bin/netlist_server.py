@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+#-------------------------------------------------------------------------------
+import os
+import sys
+
+bin_dir = os.path.dirname(os.path.abspath(__file__))
+pkg_dir = os.path.abspath(os.path.join(bin_dir, ".."))
+sys.path.append(pkg_dir)
+
+#-------------------------------------------------------------------------------
+import argparse
+
+import cktapps
+from cktapps import server
+
+#-------------------------------------------------------------------------------
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Serve netlist queries from "
+                                                 "a loaded database")
+
+    parser.add_argument('spice_files', metavar='file', nargs='+',
+                        type=argparse.FileType('r'), help='spice netlist file(s)')
+
+    parser.add_argument('--lib', type=argparse.FileType('r'),
+                        help='lib file(s) with model (e.g. nch, pch) defintions')
+
+    address = parser.add_mutually_exclusive_group(required=True)
+
+    address.add_argument('--socket', metavar='PATH',
+                         help='UNIX socket to listen on')
+
+    address.add_argument('--port', type=int,
+                         help='TCP port to listen on (localhost only)')
+
+    arg_ns = parser.parse_args(args)
+
+    #---------------------------------------------------------------------------
+
+    ckt = cktapps.Ckt()
+
+    if arg_ns.lib:
+        ckt.read_spice(arg_ns.lib)
+
+    for spice_file in arg_ns.spice_files:
+        ckt.read_spice(spice_file)
+
+    ckt.link()
+
+    if arg_ns.socket:
+        address = arg_ns.socket
+    else:
+        address = ('localhost', arg_ns.port)
+
+    srv = server.make_server(ckt, address)
+    print("Serving on %s" % (address,))
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+        if arg_ns.socket:
+            os.unlink(arg_ns.socket)
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+#-------------------------------------------------------------------------------
+import os
+import sys
+
+bin_dir = os.path.dirname(os.path.abspath(__file__))
+pkg_dir = os.path.abspath(os.path.join(bin_dir, ".."))
+sys.path.append(pkg_dir)
+
+#-------------------------------------------------------------------------------
+import argparse
+import json
+
+from cktapps import server
+
+#-------------------------------------------------------------------------------
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Query a netlist server "
+                                                 "(see netlist_server.py)")
+
+    address = parser.add_mutually_exclusive_group(required=True)
+
+    address.add_argument('--socket', metavar='PATH',
+                         help='UNIX socket of the server')
+
+    address.add_argument('--port', type=int,
+                         help='TCP port of the server (on localhost)')
+
+    parser.add_argument('query', choices=['cells', 'report_net',
+                                          'report_hierarchy', 'lookup', 'eval'],
+                        help='query to run')
+
+    parser.add_argument('--cell', help='name of the cell to be queried '
+                                       '(top cell by default)')
+
+    parser.add_argument('--top', type=int, metavar='N',
+                        help='report_net: only the N nets with the highest '
+                             'fanout')
+
+    parser.add_argument('--path', help='lookup/eval: instance path, e.g. x1/x2')
+
+    parser.add_argument('--param', help='eval: name of the parameter')
+
+    arg_ns = parser.parse_args(args)
+
+    #---------------------------------------------------------------------------
+
+    if arg_ns.socket:
+        address = arg_ns.socket
+    else:
+        address = ('localhost', arg_ns.port)
+
+    query_args = {}
+    for name in ('cell', 'top', 'path', 'param'):
+        value = getattr(arg_ns, name)
+        if value is not None:
+            query_args[name] = value
+
+    client = server.Client(address)
+    try:
+        result = client.query(arg_ns.query, **query_args)
+    except server.QueryError, e:
+        sys.exit("Error: %s" % e)
+    finally:
+        client.close()
+
+    if isinstance(result, list):
+        for row in result:
+            print(json.dumps(row))
+    else:
+        print(json.dumps(result))
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    main()
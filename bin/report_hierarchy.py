@@ -28,8 +28,29 @@ def main(args=None):
 
     parser.add_argument('--cell', help='name of the cell to be analyzed')
 
+    parser.add_argument('--summary', action='store_true',
+                        help='report per-cell device and instance counts '
+                             'instead of the instance tree')
+
+    parser.add_argument('--format', choices=apps.OUTPUT_FORMATS,
+                        help='write the report rows in a machine-readable '
+                             'format instead')
+
+    parser.add_argument('--output', metavar='FILE',
+                        help='file to write the --format output to '
+                             '(stdout by default)')
+
     arg_ns = parser.parse_args(args)
 
+    if arg_ns.summary and (arg_ns.format or arg_ns.output):
+        parser.error("--summary does not support --format and --output")
+
+    if arg_ns.output and not arg_ns.format:
+        parser.error("--output requires --format")
+
+    if arg_ns.format == 'npz' and not arg_ns.output:
+        parser.error("--format npz requires --output")
+
     #---------------------------------------------------------------------------
    
     ckt = cktapps.Ckt()
@@ -51,7 +72,13 @@ def main(args=None):
         else:
             cell = ckt
 
-    apps.report_hierarchy(cell)
+    if arg_ns.summary:
+        apps.report_hierarchy_summary(cell)
+    else:
+        output = open(arg_ns.output, 'wb') if arg_ns.output else None
+        apps.report_hierarchy(cell, format=arg_ns.format, f=output)
+        if output:
+            output.close()
 
 #-------------------------------------------------------------------------------
 if __name__ == "__main__":
@@ -30,8 +30,107 @@ def main(args=None):
     parser.add_argument('--cell', help='name of the cell to be analyzed '
                                        '(top cell by default)')
 
+    parser.add_argument('--hier', action='store_true',
+                        help='compute the caps from the cell hierarchy '
+                             'instead of flattening the cell')
+
+    parser.add_argument('--vector', action='store_true',
+                        help='evaluate the flattened device caps with numpy')
+
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of processes to compute the flattened '
+                             'net caps with (default: %(default)s)')
+
+    parser.add_argument('--ccc', action='store_true',
+                        help='split the nets between the --jobs processes by '
+                             'channel-connected components')
+
+    parser.add_argument('--dspf', type=argparse.FileType('r'),
+                        help='DSPF file of the cell to take the wire caps '
+                             'from')
+
+    parser.add_argument('--spef', type=argparse.FileType('r'),
+                        help='SPEF file of the cell to take the wire caps '
+                             'from')
+
+    parser.add_argument('--reduce-rc', action='store_true',
+                        help='collapse resistor-connected nets of the '
+                             'flattened cell into logical nets')
+
+    parser.add_argument('--merge-parallel', action='store_true',
+                        help='merge parallel devices of the flattened cell '
+                             'before computing the caps')
+
+    parser.add_argument('--skip-supplies', action='store_true',
+                        help='leave the supply nets (matching '
+                             '--supply-pattern, .global, or with more than '
+                             '--supply-pins pins) out of the report')
+
+    parser.add_argument('--summarize-supplies', action='store_true',
+                        help='same as --skip-supplies, but also print the '
+                             'pin counts of the supply nets')
+
+    parser.add_argument('--supply', action='append', default=[],
+                        metavar='NET',
+                        help='net to treat as a supply (may be repeated)')
+
+    parser.add_argument('--supply-pattern', default=apps.SUPPLY_NET_PATTERN,
+                        metavar='REGEX',
+                        help='supply net name pattern ("" to disable)')
+
+    parser.add_argument('--supply-pins', type=int, metavar='N',
+                        help='treat nets with more than N pins as supplies')
+
+    output = parser.add_mutually_exclusive_group()
+
+    output.add_argument('--top', type=int, metavar='N',
+                        help='only report the N nets with the highest fanout')
+
+    output.add_argument('--stream', action='store_true',
+                        help='report the nets unsorted, as they are computed')
+
+    parser.add_argument('--format', choices=apps.OUTPUT_FORMATS,
+                        help='write the report rows in a machine-readable '
+                             'format instead')
+
+    parser.add_argument('--output', metavar='FILE',
+                        help='file to write the --format output to '
+                             '(stdout by default)')
+
     arg_ns = parser.parse_args(args)
 
+    if ((arg_ns.supply or arg_ns.supply_pins is not None or
+         arg_ns.supply_pattern != apps.SUPPLY_NET_PATTERN) and
+        not (arg_ns.skip_supplies or arg_ns.summarize_supplies)):
+        parser.error("--supply, --supply-pattern and --supply-pins require "
+                     "--skip-supplies or --summarize-supplies")
+
+    if arg_ns.jobs > 1 and (arg_ns.hier or arg_ns.vector):
+        parser.error("--jobs is not supported with --hier or --vector")
+
+    if arg_ns.hier and arg_ns.vector:
+        parser.error("--hier and --vector are mutually exclusive")
+
+    if arg_ns.ccc and arg_ns.jobs < 2:
+        parser.error("--ccc requires --jobs 2 or more")
+
+    if arg_ns.merge_parallel and arg_ns.hier:
+        parser.error("--merge-parallel is not supported with --hier")
+
+    if arg_ns.reduce_rc and arg_ns.hier:
+        parser.error("--reduce-rc is not supported with --hier")
+
+    if ((arg_ns.skip_supplies or arg_ns.summarize_supplies) and
+        (arg_ns.hier or arg_ns.vector)):
+        parser.error("--skip-supplies and --summarize-supplies are not "
+                     "supported with --hier or --vector")
+
+    if arg_ns.output and not arg_ns.format:
+        parser.error("--output requires --format")
+
+    if arg_ns.format == 'npz' and not arg_ns.output:
+        parser.error("--format npz requires --output")
+
     #---------------------------------------------------------------------------
    
     ckt = cktapps.Ckt()
@@ -64,14 +163,39 @@ def main(args=None):
     #ckt.write_spice(cell)
 
     #print "-"*80
-    cell.ungroup(flatten=True)
+    if arg_ns.dspf:
+        ckt.read_dspf(arg_ns.dspf, cell)
+    if arg_ns.spef:
+        ckt.read_spef(arg_ns.spef, cell)
+
+    if not arg_ns.hier:
+        cell.ungroup(flatten=True)
+        if arg_ns.reduce_rc:
+            apps.reduce_rc(cell)
+        if arg_ns.merge_parallel:
+            apps.merge_parallel_devices(cell)
     #print cell
     #ckt.write_spice(cell)
 
     #print "-"*80
     lib = arg_ns.lib.name
     netlists = [f.name for f in arg_ns.spice_files]
-    apps.report_net(cell, lib, netlists)
+    supplies = None
+    if arg_ns.skip_supplies or arg_ns.summarize_supplies:
+        supplies = apps.SupplyNets(arg_ns.supply, arg_ns.supply_pattern,
+                                   max_pins=arg_ns.supply_pins)
+    partitions = None
+    if arg_ns.ccc:
+        partitions = apps.ccc_partitions(cell, arg_ns.jobs)
+    output = open(arg_ns.output, 'wb') if arg_ns.output else None
+    apps.report_net(cell, lib, netlists, hierarchical=arg_ns.hier,
+                    vectorized=arg_ns.vector, jobs=arg_ns.jobs,
+                    partitions=partitions, top=arg_ns.top,
+                    supplies=supplies,
+                    summarize_supplies=arg_ns.summarize_supplies,
+                    stream=arg_ns.stream, format=arg_ns.format, f=output)
+    if output:
+        output.close()
 
     #print "-"*80
     #apps.report_hierarchy(cell)
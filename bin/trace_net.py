@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+#-------------------------------------------------------------------------------
+import os
+import sys
+
+bin_dir = os.path.dirname(os.path.abspath(__file__))
+pkg_dir = os.path.abspath(os.path.join(bin_dir, ".."))
+sys.path.append(pkg_dir)
+
+#-------------------------------------------------------------------------------
+import argparse
+
+import cktapps
+from cktapps import apps
+
+#-------------------------------------------------------------------------------
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Trace the fanin or fanout "
+                                                 "cone of a net")
+
+    parser.add_argument('spice_files', metavar='file', nargs='+',
+                        type=argparse.FileType('r'), help='spice netlist file(s)')
+
+    parser.add_argument('--lib', type=argparse.FileType('r'),
+                        help='lib file(s) with model (e.g. nch, pch) defintions')
+
+    parser.add_argument('--cell', help='name of the cell to be analyzed '
+                                       '(top cell by default)')
+
+    parser.add_argument('--net', required=True,
+                        help='net to trace from (flattened name, e.g. x1/n2)')
+
+    parser.add_argument('--fanin', action='store_true',
+                        help='trace the fanin cone (fanout by default)')
+
+    parser.add_argument('--depth', type=int,
+                        help='maximum number of device stages')
+
+    parser.add_argument('--stop', action='append', default=[], metavar='NET',
+                        help='net to stop at (may be repeated)')
+
+    parser.add_argument('--stop-pattern', default=apps.SUPPLY_NET_PATTERN,
+                        metavar='REGEX',
+                        help='stop at nets matching REGEX (supply nets by '
+                             'default; "" to disable)')
+
+    parser.add_argument('--channels', action='store_true',
+                        help='fanout cone only: also trace from s/d to s/d '
+                             '(e.g. through pass transistors); the fanin '
+                             'cone always does')
+
+    parser.add_argument('--devices', action='store_true',
+                        help='list the devices of the cone instead of the '
+                             'nets')
+
+    arg_ns = parser.parse_args(args)
+
+    if arg_ns.fanin and arg_ns.channels:
+        parser.error("--channels is only supported for the fanout cone")
+
+    #---------------------------------------------------------------------------
+
+    ckt = cktapps.Ckt()
+
+    if arg_ns.lib:
+        ckt.read_spice(arg_ns.lib)
+
+    for spice_file in arg_ns.spice_files:
+        ckt.read_spice(spice_file)
+
+    ckt.link()
+
+    if arg_ns.cell:
+        cell = ckt.get_cell(arg_ns.cell)
+    else:
+        topcells = ckt.get_topcells()
+        if topcells:
+            cell = topcells[0]
+        else:
+            cell = ckt
+
+    flat = cell.flattened()
+    for netname in [arg_ns.net] + arg_ns.stop:
+        if netname not in flat.nets:
+            parser.error("no net '%s' in cell '%s'" % (netname, cell.name))
+
+    graph = apps.NetGraph(flat)
+    stop = graph.stop_nets(arg_ns.stop, arg_ns.stop_pattern)
+
+    if arg_ns.fanin:
+        cone = graph.fanin(arg_ns.net, depth=arg_ns.depth, stop=stop)
+    else:
+        cone = graph.fanout(arg_ns.net, depth=arg_ns.depth, stop=stop,
+                            channels=arg_ns.channels)
+
+    items = cone.devices if arg_ns.devices else cone.nets
+    for name, depth in items.items():
+        print("%d %s" % (depth, name))
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,839 @@
 #-------------------------------------------------------------------------------
 from __future__ import print_function
 import collections
+import copy
+import csv
 import datetime
+import heapq
+import itertools
+import json
+import multiprocessing
+import re
+import sys
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from cktapps.packages import prettytable
+from cktapps import core
 from cktapps.core import Ckt
 
 #-------------------------------------------------------------------------------
-def report_net(cell, lib, netlists):
+# Names of the power and ground rails
+SUPPLY_NET_PATTERN = r'(?i)^(vdd|vss|vcc|vee|gnd|avdd|avss|dvdd|dvss)\w*!?$'
+
+class SupplyNets(object):
+    """ Rules identifying the supply nets of a cell
+
+    - names     : net names
+    - pattern   : regex the net names are matched against (None to disable)
+    - use_globals : global nets (.global, Ckt supply_nets) are supplies
+    - max_pins  : nets with more driver, load and cap pins than this are
+                  supplies (None to disable)
+    """
+
+    def __init__(self, names=(), pattern=SUPPLY_NET_PATTERN, use_globals=True,
+                 max_pins=None):
+        self.names = set(names)
+        self.re_name = re.compile(pattern) if pattern else None
+        self.use_globals = use_globals
+        self.max_pins = max_pins
+
+    def match(self, net):
+        """ True if net is a supply by name or by being global """
+        return ((self.use_globals and net.is_global) or
+                self.match_name(net.name))
+
+    def match_name(self, name):
+        """ True if name is a supply name, by names or pattern """
+        return (name in self.names or
+                (self.re_name is not None and
+                 self.re_name.match(name) is not None))
+
+#-------------------------------------------------------------------------------
+def net_caps(cell, cache=None, supplies=None, summary=None):
+    """ Generate (net, cwire, cload, cdriver) for all the nets of a flat cell
+
+    Caps are in F. Any hierarchical instances left in the cell are ignored, so
+    the cell is normally flattened with cell.ungroup(flatten=True) first.
+    Device caps are looked up through cache (a RefParamCache), and a new one
+    is used if none is given.
+
+    If supplies (SupplyNets) is given, the supply nets are left out: their
+    device caps are not evaluated, and only their driver, load and cap pins
+    are counted into summary (if given), as {net: [drivers, loads, caps]}.
+    """
+    if cache is None:
+        cache = RefParamCache()
+
+    for netname, info in _net_info(cell, supplies, summary).items():
+        yield _net_row(netname, info, cache)
+
+    _debug('%r', cache)
+
+def _net_info(cell, supplies=None, summary=None):
     net_info = collections.OrderedDict()
+    counts = {}
     for net in cell.all_nets():
-        net_info[net.name] = dict(drivers=[], loads=[], caps=[])
+        if supplies is not None and supplies.match(net):
+            counts[net.name] = [0, 0, 0]
+        else:
+            net_info[net.name] = dict(drivers=[], loads=[], caps=[])
+    max_pins = supplies.max_pins if supplies is not None else None
 
     for inst in cell.all_instances():
         for pin in inst.all_pins():
             if pin.port.name in ('s', 'd'):
-                net_info[pin.net.name]['drivers'].append(pin.instance)
+                field, i = 'drivers', 0
             elif pin.port.name == 'g':
-                net_info[pin.net.name]['loads'].append(pin.instance)
+                field, i = 'loads', 1
             elif pin.instance.refname == 'c':
-                net_info[pin.net.name]['caps'].append(pin.instance)
+                field, i = 'caps', 2
+            else:
+                continue
+            netname = pin.net.name
+            info = net_info.get(netname)
+            if info is None:
+                counts[netname][i] += 1
+                continue
+            info[field].append(pin.instance)
+            if max_pins is not None:
+                npins = [len(info['drivers']), len(info['loads']),
+                         len(info['caps'])]
+                if sum(npins) > max_pins:
+                    # too many pins: only count them from now on
+                    counts[netname] = npins
+                    del net_info[netname]
+
+    if summary is not None:
+        for net in cell.all_nets():
+            if net.name in counts:
+                summary[net.name] = counts[net.name]
+    return net_info
+
+def _net_row(netname, info, cache):
+    drivers = info['drivers']
+    loads   = info['loads']
+    caps    = info['caps']
+
+    _debug('net: %s', netname)
+
+    net_cap = 0
+    driver_cap = 0
+    load_cap = 0
+
+    for i in caps:
+        c = cache.eval(i, 'c')
+        _debug('> cap %s %s', c, i)
+        net_cap += c
+
+    for i in drivers:
+        cg = cache.eval(i, 'cg')
+        _debug('> %s driver %s', cg, i)
+        driver_cap += cg
+
+    for i in loads:
+        cg = cache.eval(i, 'cg')
+        _debug('> %s load %s', cg, i)
+        load_cap += cg
+
+    return netname, net_cap, load_cap, driver_cap
+
+#-------------------------------------------------------------------------------
+# State shared with the pool workers (see _fork_pool). It is only set while
+# the pool is created, so the forked workers inherit it instead of having it
+# pickled to them.
+_shared = {}
+_shared_lock = threading.Lock()
+
+def _fork_pool(jobs, **shared):
+    # the lock keeps concurrent callers (e.g. server threads) from forking
+    # their workers with each other's state
+    with _shared_lock:
+        _shared.update(shared)
+        try:
+            return multiprocessing.Pool(jobs)
+        finally:
+            _shared.clear()
+
+def parallel_net_caps(cell, jobs, partitions=None, supplies=None,
+                      summary=None):
+    """ Same as net_caps(), but computed by a pool of jobs processes
+
+    The nets are split into partitions (lists of net names), by default
+    contiguous runs of nets, 4 per job. Each worker sums the caps of a whole
+    partition, in the same order as net_caps(), and the rows are returned
+    (as a list) in net order, so the results are identical to the serial
+    ones. supplies and summary are the same as for net_caps(); the supply
+    nets are dropped from the partitions.
+    """
+    net_info = _net_info(cell, supplies, summary)
+
+    if partitions is None:
+        netnames = list(net_info)
+        size = max(1, -(-len(netnames) // (jobs * 4)))
+        partitions = [netnames[i:i + size]
+                      for i in range(0, len(netnames), size)]
+
+    pool = _fork_pool(jobs, net_info=net_info)
+    try:
+        rows = {}
+        for partition_rows in pool.imap(_net_caps_partition, partitions):
+            for row in partition_rows:
+                rows[row[0]] = row
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return [rows[netname] for netname in net_info if netname in rows]
+
+def _net_caps_partition(netnames):
+    net_info = _shared['net_info']
+    if 'cache' not in _shared:
+        _shared['cache'] = RefParamCache()
+    cache = _shared['cache']
+    return [_net_row(netname, net_info[netname], cache)
+            for netname in netnames if netname in net_info]
+
+#-------------------------------------------------------------------------------
+class IncrementalNetCaps(object):
+    """ Net caps of a flat cell, kept up to date as the cell is edited
+
+    The caps each instance adds to its nets are recorded, and the cell is
+    listened to (see Cell.add_listener), so adding or deleting an instance,
+    adding a pin, or changing an instance param only updates the nets of
+    the instances involved. rows() then gives the same caps as net_caps(),
+    up to floating point rounding.
+    """
+
+    def __init__(self, cell, cache=None):
+        self.cell = cell
+        self.cache = cache or RefParamCache()
+        self.nets = collections.OrderedDict()
+        self._contribs = {}
+
+        for net in cell.all_nets():
+            self.nets[net.name] = [0, 0, 0]
+        for inst in cell.all_instances():
+            self._add_instance(inst)
+
+        cell.add_listener(self._on_edit)
+
+    def close(self):
+        """ Stop tracking the edits of the cell """
+        self.cell.remove_listener(self._on_edit)
+
+    def get(self, netname):
+        """ Current (cwire, cload, cdriver) of a net """
+        try:
+            return tuple(self.nets[netname])
+        except KeyError:
+            raise core.CktObjDoesNotExist("'%s' in: '%s'" %
+                                          (netname, self.cell))
+
+    def rows(self):
+        """ Generate (net, cwire, cload, cdriver) like net_caps() """
+        for netname, (cwire, cload, cdriver) in self.nets.items():
+            yield netname, cwire, cload, cdriver
+
+    #---------------------------------------------------------------------------
+    def _on_edit(self, event, obj):
+        if event == 'add_instance':
+            self._del_instance(obj)
+            self._add_instance(obj)
+        elif event == 'del_instance':
+            self._del_instance(obj)
+        elif event == 'add_pin':
+            self._add_pin(obj.instance, obj)
+        elif event == 'set_param':
+            self._del_instance(obj)
+            self._add_instance(obj)
+
+    def _add_instance(self, inst):
+        for pin in inst.all_pins():
+            self._add_pin(inst, pin)
+
+    def _add_pin(self, inst, pin):
+        if pin.port.name in ('s', 'd'):
+            field, param = 2, 'cg'
+        elif pin.port.name == 'g':
+            field, param = 1, 'cg'
+        elif inst.refname == 'c':
+            field, param = 0, 'c'
+        else:
+            self.nets.setdefault(pin.net.name, [0, 0, 0])
+            return
+        value = self.cache.eval(inst, param)
+        self.nets.setdefault(pin.net.name, [0, 0, 0])[field] += value
+        self._contribs.setdefault(inst, []).append((pin.net.name, field,
+                                                    value))
+
+    def _del_instance(self, inst):
+        for netname, field, value in self._contribs.pop(inst, []):
+            self.nets[netname][field] -= value
+
+#-------------------------------------------------------------------------------
+def vector_net_caps(cell):
+    """ Same as net_caps(), but evaluated with numpy
+
+    Devices are grouped by ref and parameter names, the ref cap expressions
+    are evaluated once per group over columns of the instance parameters, and
+    the per-net sums are accumulated with numpy.bincount() over the pin -> net
+    indices. Results match net_caps() up to floating point rounding.
+    """
+    if numpy is None:
+        raise ImportError("vector_net_caps() requires numpy")
+
+    netnames = list(cell.nets)
+    net_index = dict((name, i) for i, name in enumerate(netnames))
+
+    groups = collections.OrderedDict()
+    cell_ctxs = {}
+    for inst in cell.all_instances():
+        if inst.is_hierarchical:
+            continue
+        if not inst.is_linked:
+            raise core.LinkError("can't eval ref params (%r not linked yet)"
+                                 % inst)
+        if inst._ctx is None:
+            owner = inst.owner
+            if owner not in cell_ctxs:
+                cell_ctxs[owner] = owner._build_ctx({})
+            inst_ctx = inst._build_ctx(cell_ctxs[owner])
+        else:
+            inst_ctx = inst._ctx
+        key = (inst.ref, inst.refname, tuple(sorted(inst_ctx)))
+        groups.setdefault(key, []).append((inst, inst_ctx))
+
+    # field -> list of (net indices, values) array pairs
+    fields = ([], [], [])
+    for (ref, refname, pnames), members in groups.items():
+        try:
+            columns = dict((pname,
+                            numpy.array([ctx[pname] for _, ctx in members],
+                                        dtype=float))
+                           for pname in pnames)
+        except (TypeError, ValueError):
+            # non-numeric params: evaluate instance by instance, as
+            # net_caps() does
+            ref_ctxs = [ref._build_ctx(ctx) for _, ctx in members]
+        else:
+            ref_ctxs = None
+            ref_ctx = ref._build_ctx(columns)
+            ones = numpy.ones(len(members))
+
+        # pins by port name, as ports may be left unconnected
+        # (see Instance._bind_by_name)
+        member_nets = [dict((pin.port.name, pin.net) for pin in inst.pins)
+                       for inst, _ in members]
+
+        for port in ref.ports:
+            if port in ('s', 'd'):
+                field, param = 2, 'cg'
+            elif port == 'g':
+                field, param = 1, 'cg'
+            elif refname == 'c':
+                field, param = 0, 'c'
+            else:
+                continue
+            rows = [i for i, nets in enumerate(member_nets) if port in nets]
+            if not rows:
+                continue
+            try:
+                if ref_ctxs is None:
+                    values = (ref_ctx[param] * ones)[rows]
+                else:
+                    values = numpy.array([ref_ctxs[i][param] for i in rows],
+                                         dtype=float)
+            except KeyError:
+                raise core.CktObjDoesNotExist("'%s' in: '%s'" % (param, ref))
+            nets = numpy.array([net_index[member_nets[i][port].name]
+                                for i in rows], dtype=numpy.intp)
+            fields[field].append((nets, values))
+
+    sums = []
+    for pairs in fields:
+        if pairs:
+            nets = numpy.concatenate([nets for nets, _ in pairs])
+            values = numpy.concatenate([values for _, values in pairs])
+            sums.append(numpy.bincount(nets, weights=values,
+                                       minlength=len(netnames)))
+        else:
+            sums.append(numpy.zeros(len(netnames)))
+
+    cwire, cload, cdriver = [column.tolist() for column in sums]
+    for i, netname in enumerate(netnames):
+        yield netname, cwire[i], cload[i], cdriver[i]
+
+#-------------------------------------------------------------------------------
+class RefParamCache(object):
+    """ Memoized Instance.eval_ref_param()
+
+    Ref (prim or cell) contexts are cached on the ref and the evaluated
+    parameters of the instance, so devices that only differ in name and
+    connectivity are evaluated once. hits and misses count the lookups.
+    """
+
+    def __init__(self):
+        self._ref_ctxs = {}
+        self._cell_ctxs = {}
+        self.hits = 0
+        self.misses = 0
+
+    def eval(self, inst, name, inst_ctx=None):
+        """ Same as inst.eval_ref_param(name), or if inst_ctx is given, the
+        value of name in the ref context built from inst_ctx.
+        """
+        ref_ctx = self.ref_ctx(inst, inst_ctx)
+        try:
+            return ref_ctx[name]
+        except KeyError:
+            raise core.CktObjDoesNotExist("'%s' in: '%s'" % (name, inst))
+
+    def ref_ctx(self, inst, inst_ctx=None):
+        if not inst.is_linked:
+            raise core.LinkError("can't eval ref params (%r not linked yet)"
+                                 % inst)
+        if inst_ctx is None:
+            inst_ctx = self.inst_ctx(inst)
+
+        key = (inst.ref, tuple(sorted(inst_ctx.items())))
+        try:
+            ref_ctx = self._ref_ctxs[key]
+        except KeyError:
+            self.misses += 1
+            ref_ctx = self._ref_ctxs[key] = inst.ref._build_ctx(inst_ctx)
+        else:
+            self.hits += 1
+        return ref_ctx
+
+    def inst_ctx(self, inst):
+        """ Evaluated params of inst, in the context of its owner cell (or
+        of the cell it was flattened from)
+        """
+        if inst._ctx is None:
+            return inst._build_ctx(self._cell_ctx(inst.owner))
+        return inst._ctx
+
+    def _cell_ctx(self, cell):
+        try:
+            return self._cell_ctxs[cell]
+        except KeyError:
+            cell_ctx = self._cell_ctxs[cell] = cell._build_ctx({})
+            return cell_ctx
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def __repr__(self):
+        return "<%s(hits=%d, misses=%d, hit_rate=%.1f%%)>" % (
+            self.__class__.__name__, self.hits, self.misses,
+            self.hit_rate() * 100)
+
+#-------------------------------------------------------------------------------
+def merge_parallel_devices(cell, by='m', caps=('cg',), cache=None):
+    """ Merge the parallel devices of a flat cell, in place
+
+    Devices are parallel if they have the same ref, the same nets on every
+    pin (s and d may be swapped), and the same evaluated params other than
+    by. Each group is replaced by its first device, with by set to the sum
+    of the group's values (m, or w for same-m devices). A group is only
+    merged if the caps params of the merged device add up to those of the
+    originals, so net caps are unchanged.
+
+    Returns an OrderedDict of {merged device name: [original device names]}.
+    """
+    if cache is None:
+        cache = RefParamCache()
+
+    groups = collections.OrderedDict()
+    for inst in cell.all_instances():
+        if inst.is_hierarchical or not inst.is_linked:
+            continue
+        if by not in cache.ref_ctx(inst):
+            continue
+        nets = dict((pin.port.name, pin.net.name) for pin in inst.all_pins())
+        if 's' in nets and 'd' in nets and nets['s'] < nets['d']:
+            nets['s'], nets['d'] = nets['d'], nets['s']
+        params = [(name, value) for name, value in cache.inst_ctx(inst).items()
+                  if name != by]
+        key = (inst.ref, tuple(sorted(nets.items())), tuple(sorted(params)))
+        groups.setdefault(key, []).append(inst)
+
+    merged = collections.OrderedDict()
+    for insts in groups.itervalues():
+        if len(insts) < 2:
+            continue
+        first = insts[0]
+        ref_ctxs = [cache.ref_ctx(inst) for inst in insts]
+        total = sum(ref_ctx[by] for ref_ctx in ref_ctxs)
+
+        inst_ctx = dict(cache.inst_ctx(first))
+        inst_ctx[by] = total
+        ref_ctx = cache.ref_ctx(first, inst_ctx)
+        if not all(_isclose(ref_ctx[name],
+                            sum(ctx[name] for ctx in ref_ctxs))
+                   for name in caps if name in ref_ctx):
+            # caps not linear in by: keep the devices
+            continue
+
+        first.add_param(by, repr(total))
+        for inst in insts[1:]:
+            cell.del_instance(inst.name)
+        merged[first.name] = [inst.name for inst in insts]
+    return merged
+
+def _isclose(a, b, rel_tol=1e-9):
+    return abs(a - b) <= rel_tol * max(abs(a), abs(b))
+
+#-------------------------------------------------------------------------------
+def reduce_rc(cell, ground=None, keep_tree=False, cache=None):
+    """ Collapse the resistor-connected net fragments of a flat cell into
+    logical nets, in place
+
+    The fragments joined by resistors are found with a union-find, so the
+    time is linear in the number of pins and resistors. Each logical net is
+    named after one of its fragments: the ground net if any, else a port,
+    else the shortest name (the first in net order on ties). The pins of the other fragments are
+    moved to it, and the fragments that are not ports are removed. Then the
+    grounded caps of each logical net (to the same net matched by ground, a
+    SupplyNets; '0' and the supply nets by default) are summed into one, and
+    the caps left with both pins on the same net are removed.
+
+    Ground nets are never joined to each other: a resistor between two of
+    them (vdd to vss, vdd to a switched vddx) is left in the cell. A net
+    named '<supply>:<n>' is a fragment of that supply when <supply> is a
+    ground net of cell, or when its last '/' component is a ground name; the
+    fragments are joined to the ground net they are connected to, like the
+    fragments of any other net. The resistors between a ground net or
+    fragment and any other net are left in the cell; the others are removed,
+    or kept per logical net with keep_tree. Returns an RCNetwork.
+    """
+    if ground is None:
+        ground = SupplyNets(names=['0'])
+    if cache is None:
+        cache = RefParamCache()
+
+    netnames = list(cell.nets)
+    index = dict((name, i) for i, name in enumerate(netnames))
+    is_ground = bytearray(ground.match(net) for net in cell.all_nets())
+    # ground nets and their fragments
+    is_supply = bytearray(is_ground)
+    for i, name in enumerate(netnames):
+        if is_ground[i] or ':' not in name:
+            continue
+        base = name.rsplit(':', 1)[0]
+        j = index.get(base)
+        if j is not None:
+            is_supply[i] = is_ground[j]
+        else:
+            is_supply[i] = ground.match_name(base.rsplit('/', 1)[-1])
+
+    parent = list(range(len(netnames)))
+    # the ground net of each group of supply fragments, by root
+    rails = dict((i, i) for i in range(len(netnames)) if is_ground[i])
+    kept = []
+    reduced = []
+    for res in cell.resistors:
+        p = _find(parent, index[res.p])
+        n = _find(parent, index[res.n])
+        if is_supply[p] != is_supply[n]:
+            kept.append(res)
+            continue
+        if p != n:
+            rail_p = rails.pop(p, None)
+            rail_n = rails.pop(n, None)
+            if rail_p is not None and rail_n is not None:
+                rails[p] = rail_p
+                rails[n] = rail_n
+                kept.append(res)
+                continue
+            _union(parent, p, n)
+            rail = rail_p if rail_p is not None else rail_n
+            if rail is not None:
+                rails[min(p, n)] = rail
+        reduced.append(res)
+
+    # pick the logical net name of every group of fragments
+    ports = cell.ports
+    rep = {}
+    for i, name in enumerate(netnames):
+        root = _find(parent, i)
+        best = rep.get(root)
+        if best is None:
+            rep[root] = i
+            continue
+        best_name = netnames[best]
+        if ((is_ground[i], name in ports, -len(name)) >
+            (is_ground[best], best_name in ports, -len(best_name))):
+            rep[root] = i
+
+    rc = RCNetwork()
+    for i, name in enumerate(netnames):
+        rc.nets.setdefault(netnames[rep[_find(parent, i)]], []).append(name)
+    for name in [name for name, fragments in rc.nets.items()
+                 if len(fragments) == 1]:
+        del rc.nets[name]
+
+    for inst in cell.all_instances():
+        for pin in inst.all_pins():
+            i = index[pin.net.name]
+            r = rep[_find(parent, i)]
+            if r != i:
+                pin.net = cell.nets[netnames[r]]
+
+    for i, name in enumerate(netnames):
+        if rep[_find(parent, i)] != i and name not in ports:
+            del cell.nets[name]
+
+    # sum the grounded caps of each logical net
+    grounded = {}
+    for inst in list(cell.all_instances()):
+        if inst.refname != 'c':
+            continue
+        p, n = [pin.net for pin in inst.all_pins()]
+        if p is n:
+            cell.del_instance(inst.name)
+            continue
+        if is_supply[index[p.name]] == is_supply[index[n.name]]:
+            continue
+        if is_supply[index[p.name]]:
+            p, n = n, p
+        c = cache.eval(inst, 'c')
+        first = grounded.get((p.name, n.name))
+        if first is None:
+            grounded[(p.name, n.name)] = [inst, c]
+            continue
+        first[1] += c
+        cell.del_instance(inst.name)
+    for inst, c in grounded.values():
+        if c != cache.eval(inst, 'c'):
+            inst.add_param('c', repr(c))
+
+    if keep_tree:
+        for res in reduced:
+            netname = netnames[rep[_find(parent, index[res.p])]]
+            rc.resistors.setdefault(netname, []).append(res)
+    cell.resistors = kept
+    return rc
+
+class RCNetwork(object):
+    """ Result of reduce_rc
+
+    - nets      : OrderedDict(logical net name: [fragment net names]) of
+                  the nets made of several fragments
+    - resistors : {logical net name: [Resistor]}, the RC tree of each net
+                  (only with keep_tree); the resistor nets are fragments
+    """
+
+    def __init__(self):
+        self.nets = collections.OrderedDict()
+        self.resistors = {}
+
+    def __repr__(self):
+        return "<%s(nets=%d)>" % (self.__class__.__name__, len(self.nets))
+
+#-------------------------------------------------------------------------------
+class _CellCaps(object):
+    """ Caps seen by one placement of a cell with a given set of parameters
+
+    - nets     : {local net name: [cwire, cload, cdriver, leaf pin count]},
+                 including everything rolled up through the ports of
+                 hierarchical instances
+    - children : [(instance name, _CellCaps)] of the hierarchical instances
+    - ports    : set of port names
+    - globals  : set of the global net names (see Ckt.add_global) used in
+                 the cell or below it, other than ports
+    """
+
+    def __init__(self, ports):
+        self.nets = collections.OrderedDict()
+        self.children = []
+        self.ports = frozenset(ports)
+        self.globals = set()
+
+def hier_net_caps(cell, sep='/', cache=None):
+    """ Generate (net, cwire, cload, cdriver) for the nets of a hierarchical
+    cell, as net_caps() would after cell.ungroup(flatten=True, sep=sep).
+
+    Every (cell, parameters) combination is characterized once: the caps it
+    contributes to each of its ports, and the caps of its internal nets. The
+    parent adds the port caps to the nets its instance pins connect to, so
+    the flat netlist is never built.
+    """
+    if cache is None:
+        cache = RefParamCache()
+    top = _characterize_caps(cell, cell._build_ctx({}), {}, cache, {})
+
+    for netname, (cwire, cload, cdriver, _) in top.nets.items():
+        yield netname, cwire, cload, cdriver
+    for instname, child in top.children:
+        for row in _iter_internal_caps(child, instname + sep, sep):
+            yield row
+
+def _characterize_caps(cell, cell_ctx, done, cache, memo):
+    # identical cells (by struct_hash) share their characterization
+    key = (cell.struct_hash(memo), tuple(sorted(cell_ctx.items())))
+    if key in done:
+        return done[key]
+
+    caps = _CellCaps(cell.ports)
+    for net in cell.all_nets():
+        caps.nets[net.name] = [0, 0, 0, 0]
+        if net.is_global and net.name not in caps.ports:
+            caps.globals.add(net.name)
+
+    for inst in cell.all_instances():
+        inst_ctx = inst._build_ctx(cell_ctx)
+
+        if inst.is_hierarchical:
+            if not inst.is_linked:
+                raise core.LinkError("can't characterize %r before it's "
+                                     "linked" % inst)
+            child = _characterize_caps(inst.ref, inst.ref._build_ctx(inst_ctx),
+                                       done, cache, memo)
+            for pin in inst.all_pins():
+                acc = caps.nets[pin.net.name]
+                for i, value in enumerate(child.nets[pin.port.name]):
+                    acc[i] += value
+            # global nets are shared with the child, like ports
+            for netname in child.globals:
+                if netname in caps.ports:
+                    acc = caps.nets[netname]
+                else:
+                    acc = caps.nets.setdefault(netname, [0, 0, 0, 0])
+                    caps.globals.add(netname)
+                for i, value in enumerate(child.nets[netname]):
+                    acc[i] += value
+            caps.children.append((inst.name, child))
+            continue
+
+        for pin in inst.all_pins():
+            acc = caps.nets[pin.net.name]
+            if pin.port.name in ('s', 'd'):
+                field, param = 2, 'cg'
+            elif pin.port.name == 'g':
+                field, param = 1, 'cg'
+            elif inst.refname == 'c':
+                field, param = 0, 'c'
+            else:
+                acc[3] += 1
+                continue
+            acc[field] += cache.eval(inst, param, inst_ctx)
+            acc[3] += 1
+
+    done[key] = caps
+    return caps
+
+def _iter_internal_caps(caps, prefix, sep):
+    for netname, (cwire, cload, cdriver, npins) in caps.nets.items():
+        if netname in caps.ports or netname in caps.globals or not npins:
+            continue
+        yield prefix + netname, cwire, cload, cdriver
+    for instname, child in caps.children:
+        for row in _iter_internal_caps(child, prefix + instname + sep, sep):
+            yield row
+
+#-------------------------------------------------------------------------------
+def report_net(cell, lib, netlists, hierarchical=False, vectorized=False,
+               jobs=1, partitions=None, incremental=None, top=None,
+               stream=False, cache=None, supplies=None,
+               summarize_supplies=False, format=None, f=None):
+    """ Print net caps and fanouts of a cell
+
+    If hierarchical is True, the caps are computed from the cell hierarchy
+    (see hier_net_caps), otherwise the cell must already be flat and
+    vectorized selects vector_net_caps (numpy) over net_caps. jobs > 1 uses
+    parallel_net_caps with that many processes, and incremental (an
+    IncrementalNetCaps of cell) reports its current caps without recomputing
+    them. partitions are passed on to parallel_net_caps (e.g. from
+    ccc_partitions). cache is an optional RefParamCache, which can be inspected
+    afterwards for its hit rate.
+
+    If parasitics were read for the cell (see Ckt.read_dspf/read_spef),
+    their total net caps are used for cwire, for the nets they cover.
+
+    supplies (SupplyNets) leaves the supply nets out of the report, which
+    is only supported with flat net_caps (serial or parallel). With
+    summarize_supplies, their pin counts are printed after the report (to
+    stderr with format, so that the rows can still be parsed).
+
+    By default all the nets are sorted by fanout. top=N only keeps the N
+    nets with the highest fanout (using a bounded heap), and stream=True
+    prints the nets unsorted as soon as they are computed.
+
+    format selects one of the OUTPUT_FORMATS instead of the printed report.
+    The rows (see NET_FIELDS, caps in fF) are then written to f (stdout by
+    default) without the report header.
+    """
+    if top is not None and stream:
+        raise ValueError("top and stream are mutually exclusive")
+
+    if supplies is not None and (incremental is not None or hierarchical or
+                                 vectorized):
+        raise ValueError("supplies are only supported by flat net_caps")
+
+    summary = collections.OrderedDict() if summarize_supplies else None
+    if cache is None:
+        cache = RefParamCache()
+    if incremental is not None:
+        rows = incremental.rows()
+    elif hierarchical:
+        rows = hier_net_caps(cell, cache=cache)
+    elif vectorized:
+        rows = vector_net_caps(cell)
+    elif jobs > 1:
+        rows = parallel_net_caps(cell, jobs, partitions, supplies=supplies,
+                                 summary=summary)
+    else:
+        rows = net_caps(cell, cache=cache, supplies=supplies,
+                        summary=summary)
+
+    if cell.parasitics is not None:
+        wire_caps = cell.parasitics.caps
+        rows = ((netname, wire_caps.get(netname, net_cap), load_cap,
+                 driver_cap)
+                for netname, net_cap, load_cap, driver_cap in rows)
+
+    rows = ((netname, net_cap, load_cap, driver_cap,
+             fanout(net_cap, load_cap, driver_cap))
+            for netname, net_cap, load_cap, driver_cap in rows)
+
+    if format is not None:
+        rows = ((netname, net_cap*1e15, load_cap*1e15, driver_cap*1e15, fo)
+                for netname, net_cap, load_cap, driver_cap, fo in rows)
+        if top is not None:
+            rows = heapq.nlargest(top, rows, key=lambda row: row[4])
+        elif not stream:
+            rows = sorted(rows, key=lambda row: row[4], reverse=True)
+        write_rows(f or sys.stdout, format, NET_FIELDS, rows)
+        _print_supply_summary(summary, sys.stderr)
+        return
 
     if isinstance(cell, Ckt) and not cell.name:
         cell_name = '$root'
     else:
         cell_name = cell.name
 
+    if stream:
+        sortby = "-sortby=None"
+    elif top is not None:
+        sortby = "-sortby=fanout, reversesort=True, top=%d" % top
+    else:
+        sortby = "-sortby=fanout, reversesort=True"
+
     print(
 """****************************************
 Report : net
         -capacitance=True
         -fanout=True
-        -sortby=fanout, reversesort=True
+        %s
 Cell   : %s
 Date   : %s
 ****************************************
@@ -46,11 +848,20 @@ Fields:
 - cdriver : driver (src/drain connected transistors) capacitance (fF)
 - fanout  : fanout of the driver = cout/cin = (cwire + cload)/cdriver
 """
-    % (cell_name, datetime.datetime.now().strftime("%I:%m%p %B %d, %Y"),
+    % (sortby, cell_name,
+       datetime.datetime.now().strftime("%I:%m%p %B %d, %Y"),
        lib, "\n          ".join(netlists)))
 
-
     header = "net cwire cload cdriver fanout".split()
+
+    if stream:
+        _stream_net_rows(header, rows)
+        _print_supply_summary(summary)
+        return
+
+    if top is not None:
+        rows = heapq.nlargest(top, rows, key=lambda row: row[4])
+
     report = prettytable.PrettyTable(header)
 
     report.vrules = prettytable.NONE
@@ -58,47 +869,119 @@ Fields:
     report.align['net'] = 'l'
     report.float_format = '1.1'
 
-    for netname, info in net_info.items():
-        drivers = info['drivers']
-        loads   = info['loads']
-        caps    = info['caps']
+    for netname, net_cap, load_cap, driver_cap, fo in rows:
+        report.add_row([netname, net_cap*1e15, load_cap*1e15, driver_cap*1e15,
+                        fo])
 
-        _debug('net: %s' % netname)
+    if top is not None:
+        # already sorted by the heap
+        rpt = report.get_string()
+    else:
+        rpt = report.get_string(sortby='fanout', reversesort=True)
+    print(rpt)
+    _print_supply_summary(summary)
 
-        net_cap = 0
-        driver_cap = 0
-        load_cap = 0
+def _print_supply_summary(summary, f=None):
+    if not summary:
+        return
+    report = prettytable.PrettyTable("net drivers loads caps".split())
+    report.vrules = prettytable.NONE
+    report.align = 'r'
+    report.align['net'] = 'l'
+    for netname, counts in summary.items():
+        report.add_row([netname] + counts)
+    print("\nSupply nets (pin counts, caps not computed):", file=f)
+    print(report.get_string(), file=f)
 
-        for i in caps:
-            _debug('> cap %s %s' % (i.eval_ref_param('c'), i))
-            net_cap += i.eval_ref_param('c')
+def _stream_net_rows(header, rows, width=24):
+    # fixed-width columns, as the widths can't be known before the last row
+    rule = '-' * (width + 4 + 10 * 4)
+    print(rule)
+    print("  %-*s %9s %9s %9s %9s" % ((width,) + tuple(header)))
+    print(rule)
+    for netname, net_cap, load_cap, driver_cap, fo in rows:
+        print("  %-*s %9.1f %9.1f %9.1f %9.1f" %
+              (width, netname, net_cap*1e15, load_cap*1e15, driver_cap*1e15,
+               fo))
+    print(rule)
 
-        for i in drivers:
-            _debug('> %s driver %s' % (i.eval_ref_param('cg'), i))
-            cg = i.eval_ref_param('cg')
-            driver_cap += cg
+def fanout(net_cap, load_cap, driver_cap):
+    if driver_cap == 0.0:
+        return 0.0
+    return (net_cap + load_cap)/driver_cap
 
-        for i in loads:
-            _debug('> %s load %s' % (i.eval_ref_param('cg'), i))
-            cg = i.eval_ref_param('cg')
-            load_cap += cg
+#-------------------------------------------------------------------------------
+OUTPUT_FORMATS = ('csv', 'jsonl', 'npz')
 
-        if driver_cap == 0.0:
-            fanout = 0.0
-        else:
-            fanout = (net_cap + load_cap)/driver_cap
+NET_FIELDS = ('net', 'cwire', 'cload', 'cdriver', 'fanout')
+HIERARCHY_FIELDS = ('instance', 'ref', 'level')
 
-        report.add_row([netname, net_cap*1e15, load_cap*1e15, driver_cap*1e15, fanout])
+def write_rows(f, format, fields, rows, chunk_size=10000):
+    """ Write rows (tuples of fields) to the file object f
 
-    rpt = report.get_string(sortby='fanout', reversesort=True)
-    print(rpt)
+    format is one of OUTPUT_FORMATS:
+    - csv   : a header line with the fields, then one line per row
+    - jsonl : one JSON object per row
+    - npz   : numpy .npz archive with one array per field (requires numpy)
+
+    Text formats are written in chunks of chunk_size rows.
+    """
+    if format == 'csv':
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(fields)
+        for chunk in _chunks(rows, chunk_size):
+            writer.writerows(chunk)
+    elif format == 'jsonl':
+        for chunk in _chunks(rows, chunk_size):
+            f.write(''.join(json.dumps(collections.OrderedDict(zip(fields,
+                                                                   row)))
+                            + '\n' for row in chunk))
+    elif format == 'npz':
+        if numpy is None:
+            raise ImportError("npz output requires numpy")
+        columns = [[] for _ in fields]
+        for row in rows:
+            for column, value in zip(columns, row):
+                column.append(value)
+        numpy.savez(f, **dict((field, numpy.array(column))
+                              for field, column in zip(fields, columns)))
+    else:
+        raise ValueError("unknown output format '%s'" % format)
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
 
 #-------------------------------------------------------------------------------
-def report_hierarchy(cell):
+def report_hierarchy(cell, format=None, f=None):
+    """ Print the instance tree of a cell
+
+    format selects one of the OUTPUT_FORMATS instead, in which case the
+    hierarchy_rows() (see HIERARCHY_FIELDS) are written to f (stdout by
+    default).
+    """
+    if format is not None:
+        write_rows(f or sys.stdout, format, HIERARCHY_FIELDS,
+                   hierarchy_rows(cell))
+        return
+
     print("Hierarchy report for cell: %s" % cell.name)
     print(cell.name)
     _print_cell_hierarchy(cell, 0) 
 
+def hierarchy_rows(cell, sep='/', prefix='', level=0):
+    """ Generate (instance path, ref name, level) for the instance tree """
+    for inst in cell.all_instances():
+        yield prefix + inst.name, inst.refname, level
+        if inst.is_hierarchical:
+            for row in hierarchy_rows(inst.ref, sep, prefix + inst.name + sep,
+                                      level + 1):
+                yield row
+
 def _print_cell_hierarchy(cell, indent):
     for inst in cell.all_instances():
         print("%s|-- %s (%s)" % (' ' * 4  * indent, inst.name, inst.refname))
@@ -107,6 +990,586 @@ def _print_cell_hierarchy(cell, indent):
             print()
 
 #-------------------------------------------------------------------------------
-def _debug(msg):
-    if False:
-        print("DBG", msg)
+class HierarchyStats(object):
+    """ Device and instance counts of a cell, computed without flattening
+
+    - devices     : {cell: Counter(prim name: count)}, the leaf devices of one
+                    placement of each cell in the subtree of top, weighted by m
+    - occurrences : {cell: number of placements of the cell under top}
+
+    Each cell is evaluated once, with its default parameters, as a bottom-up
+    pass over the cell hierarchy graph. m is therefore taken from the default
+    context of the instantiating cell.
+    """
+
+    def __init__(self, top):
+        self.top = top
+        self.devices = collections.OrderedDict()
+        self.occurrences = collections.OrderedDict()
+        self._build()
+
+    def _build(self):
+        hier = _hierarchy(self.top)
+
+        for cell in hier.reverse_topological_order(self.top):
+            devices = collections.Counter()
+            for inst in cell.all_instances():
+                if inst.ref is None:
+                    continue
+                if isinstance(inst.ref, core.Prim):
+                    devices[inst.ref.name] += _inst_m(inst, ref=True)
+                else:
+                    m = _inst_m(inst, ref=False)
+                    for prim, count in self.devices[inst.ref].items():
+                        devices[prim] += count * m
+            self.devices[cell] = devices
+
+        for cell in hier.topological_order(self.top):
+            self.occurrences.setdefault(cell, 1 if cell is self.top else 0)
+            for child, count in hier.children(cell).items():
+                self.occurrences[child] = (self.occurrences.get(child, 0) +
+                                           self.occurrences[cell] * count)
+
+    def totals(self):
+        """ Expanded leaf device counts of top: Counter(prim name: count) """
+        return self.devices[self.top]
+
+def _hierarchy(cell):
+    root = cell.root()
+    if isinstance(root, Ckt):
+        return root.hierarchy()
+    return core.Hierarchy(root)
+
+def _inst_m(inst, ref):
+    try:
+        if ref:
+            return inst.eval_ref_param('m')
+        return inst.eval_param('m')
+    except core.CktObjDoesNotExist:
+        return 1
+
+def report_hierarchy_summary(cell):
+    stats = HierarchyStats(cell)
+    depths = _hierarchy(cell).depths(cell)
+
+    print("Hierarchy summary for cell: %s" % cell.name)
+
+    report = prettytable.PrettyTable("cell depth placements devices".split())
+    report.vrules = prettytable.NONE
+    report.align = 'r'
+    report.align['cell'] = 'l'
+    for c in stats.devices:
+        report.add_row([c.full_name(), depths[c],
+                        stats.occurrences[c], sum(stats.devices[c].values())])
+    print(report.get_string(sortby='depth'))
+
+    report = prettytable.PrettyTable("prim count".split())
+    report.vrules = prettytable.NONE
+    report.align = 'r'
+    report.align['prim'] = 'l'
+    for prim, count in sorted(stats.totals().items()):
+        report.add_row([prim, count])
+    print(report)
+
+#-------------------------------------------------------------------------------
+LIBRARY_FIELDS = ('cell',) + NET_FIELDS
+
+def characterize_cells(ckt, pattern='.*', jobs=1, cache=None):
+    """ Compute the flat net caps of every root cell whose name matches the
+    regex pattern, and return {cell name: [(net, cwire, cload, cdriver)]}.
+
+    Each cell is flattened into a copy (Cell.flattened), so the database is
+    left unchanged, and with jobs > 1 the cells are processed by a pool of
+    processes. Results are cached per Cell.struct_hash in cache (a dict,
+    which can be kept across runs), so identical cells are characterized
+    once.
+    """
+    if cache is None:
+        cache = {}
+
+    re_name = re.compile(r'^(?:%s)$' % pattern)
+    cells = [cell for cell in ckt.all_cells() if re_name.match(cell.name)]
+
+    memo = {}
+    hashes = collections.OrderedDict((cell.name, cell.struct_hash(memo))
+                                     for cell in cells)
+
+    todo = collections.OrderedDict()
+    for cellname, digest in hashes.items():
+        if digest not in cache:
+            todo.setdefault(digest, cellname)
+
+    if jobs > 1 and len(todo) > 1:
+        pool = _fork_pool(jobs, ckt=ckt)
+        try:
+            results = pool.map(_characterize_cell, todo.values())
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = [_characterize_cell(cellname, ckt)
+                   for cellname in todo.values()]
+
+    for digest, rows in zip(todo, results):
+        cache[digest] = rows
+
+    return collections.OrderedDict((cellname, cache[digest])
+                                   for cellname, digest in hashes.items())
+
+def _characterize_cell(cellname, ckt=None):
+    if ckt is None:
+        ckt = _shared['ckt']
+    flat = ckt.get_cell(cellname).flattened()
+    return list(net_caps(flat))
+
+def library_rows(results):
+    """ Generate rows of LIBRARY_FIELDS (caps in fF) from characterize_cells()
+    results, sorted by fanout within each cell
+    """
+    for cellname, rows in results.items():
+        rows = [(netname, cwire, cload, cdriver,
+                 fanout(cwire, cload, cdriver))
+                for netname, cwire, cload, cdriver in rows]
+        rows.sort(key=lambda row: row[4], reverse=True)
+        for netname, cwire, cload, cdriver, fo in rows:
+            yield cellname, netname, cwire*1e15, cload*1e15, cdriver*1e15, fo
+
+#-------------------------------------------------------------------------------
+class NetGraph(object):
+    """ Indexed device connectivity of a flat cell
+
+    Nets and devices are numbered, and pins are classified with the same rule
+    as report_net: s/d pins are channel (driver) connections, g pins are gate
+    (load) connections. Other pins (caps, bulk) are not part of the graph.
+
+    - netnames     : [net name] by net index
+    - devices      : [instance] by device index
+    - net_gates    : [[device index]] of devices gated by each net
+    - net_channels : [[device index]] of devices with s/d on each net
+    - dev_gates    : [[net index]] of the g pins of each device
+    - dev_channels : [[net index]] of the s/d pins of each device
+    """
+
+    def __init__(self, cell):
+        self.cell = cell
+        self.netnames = list(cell.nets)
+        self.net_index = dict((name, i) for i, name in
+                              enumerate(self.netnames))
+        self.devices = []
+        self.net_gates = [[] for _ in self.netnames]
+        self.net_channels = [[] for _ in self.netnames]
+        self.dev_gates = []
+        self.dev_channels = []
+
+        for inst in cell.all_instances():
+            gates = []
+            channels = []
+            for pin in inst.all_pins():
+                if pin.port.name in ('s', 'd'):
+                    channels.append(self.net_index[pin.net.name])
+                elif pin.port.name == 'g':
+                    gates.append(self.net_index[pin.net.name])
+            if not gates and not channels:
+                continue
+            dev = len(self.devices)
+            self.devices.append(inst)
+            self.dev_gates.append(gates)
+            self.dev_channels.append(channels)
+            for net in gates:
+                self.net_gates[net].append(dev)
+            for net in set(channels):
+                self.net_channels[net].append(dev)
+
+    def stop_nets(self, names=(), pattern=SUPPLY_NET_PATTERN):
+        """ bytearray flagging the nets in names or matching pattern """
+        stop = bytearray(len(self.netnames))
+        for name in names:
+            stop[self.net_index[name]] = 1
+        if pattern:
+            re_name = re.compile(pattern)
+            for i, name in enumerate(self.netnames):
+                if re_name.match(name):
+                    stop[i] = 1
+        return stop
+
+    def fanout(self, netname, depth=None, stop=None, channels=False):
+        """ Trace the fanout cone of a net: through the devices it gates to
+        their s/d nets, and so on. Returns a Cone.
+
+        By default a net only reaches further through the gates it drives,
+        so a cone stops at the pass transistors (transmission gates) whose
+        s/d it is on. With channels, the trace also goes from s/d to s/d
+        through such devices, which also enters the internal nodes of the
+        stacks the net is driven by.
+
+        - depth    : maximum number of device stages (no limit if None)
+        - stop     : bytearray of nets that are neither entered nor traced
+                     through (see stop_nets); the supply nets by default
+        - channels : also trace through the s/d channels
+        """
+        if channels:
+            net_devs = (self.net_gates, self.net_channels)
+        else:
+            net_devs = (self.net_gates,)
+        return self._trace(netname, depth, stop, net_devs,
+                           (self.dev_channels,))
+
+    def fanin(self, netname, depth=None, stop=None):
+        """ Trace the fanin cone of a net: through the devices with s/d on
+        it to their gate nets and their other s/d nets, and so on. Returns
+        a Cone; depth and stop are the same as for fanout().
+        """
+        return self._trace(netname, depth, stop, (self.net_channels,),
+                           (self.dev_gates, self.dev_channels))
+
+    def _trace(self, netname, depth, stop, net_devs, dev_nets):
+        if stop is None:
+            stop = self.stop_nets()
+        start = self.net_index[netname]
+
+        net_seen = bytearray(len(self.netnames))
+        dev_seen = bytearray(len(self.devices))
+        cone = Cone()
+
+        net_seen[start] = 1
+        cone.nets[netname] = 0
+        frontier = [start]
+        level = 0
+        while frontier and (depth is None or level < depth):
+            level += 1
+            next_frontier = []
+            for net in frontier:
+                for dev in itertools.chain(*[devs[net] for devs in net_devs]):
+                    if dev_seen[dev]:
+                        continue
+                    dev_seen[dev] = 1
+                    cone.devices[self.devices[dev].name] = level
+                    for nets in dev_nets:
+                        for next_net in nets[dev]:
+                            if net_seen[next_net] or stop[next_net]:
+                                continue
+                            net_seen[next_net] = 1
+                            cone.nets[self.netnames[next_net]] = level
+                            next_frontier.append(next_net)
+            frontier = next_frontier
+        return cone
+
+    def components(self, stop=None):
+        """ Channel-connected components (CCCs): the devices joined through
+        their s/d nets, except through the stop nets (supply nets by
+        default, see stop_nets). Devices with no s/d on a non-stop net are
+        components of their own. Returns a list of Component, in the order
+        of their first device.
+        """
+        if stop is None:
+            stop = self.stop_nets()
+
+        parent = list(range(len(self.netnames)))
+        dev_nets = []
+        for channels in self.dev_channels:
+            nets = [net for net in channels if not stop[net]]
+            for net in nets[1:]:
+                _union(parent, nets[0], net)
+            dev_nets.append(nets)
+
+        comps = []
+        comp_nets = []
+        comp_of_root = {}
+        for dev, nets in enumerate(dev_nets):
+            if nets:
+                root = _find(parent, nets[0])
+            else:
+                root = -1 - dev
+            i = comp_of_root.get(root)
+            if i is None:
+                i = comp_of_root[root] = len(comps)
+                comps.append([])
+                comp_nets.append(set())
+            comps[i].append(dev)
+            comp_nets[i].update(nets)
+
+        ports = set(self.cell.ports)
+        components = []
+        for devs, nets in zip(comps, comp_nets):
+            comp = Component()
+            comp.devices = [self.devices[dev].name for dev in devs]
+            comp.nets = [self.netnames[net] for net in sorted(nets)]
+            gates = set(net for dev in devs for net in self.dev_gates[dev]
+                        if not stop[net])
+            comp.inputs = [self.netnames[net] for net in sorted(gates)]
+            comp.outputs = [self.netnames[net] for net in sorted(nets)
+                            if self.net_gates[net] or
+                               self.netnames[net] in ports]
+            components.append(comp)
+        return components
+
+class Component(object):
+    """ Channel-connected component of a NetGraph
+
+    - devices : instance names
+    - nets    : s/d nets (stop nets excluded)
+    - inputs  : gate nets (stop nets excluded)
+    - outputs : nets that gate other devices or are ports of the cell
+    """
+
+    def __init__(self):
+        self.devices = []
+        self.nets = []
+        self.inputs = []
+        self.outputs = []
+
+    def __repr__(self):
+        return "<%s(devices=%d, inputs=%r, outputs=%r)>" % (
+            self.__class__.__name__, len(self.devices), self.inputs,
+            self.outputs)
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def _union(parent, i, j):
+    i = _find(parent, i)
+    j = _find(parent, j)
+    if i != j:
+        parent[max(i, j)] = min(i, j)
+
+def ccc_partitions(cell, jobs, stop=None):
+    """ Net partitions of a flat cell for parallel_net_caps, made of whole
+    channel-connected components
+
+    The components are packed, in order, into about 4 partitions per job of
+    similar device counts. The nets not in any component (only gating,
+    supply or passive nets) are spread over the partitions afterwards, so
+    that every net of cell is in exactly one partition.
+    """
+    graph = NetGraph(cell)
+    components = graph.components(stop)
+
+    size = max(1, -(-len(graph.devices) // (jobs * 4)))
+    partitions = []
+    netnames = []
+    count = 0
+    for comp in components:
+        netnames.extend(comp.nets)
+        count += len(comp.devices)
+        if count >= size:
+            partitions.append(netnames)
+            netnames = []
+            count = 0
+    if netnames:
+        partitions.append(netnames)
+
+    done = set(name for partition in partitions for name in partition)
+    rest = [name for name in graph.netnames if name not in done]
+    if not partitions:
+        partitions.append([])
+    for i, name in enumerate(rest):
+        partitions[i % len(partitions)].append(name)
+    return partitions
+
+class Cone(object):
+    """ Result of a NetGraph trace
+
+    - nets    : OrderedDict(net name: depth), in the order they were reached
+    - devices : OrderedDict(instance name: depth)
+    """
+
+    def __init__(self):
+        self.nets = collections.OrderedDict()
+        self.devices = collections.OrderedDict()
+
+    def __repr__(self):
+        return "<%s(nets=%d, devices=%d)>" % (self.__class__.__name__,
+                                              len(self.nets),
+                                              len(self.devices))
+
+#-------------------------------------------------------------------------------
+def diff_ckts(old, new):
+    """ Generate the differences between two Ckt databases as dicts
+
+    Cells are matched by full name. Cells whose struct_hash is the same in
+    both are skipped without further comparison; the others are compared
+    instance by instance. Each difference is a dict with 'cell' and
+    'change' keys, 'instance' for instance level changes, and 'old'/'new'
+    values:
+
+    - cell_added, cell_removed
+    - ports, param (with 'param'), param_added, param_removed
+    - instance_added, instance_removed
+    - ref, pins (as [port, net] lists), and param/param_added/param_removed
+      with an 'instance'
+
+    Prims (macromodels), matched by full name too, come first, with a
+    'prim' key instead of 'cell': prim_added, prim_removed, type, ports
+    and param/param_added/param_removed.
+    """
+    for diff in _diff_prims(old, new):
+        yield diff
+
+    old_cells = _all_cells(old)
+    new_cells = _all_cells(new)
+    old_memo = {}
+    new_memo = {}
+
+    for name, cell in old_cells.items():
+        if name not in new_cells:
+            yield dict(cell=name, change='cell_removed')
+
+    for name, new_cell in new_cells.items():
+        old_cell = old_cells.get(name)
+        if old_cell is None:
+            yield dict(cell=name, change='cell_added')
+            continue
+        if old_cell.struct_hash(old_memo) == new_cell.struct_hash(new_memo):
+            continue
+        for diff in _diff_cell(name, old_cell, new_cell):
+            yield diff
+
+def _all_cells(ckt, prims=False):
+    cells = collections.OrderedDict()
+    scopes = [ckt]
+    while scopes:
+        scope = scopes.pop()
+        for cell in (scope.all_prims() if prims else scope.all_cells()):
+            cells[cell.full_name()] = cell
+        scopes.extend(reversed(scope.cells.values()))
+    return cells
+
+def _diff_prims(old, new):
+    # a prim change does not show in the cells that use it, other than
+    # through their struct_hash
+    old_prims = _all_cells(old, prims=True)
+    new_prims = _all_cells(new, prims=True)
+
+    for name in old_prims:
+        if name not in new_prims:
+            yield dict(prim=name, change='prim_removed')
+
+    for name, new_prim in new_prims.items():
+        old_prim = old_prims.get(name)
+        if old_prim is None:
+            yield dict(prim=name, change='prim_added')
+            continue
+        if old_prim.type != new_prim.type:
+            yield dict(prim=name, change='type', old=old_prim.type,
+                       new=new_prim.type)
+        if list(old_prim.ports) != list(new_prim.ports):
+            yield dict(prim=name, change='ports', old=list(old_prim.ports),
+                       new=list(new_prim.ports))
+        for diff in _diff_params(old_prim.params, new_prim.params):
+            diff['prim'] = name
+            yield diff
+
+def _diff_cell(name, old, new):
+    if list(old.ports) != list(new.ports):
+        yield dict(cell=name, change='ports', old=list(old.ports),
+                   new=list(new.ports))
+
+    for diff in _diff_params(old.params, new.params):
+        diff['cell'] = name
+        yield diff
+
+    for instname, inst in old.instances.items():
+        if instname not in new.instances:
+            yield dict(cell=name, change='instance_removed',
+                       instance=instname)
+
+    for instname, new_inst in new.instances.items():
+        old_inst = old.instances.get(instname)
+        if old_inst is None:
+            yield dict(cell=name, change='instance_added', instance=instname,
+                       new=new_inst.refname)
+            continue
+        if old_inst.refname != new_inst.refname:
+            yield dict(cell=name, change='ref', instance=instname,
+                       old=old_inst.refname, new=new_inst.refname)
+        old_pins = [[pin.port.name, pin.net.name]
+                    for pin in old_inst.all_pins()]
+        new_pins = [[pin.port.name, pin.net.name]
+                    for pin in new_inst.all_pins()]
+        if old_pins != new_pins:
+            yield dict(cell=name, change='pins', instance=instname,
+                       old=old_pins, new=new_pins)
+        for diff in _diff_params(old_inst.params, new_inst.params):
+            diff['cell'] = name
+            diff['instance'] = instname
+            yield diff
+
+def _diff_params(old, new):
+    for pname, param in old.items():
+        if pname not in new:
+            yield dict(change='param_removed', param=pname, old=param.value)
+    for pname, param in new.items():
+        if pname not in old:
+            yield dict(change='param_added', param=pname, new=param.value)
+        elif (core.normalize_value(old[pname].value) !=
+              core.normalize_value(param.value)):
+            yield dict(change='param', param=pname, old=old[pname].value,
+                       new=param.value)
+
+def write_diffs(f, diffs, chunk_size=10000):
+    """ Write diff_ckts() dicts to f as JSON Lines """
+    for chunk in _chunks(diffs, chunk_size):
+        f.write(''.join(json.dumps(diff, sort_keys=True) + '\n'
+                        for diff in chunk))
+
+#-------------------------------------------------------------------------------
+# name: (report function, whether it needs the flattened cell)
+REPORTS = collections.OrderedDict([
+    ('net',       (lambda cell, lib, netlists:
+                       report_net(cell, lib, netlists), True)),
+    ('hierarchy', (lambda cell, lib, netlists:
+                       report_hierarchy(cell), False)),
+    ('summary',   (lambda cell, lib, netlists:
+                       report_hierarchy_summary(cell), False)),
+])
+
+def run_reports(ckt, reports, lib='', netlists=()):
+    """ Run a batch of reports against one linked Ckt
+
+    - reports : list of (report name, cell name) with names from REPORTS;
+                a cell name of None selects the (first) top cell
+
+    Reports needing a flat cell get a flattened copy of it (Cell.flattened),
+    made once per cell structure (Cell.struct_hash) and only if such a
+    report is requested, so the database itself is never modified.
+    """
+    flat_cells = {}
+    memo = {}
+    for name, cellname in reports:
+        try:
+            report, needs_flat = REPORTS[name]
+        except KeyError:
+            raise ValueError("unknown report '%s'" % name)
+
+        cell = _select_cell(ckt, cellname)
+        if needs_flat:
+            digest = cell.struct_hash(memo)
+            if digest not in flat_cells:
+                flat_cells[digest] = cell.flattened()
+            flat = flat_cells[digest]
+            if flat.name != cell.name:
+                # same structure under another name
+                flat = copy.copy(flat)
+                flat.name = cell.name
+            cell = flat
+        report(cell, lib, list(netlists))
+
+def _select_cell(ckt, cellname=None):
+    if cellname:
+        return ckt.get_cell(cellname)
+    topcells = ckt.get_topcells()
+    if topcells:
+        return topcells[0]
+    return ckt
+
+#-------------------------------------------------------------------------------
+DEBUG = False
+
+def _debug(msg, *args):
+    # args are only formatted into msg when debugging is enabled
+    if DEBUG:
+        print("DBG", msg % args)
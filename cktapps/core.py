@@ -8,9 +8,12 @@ as well as modified through the core API interface.
 #-------------------------------------------------------------------------------
 from __future__ import absolute_import
 from __future__ import print_function
-import collections, copy, re
+import collections, copy, hashlib, re, sys
 
+from cktapps.formats import dspf
+from cktapps.formats import spef
 from cktapps.formats import spice
+from cktapps.formats import verilog
 
 #-------------------------------------------------------------------------------
 class InternalError(Exception): pass
@@ -172,9 +175,47 @@ class Net(object):
     def __init__(self, name, owner):
         self.name = name
         self.owner = owner
+        # global nets are shared by all the cells (see Ckt.add_global)
+        self.is_global = False
     def __repr__(self):
         return "Net(%s)" % self.name
 
+# Resistors are kept in this compact form, on the cell, rather than as
+# instances: parasitic netlists have many more of them than devices.
+# - p, n  : net names
+# - value : resistance as written, with any spice suffix evaluated (see
+#           spice.eval_spice_number)
+Resistor = collections.namedtuple('Resistor', 'name p n value')
+
+# Element of the RC detail of a net in Parasitics
+# - type  : 'r' or 'c'
+# - p, n  : node names ('0' for ground)
+# - value : ohms or F
+RCElement = collections.namedtuple('RCElement', 'type name p n value')
+
+class Parasitics(object):
+    """ Extracted parasitics of the nets of a cell (see Ckt.read_dspf and
+    Ckt.read_spef), by flattened net name
+
+    - caps    : OrderedDict(net name: total cap in F)
+    - details : {net name: [RCElement]}, only if read with detail
+    """
+
+    def __init__(self):
+        self.caps = collections.OrderedDict()
+        self.details = {}
+
+    def add_net(self, name, cap):
+        self.caps[name] = cap
+
+    def add_element(self, netname, type, name, p, n, value):
+        element = RCElement(type, name, p, n, value)
+        self.details.setdefault(netname, []).append(element)
+        return element
+
+    def __repr__(self):
+        return "<%s(nets=%d)>" % (self.__class__.__name__, len(self.caps))
+
 class Param(object):
     def __init__(self, name, value):
         self.name = name
@@ -205,6 +246,7 @@ class Instance(object):
         self._ctx = None
         #self._owner_ctx = None
         self._ref_ctx = None
+        self._cell_ctx = None
 
         self.is_hierarchical = False
         self.is_linked = False
@@ -220,7 +262,10 @@ class Instance(object):
         # unique (de-contextualized) copy
         cpy = copy.copy(self)
         cpy.name = name
+        # own params, so that editing the copy leaves self unchanged
+        cpy.params = collections.OrderedDict(self.params)
         if not cpy._ctx:
+            cpy._cell_ctx = ctx
             cpy._ctx = cpy._build_ctx(ctx)
         if not cpy._ref_ctx:
             cpy._ref_ctx = cpy.ref._build_ctx(cpy._ctx)
@@ -233,6 +278,8 @@ class Instance(object):
         port = Port(name, owner=None)
         pin = Pin(port=port, instance=self, net=net)
         self.pins.append(pin)
+        if self.owner is not None:
+            self.owner._notify('add_pin', pin)
         return pin
 
     def add_pin_obj(self, pin):
@@ -240,6 +287,8 @@ class Instance(object):
             raise CktObjTypeError("can't add '%r' to '%r'" % (pin, self))
         pin.instance = self
         self.pins.append(pin)
+        if self.owner is not None:
+            self.owner._notify('add_pin', pin)
         return pin
 
     def all_pins(self):
@@ -257,6 +306,12 @@ class Instance(object):
             raise CktObjValueError("param has no name")
         param = Param(name, value)
         self.params[name] = param
+        if self._ctx is not None:
+            # re-evaluate in the context the (flattened) copy was made in
+            self._ctx = self._build_ctx(self._cell_ctx or {})
+            self._ref_ctx = None
+        if self.owner is not None:
+            self.owner._notify('set_param', self)
         return param
 
     def all_params(self):
@@ -346,6 +401,7 @@ class Instance(object):
 
         ref._ref_count += 1
         self.ref = ref
+        self.owner._invalidate_hierarchy()
 
 
     def _bind(self):
@@ -354,6 +410,10 @@ class Instance(object):
         inst_pins = self.pins
         ref_ports = self.ref.ports.values()
 
+        if inst_pins and inst_pins[0].port.name is not None:
+            self._bind_by_name()
+            return
+
         if len(inst_pins) != len(ref_ports):
             raise LinkError("port count mismatch\n"
                             "> cell %s : %s\n"
@@ -366,6 +426,33 @@ class Instance(object):
         for pin, port in zip(inst_pins, ref_ports):
                 pin.port = port
 
+    def _bind_by_name(self):
+        # pins named after a bus port (e.g. 'd' for 'd[3]', 'd[2]', ...)
+        # take its bits in order; unconnected ports are allowed
+        ref_ports = self.ref.ports
+        bits = {}
+        for port in ref_ports.itervalues():
+            base = port.name.split('[', 1)[0]
+            if base != port.name:
+                bits.setdefault(base, collections.deque()).append(port)
+
+        bound = {}
+        for pin in self.pins:
+            name = pin.port.name
+            port = ref_ports.get(name)
+            if port is None and bits.get(name):
+                port = bits[name].popleft()
+            if port is None or port.name in bound:
+                raise LinkError("can't bind pin '%s' of '%s' to a port of "
+                                "cell %s" % (name, self.owner.full_name() +
+                                             "/" + self.name,
+                                             self.ref.full_name()))
+            pin.port = port
+            bound[port.name] = pin
+
+        order = dict((name, pos) for pos, name in enumerate(ref_ports))
+        self.pins.sort(key=lambda pin: order[pin.port.name])
+
 
     #---------------------------------------------------------------------------
     def ungroup(self, owner, flatten=False, prefix='', sep='/', ctx=None):
@@ -398,22 +485,32 @@ class Instance(object):
         for pin in self.all_pins():
             pinmap[pin.port.name] = pin
 
+        def map_net(net):
+            if net.name in pinmap:
+                return pinmap[net.name].net
+            elif net.is_global:
+                return owner.nets.setdefault(net.name, net)
+            else:
+                #return self.owner.get_net_else_add(presep + net.name)
+                return owner.get_net_else_add(presep + net.name)
+
         for inst in list(uniq_ref.all_instances()):
             uniq_inst = inst._uniq(name=presep + inst.name, ctx=ref_ctx)
             # TODO: maybe inst._uniq should be doing the below stuff as well
             # In other words, is there any point in just doing a copy and not
             # updating the owner and pinmap.       
             #self.owner.add_instance_obj(uniq_inst)
-            owner.add_instance_obj(uniq_inst)
             uniq_inst.pins = []
+            owner.add_instance_obj(uniq_inst)
             for pin in inst.all_pins():
-                if pin.net.name in pinmap:
-                    net = pinmap[pin.net.name].net
-                else:
-                    #net = self.owner.get_net_else_add(presep + pin.net.name)
-                    net = owner.get_net_else_add(presep + pin.net.name)
+                net = map_net(pin.net)
                 uniq_inst.add_pin_obj(Pin(pin.port, uniq_inst, net))
 
+        for res in uniq_ref.resistors:
+            owner.resistors.append(Resistor(
+                presep + res.name, map_net(uniq_ref.nets[res.p]).name,
+                map_net(uniq_ref.nets[res.n]).name, res.value))
+
         #self.owner.del_instance(self.name)
         owner.del_instance(self.name)
 
@@ -452,6 +549,9 @@ class Cell(object):
         self.nets = collections.OrderedDict()
         self.instances = collections.OrderedDict()
         self.params = collections.OrderedDict()
+        self.resistors = []
+        # Parasitics read for the cell, if any
+        self.parasitics = None
 
         for name in portnames:
             net = Net(name, owner=self)
@@ -465,6 +565,7 @@ class Cell(object):
 
         #self._ctx = None
         self._ref_count = 0
+        self._listeners = []
 
     def full_name(self):
         scope = self
@@ -474,12 +575,74 @@ class Cell(object):
             scope = scope.owner
         return "/".join(scope_path)
 
+    def root(self):
+        scope = self
+        while scope.owner:
+            scope = scope.owner
+        return scope
+
+    def _invalidate_hierarchy(self):
+        # any structural edit below the root makes the cached graph stale,
+        # unless it is made to a copy that isn't in its owner's cells (see
+        # flattened), as the graph doesn't see such copies
+        scope = self
+        while scope.owner:
+            if scope.owner.cells.get(scope.name) is not scope:
+                return
+            scope = scope.owner
+        if isinstance(scope, Ckt):
+            scope._hierarchy = None
+
     #---------------------------------------------------------------------------
     def _uniq(self):
         cpy = copy.copy(self)
         cpy.instances = collections.OrderedDict(self.instances)
+        cpy.nets = collections.OrderedDict(self.nets)
+        cpy.resistors = list(self.resistors)
+        cpy._listeners = []
+        return cpy
+
+    def flattened(self, sep='/'):
+        """ Return a flattened copy of the cell
+
+        Unlike ungroup(flatten=True), the cell itself and the rest of the
+        hierarchy are left unchanged. The copy is not added to any scope:
+        it keeps the owner of the cell to resolve names, but its edits don't
+        invalidate the owner's cached hierarchy.
+        """
+        cpy = self._uniq()
+        cpy.ungroup(flatten=True, sep=sep)
+
+        # the devices of the cell itself are still shared with it
+        cell_ctx = cpy._build_ctx({})
+        for inst in list(cpy.all_instances()):
+            if inst.owner is self:
+                uniq_inst = inst._uniq(name=inst.name, ctx=cell_ctx)
+                uniq_inst.owner = cpy
+                uniq_inst.pins = [Pin(pin.port, uniq_inst, pin.net)
+                                  for pin in inst.all_pins()]
+                cpy.instances[inst.name] = uniq_inst
         return cpy
 
+    #---------------------------------------------------------------------------
+    def add_listener(self, listener):
+        """ Call listener(event, obj) after every edit of this cell:
+
+        - 'add_instance' : instance added (obj: Instance)
+        - 'del_instance' : instance deleted (obj: Instance)
+        - 'add_pin'      : pin added to one of the instances (obj: Pin)
+        - 'set_param'    : param added/changed on one of the instances
+                           (obj: Instance)
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def _notify(self, event, obj):
+        for listener in self._listeners:
+            listener(event, obj)
+
     #---------------------------------------------------------------------------
     def add_cell(self, name, portnames, params=None, overwrite=False):
         if name is None:
@@ -489,6 +652,7 @@ class Cell(object):
         cell = Cell(name, portnames, params)
         cell.owner = self
         self.cells[name] = cell
+        self._invalidate_hierarchy()
         return cell
 
     def all_cells(self):
@@ -526,7 +690,10 @@ class Cell(object):
             raise CktObjValueError("instance has no name")
         instance = Instance(name, *args, **kwargs)
         instance.owner = self
+        self._replace_instance(name)
         self.instances[name] = instance
+        self._invalidate_hierarchy()
+        self._notify('add_instance', instance)
         return instance
 
     def add_instance_obj(self, instance):
@@ -535,7 +702,10 @@ class Cell(object):
         if instance.name is None:
             raise CktObjValueError("instance '%r' has no name" % instance)
         instance.owner = self
+        self._replace_instance(instance.name)
         self.instances[instance.name] = instance
+        self._invalidate_hierarchy()
+        self._notify('add_instance', instance)
         return instance
 
     def all_instances(self):
@@ -547,8 +717,15 @@ class Cell(object):
         except KeyError:
             raise CktObjDoesNotExist("'%s' in: '%s'" % (name, self))
 
+    def _replace_instance(self, name):
+        # an instance added under an existing name replaces (deletes) it
+        if self._listeners and name in self.instances:
+            self._notify('del_instance', self.instances[name])
+
     def del_instance(self, name):
-        del self.instances[name]
+        instance = self.instances.pop(name)
+        self._invalidate_hierarchy()
+        self._notify('del_instance', instance)
 
     #---------------------------------------------------------------------------
     def add_net(self, name, *args, **kwargs):
@@ -570,8 +747,21 @@ class Cell(object):
             #else:
             raise CktObjDoesNotExist("'%s' in: '%s'" % (name, self))
 
+    def add_resistor(self, name, pnetname, nnetname, value):
+        """ Add a resistor (see Resistor) between two nets, adding the nets
+        if needed
+        """
+        self.get_net_else_add(pnetname)
+        self.get_net_else_add(nnetname)
+        res = Resistor(name, pnetname, nnetname, value)
+        self.resistors.append(res)
+        return res
+
     def get_net_else_add(self, name):
-        return self.nets.setdefault(name, Net(name, owner=self))
+        try:
+            return self.nets[name]
+        except KeyError:
+            return self.add_net(name)
 
     #---------------------------------------------------------------------------
     def add_port(self, name):
@@ -623,6 +813,86 @@ class Cell(object):
         #print("< cell ctx:", self, cell_ctx)
         return cell_ctx
 
+    #---------------------------------------------------------------------------
+    def struct_hash(self, memo=None, names=True):
+        """ Return a hex digest of the cell structure
+
+        The hash covers, in order, the ports, the params, and every instance
+        and resistor, in sorted order: its params, net connections and ref
+        (prims by name, type, ports and params; cells by their own
+        struct_hash). Param values are normalized (case, spaces and number
+        formatting), global nets are told apart from local ones, and the
+        cell's own name is not part of the hash.
+
+        - names : if True, port, net and instance names are hashed too, so
+                  cells with equal hashes flatten to the same netlist, down
+                  to the names. If False, ports only count by position,
+                  global nets by name and the other nets by order of first
+                  connection (the instances being sorted without them), so
+                  the hash identifies the cell up to renaming, and up to the
+                  order of instances that only differ by their local nets.
+        - memo  : optional {(cell, names): hash} dict shared between calls
+                  to avoid rehashing the same cells
+        """
+        if memo is None:
+            memo = {}
+        key = (self, names)
+        if key in memo:
+            return memo[key]
+
+        netids = collections.OrderedDict()
+        for pos, portname in enumerate(self.ports):
+            netids[portname] = portname if names else pos
+
+        def net_key(netname):
+            # global nets are connected by name, so they keep it in any case
+            if netname in netids:
+                return netids[netname]
+            net = self.nets.get(netname)
+            if net is not None and net.is_global:
+                return ('global', netname)
+            return netname if names else None
+
+        records = []
+        for inst in self.all_instances():
+            ref = inst.ref
+            if ref is None:
+                refkey = ('unlinked', inst.refname)
+            elif isinstance(ref, Prim):
+                refkey = ('prim', ref.name, ref.type, list(ref.ports),
+                          _param_values(ref.params))
+            else:
+                refkey = ('cell', ref.struct_hash(memo, names))
+            netnames = [pin.net.name for pin in inst.all_pins()]
+            records.append(((inst.name if names else None, refkey,
+                             _param_values(inst.params),
+                             [net_key(netname) for netname in netnames]),
+                            netnames))
+        for res in self.resistors:
+            netnames = [res.p, res.n]
+            records.append(((res.name if names else None, 'r',
+                             normalize_value(res.value),
+                             [net_key(netname) for netname in netnames]),
+                            netnames))
+        # sorted, so that the statement order doesn't matter
+        records.sort(key=lambda record: repr(record[0]))
+
+        h = hashlib.sha1()
+        h.update(repr((list(netids.values()), _param_values(self.params))))
+        for record, netnames in records:
+            if not names:
+                # number the internal nets by order of first connection
+                conns = record[3]
+                for i, netname in enumerate(netnames):
+                    if conns[i] is None:
+                        if netname not in netids:
+                            netids[netname] = len(netids)
+                        conns[i] = netids[netname]
+            h.update(repr(record))
+
+        memo[key] = h.hexdigest()
+        return memo[key]
+
     #---------------------------------------------------------------------------
     def search_scope_cell(self, name):
         scope = self
@@ -651,7 +921,8 @@ class Cell(object):
             except LinkError, e:
                 if ignore_link_errors:
                     link_failed = True
-                    print("Error: %s. Ignoring..." % str(e))
+                    print("Error: %s. Ignoring..." % str(e),
+                          file=sys.stderr)
                 else:
                     raise e
 
@@ -661,13 +932,32 @@ class Cell(object):
             except LinkError, e:
                 if ignore_link_errors:
                     link_failed = True
-                    print("Error: %s. Ignoring..." % str(e))
+                    print("Error: %s. Ignoring..." % str(e),
+                          file=sys.stderr)
                 else:
                     raise e
 
         if link_failed:
             raise LinkError("failed to link cell '%s'" % self.full_name())
 
+    def _bind_globals(self, global_nets):
+        """ Connect the pins on nets named like a global net (other than
+        ports) to the shared global Net, in this cell and all the cells
+        declared in it.
+        """
+        for cell in self.all_cells():
+            cell._bind_globals(global_nets)
+
+        for inst in self.all_instances():
+            for pin in inst.all_pins():
+                net = global_nets.get(pin.net.name)
+                if net is not None and pin.net.name not in self.ports:
+                    pin.net = net
+
+        for name, net in global_nets.items():
+            if name in self.nets and name not in self.ports:
+                self.nets[name] = net
+
     #---------------------------------------------------------------------------
     def ungroup(self, instname=None, flatten=False, prefix='', sep='/',
                 ctx=None):
@@ -712,6 +1002,19 @@ class Cell(object):
     #    r += indent*lev + "}"
     #    return r
 
+def _param_values(params):
+    return [(name, normalize_value(param.value))
+            for name, param in params.items()]
+
+def normalize_value(value):
+    """ Param value string normalized for comparisons """
+    value = re.sub(r'\s+', '', str(value).lower())
+    value = spice.eval_spice_number(value)
+    try:
+        return repr(float(value))
+    except ValueError:
+        return value
+
 #-------------------------------------------------------------------------------
 class Prim(Cell):
     def __init__(self, name, type, portnames, params):
@@ -719,6 +1022,118 @@ class Prim(Cell):
         self.type = type
         self.portnames = portnames
 
+#-------------------------------------------------------------------------------
+class Hierarchy(object):
+    """ Cell hierarchy graph of a Ckt
+
+    The nodes are the root Ckt and every (possibly nested) Cell declared in it;
+    prims are leaves and are not part of the graph. An edge parent -> child
+    exists for every linked hierarchical instance, with the number of such
+    instances as its multiplicity.
+
+    - edges   : {parent: OrderedDict(child: count)}
+    - parents : {child: OrderedDict(parent: count)}
+    - order   : all nodes in topological order (parents before children)
+    - depth   : {cell: longest path from a node that has no parents}
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.edges = collections.OrderedDict()
+        self.parents = collections.OrderedDict()
+        self.order = []
+        self.depth = {}
+        self._build()
+
+    def _build(self):
+        nodes = []
+        scopes = [self.root]
+        while scopes:
+            scope = scopes.pop()
+            nodes.append(scope)
+            scopes.extend(reversed(scope.cells.values()))
+
+        for cell in nodes:
+            self.edges[cell] = collections.OrderedDict()
+            self.parents[cell] = collections.OrderedDict()
+
+        for cell in nodes:
+            children = self.edges[cell]
+            for inst in cell.all_instances():
+                ref = inst.ref
+                if ref is None or isinstance(ref, Prim):
+                    continue
+                if ref not in self.parents:
+                    # ref was declared outside of this root (or has since
+                    # been removed); treat it as a leaf
+                    continue
+                children[ref] = children.get(ref, 0) + 1
+            for child, count in children.items():
+                self.parents[child][cell] = count
+
+        # Kahn's algorithm, visiting nodes in declaration order
+        indegree = dict((cell, len(self.parents[cell])) for cell in nodes)
+        ready = collections.deque(cell for cell in nodes
+                                  if indegree[cell] == 0)
+        for cell in ready:
+            self.depth[cell] = 0
+        while ready:
+            cell = ready.popleft()
+            self.order.append(cell)
+            for child in self.edges[cell]:
+                self.depth[child] = max(self.depth.get(child, 0),
+                                        self.depth[cell] + 1)
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    ready.append(child)
+
+        if len(self.order) != len(nodes):
+            cycle = [cell.full_name() for cell in nodes if indegree[cell]]
+            raise LinkError("cyclic cell hierarchy: %s" % ", ".join(cycle))
+
+    #---------------------------------------------------------------------------
+    def children(self, cell):
+        return self.edges[cell]
+
+    def topcells(self):
+        """ Cells declared at the root that are not instantiated anywhere """
+        return [cell for cell in self.root.all_cells()
+                if not self.parents[cell]]
+
+    def topological_order(self, top=None):
+        """ Nodes ordered parents-first (restricted to the subtree of top) """
+        if top is None:
+            return list(self.order)
+        reachable = self.subtree(top)
+        return [cell for cell in self.order if cell in reachable]
+
+    def reverse_topological_order(self, top=None):
+        """ Nodes ordered children-first (restricted to the subtree of top) """
+        return self.topological_order(top)[::-1]
+
+    def depths(self, top):
+        """ {node: longest path from top} of the subtree of top (unlike
+        depth, which counts from any node without parents) """
+        depths = {top: 0}
+        for cell in self.topological_order(top):
+            for child in self.edges[cell]:
+                depths[child] = max(depths.get(child, 0), depths[cell] + 1)
+        return depths
+
+    def subtree(self, top):
+        """ Set of nodes reachable from top (including top itself) """
+        reachable = set([top])
+        stack = [top]
+        while stack:
+            for child in self.edges[stack.pop()]:
+                if child not in reachable:
+                    reachable.add(child)
+                    stack.append(child)
+        return reachable
+
+    def __repr__(self):
+        return "Hierarchy(%s)" % self.root.full_name()
+
 #-------------------------------------------------------------------------------
 class Ckt(Cell):
     """ Ckt class represents the top-level of the design. Ckt is essentially a
@@ -726,19 +1141,74 @@ class Ckt(Cell):
     spice format or $root in verilog.
     """
 
-    def __init__(self, name="", params=None):
+    def __init__(self, name="", params=None, supply_nets=()):
         if params is None:
             params = {}
         super(Ckt, self).__init__(name, portnames=[], params=params)
+        # {name: Net} shared by every cell that uses the name without a port
+        self.global_nets = collections.OrderedDict()
+        # names of the supply nets, made global at link time
+        self.supply_nets = set(supply_nets)
         self._reader_cache = {}
+        self._hierarchy = None
 
-    def get_topcells(self):
-        top_cells = []
+    def duplicate_cells(self, memo=None):
+        """ Return OrderedDict(name: name of the first structurally identical
+        cell) of the root cells that duplicate one declared before them, up
+        to renaming (struct_hash(names=False)).
+
+        Call it once linked: an unlinked ref only counts by its name.
+        - memo : optional struct_hash memo
+        """
+        if memo is None:
+            memo = {}
+        firsts = {}
+        duplicates = collections.OrderedDict()
         for cell in self.all_cells():
-            if cell._ref_count == 0:
-                top_cells.append(cell)
-        #print("Top cells: %s" % top_cells)
-        return top_cells
+            digest = cell.struct_hash(memo, names=False)
+            original = firsts.setdefault(digest, cell.name)
+            if original != cell.name:
+                duplicates[cell.name] = original
+        return duplicates
+
+    def add_global(self, name):
+        """ Declare a global net (spice .global) and return its Net
+
+        Every cell that has a net of that name, other than a port, shares
+        this Net once linked, and keeps sharing it when flattened.
+        """
+        try:
+            return self.global_nets[name]
+        except KeyError:
+            net = Net(name, owner=self)
+            net.is_global = True
+            self.global_nets[name] = net
+            return net
+
+    def is_global(self, name):
+        return name in self.global_nets or name in self.supply_nets
+
+    def link(self, ignore_link_errors=False):
+        self._hierarchy = None
+        super(Ckt, self).link(ignore_link_errors=ignore_link_errors)
+        for name in sorted(self.supply_nets):
+            self.add_global(name)
+        if self.global_nets:
+            self._bind_globals(self.global_nets)
+        self._hierarchy = Hierarchy(self)
+
+    def hierarchy(self):
+        """ Return the (cached) cell hierarchy graph
+
+        The graph is built at link time and rebuilt on demand after any cell
+        or instance is added or removed.
+        """
+        if self._hierarchy is None:
+            self._hierarchy = Hierarchy(self)
+        return self._hierarchy
+
+    def get_topcells(self):
+        return self.hierarchy().topcells()
 
 
     def read_spice(self, f):
@@ -748,12 +1218,58 @@ class Ckt(Cell):
         """
         spice.Reader(self).read(f)
 
-    def write_spice(self, cell, f=None):
+    def read_verilog(self, f):
+        """ Read a structural verilog file into the Ckt database
+
+        - f : file or filetype object
+        """
+        verilog.Reader(self).read(f)
+
+    def read_dspf(self, f, cell, detail=False, sep='/'):
+        """ Read the parasitics of a cell from a DSPF file into
+        cell.parasitics (added to any already read)
+
+        - f      : file or filetype object
+        - cell   : cell the file was extracted from
+        - detail : keep the RC elements of each net, not only the total cap
+        - sep    : hierarchy separator used in the Ckt net names
+        """
+        if cell.parasitics is None:
+            cell.parasitics = Parasitics()
+        dspf.Reader(cell.parasitics, sep=sep, detail=detail).read(f)
+
+    def read_spef(self, f, cell, detail=False, sep='/'):
+        """ Same as read_dspf, but from a SPEF file """
+        if cell.parasitics is None:
+            cell.parasitics = Parasitics()
+        spef.Reader(cell.parasitics, sep=sep, detail=detail).read(f)
+
+    def write_spice(self, cell, f=None, hierarchical=False, flatten=False,
+                    prims=False, jobs=None, include=None):
         """ Write a cell to a file in the spice format
 
-        - cell : cell to write
-        - f    : file or filetype object
+        - cell         : cell to write
+        - f            : file or filetype object (stdout by default)
+        - hierarchical : also write every cell below cell, bottom-up
+        - flatten      : write cell flattened, without modifying it
+        - prims        : with hierarchical, also write the .macromodel of
+                         the prims used
+        - jobs         : format the instances of cell (typically already
+                         flattened) in shards, with a pool of jobs processes
+        - include      : with jobs, write the shards to '<include>.<i>'
+                         files, included from f
         """
-        spice.Writer(cell).write()
+        writer = spice.Writer(cell, f)
+        if jobs is not None:
+            if flatten or hierarchical:
+                raise CktObjValueError("jobs can't be used with flatten or "
+                                       "hierarchical")
+            writer.write_sharded(jobs, include=include)
+        elif flatten:
+            writer.write_flat()
+        elif hierarchical:
+            writer.write_hierarchy(prims=prims)
+        else:
+            writer.write()
 
 #-------------------------------------------------------------------------------
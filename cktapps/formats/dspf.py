@@ -0,0 +1,78 @@
+"""
+Functions and classes to handle the DSPF (detailed standard parasitic format)
+format
+
+Classes:
+
+    Reader
+
+"""
+
+#-------------------------------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import print_function
+
+from cktapps.formats import spice
+
+#-------------------------------------------------------------------------------
+class Reader(object):
+    """ Streaming DSPF reader
+
+    Only the net sections are read: the total cap of every *|NET, and with
+    detail, the R and C elements that follow it. Instance sections and the
+    *|I, *|P, *|S node lines are skipped, and no element is kept otherwise,
+    so the memory used does not grow with the file.
+
+    - parasitics : core.Parasitics to add the nets to
+    - sep        : hierarchy separator of the net names in the Ckt; the
+                   *|DIVIDER of the file is replaced by it
+    - detail     : if True, also keep the RC elements of each net
+    """
+
+    def __init__(self, parasitics, sep='/', detail=False):
+        self.parasitics = parasitics
+        self.sep = sep
+        self.detail = detail
+        self.divider = '/'
+        self.ground_nets = set(['0'])
+
+    def read(self, f):
+        netname = None
+
+        for (line, fname, lineno) in spice.Reader.read_line(f):
+            tokens = line.split()
+            if not tokens:
+                continue
+            keyword = tokens[0].upper()
+
+            try:
+                if keyword == '*|NET':
+                    netname = self._name(tokens[1])
+                    self.parasitics.add_net(netname,
+                                            _value(tokens[2]))
+                elif keyword == '*|DIVIDER':
+                    self.divider = tokens[1]
+                elif keyword == '*|GROUND_NET':
+                    self.ground_nets.add(tokens[1])
+                elif keyword in ('.SUBCKT', '.ENDS'):
+                    netname = None
+                elif (self.detail and netname is not None and
+                      keyword[0] in 'RC'):
+                    name, p, n, value = tokens[:4]
+                    if n in self.ground_nets:
+                        n = '0'
+                    self.parasitics.add_element(netname, keyword[0].lower(),
+                                                name, self._name(p),
+                                                self._name(n), _value(value))
+            except (IndexError, ValueError):
+                raise spice.SyntaxError("invalid DSPF line [%s, %s]\n-> %s" %
+                                        (fname, lineno, line))
+        return self.parasitics
+
+    def _name(self, name):
+        if self.divider != self.sep:
+            return name.replace(self.divider, self.sep)
+        return name
+
+def _value(token):
+    return float(spice.eval_spice_number(token))
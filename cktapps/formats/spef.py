@@ -0,0 +1,117 @@
+"""
+Functions and classes to handle the SPEF (IEEE 1481 standard parasitic
+exchange format) format
+
+Classes:
+
+    Reader
+
+"""
+
+#-------------------------------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import print_function
+
+from cktapps.formats import spice
+
+#-------------------------------------------------------------------------------
+_UNITS = {'F'   : 1.0,     'PF' : 1e-12,   'FF'  : 1e-15,
+          'NF'  : 1e-9,    'UF' : 1e-6,
+          'OHM' : 1.0,     'KOHM' : 1e3,   'MOHM' : 1e6}
+
+class Reader(object):
+    """ Streaming SPEF reader
+
+    The total cap of every *D_NET (and *R_NET) is read, and with detail,
+    the elements of its *CAP and *RES sections. Names are translated
+    through the *NAME_MAP, and values scaled with the *C_UNIT and *R_UNIT.
+    Besides the name map, nothing but the parasitics is kept.
+
+    - parasitics : core.Parasitics to add the nets to
+    - sep        : hierarchy separator of the net names in the Ckt; the
+                   *DIVIDER of the file is replaced by it
+    - detail     : if True, also keep the RC elements of each net
+    """
+
+    def __init__(self, parasitics, sep='/', detail=False):
+        self.parasitics = parasitics
+        self.sep = sep
+        self.detail = detail
+        self.divider = '/'
+        self.delimiter = ':'
+        self.c_unit = 1e-12
+        self.r_unit = 1.0
+        self.name_map = {}
+
+    def read(self, f):
+        section = None
+        netname = None
+
+        for lineno, line in enumerate(f, 1):
+            line = line.split('//', 1)[0]
+            tokens = line.split()
+            if not tokens:
+                continue
+            keyword = tokens[0].upper()
+
+            try:
+                if keyword in ('*D_NET', '*R_NET'):
+                    netname = self._name(tokens[1])
+                    self.parasitics.add_net(netname,
+                                            _value(tokens[2]) * self.c_unit)
+                    section = None
+                elif keyword in ('*CONN', '*CAP', '*RES', '*INDUC'):
+                    section = keyword
+                elif keyword == '*END':
+                    section = netname = None
+                elif keyword in ('*NAME_MAP', '*PORTS', '*PHYSICAL_PORTS',
+                                 '*POWER_NETS', '*GROUND_NETS'):
+                    section = keyword
+                elif keyword == '*DIVIDER':
+                    self.divider = tokens[1]
+                elif keyword == '*DELIMITER':
+                    self.delimiter = tokens[1]
+                elif keyword == '*C_UNIT':
+                    self.c_unit = float(tokens[1]) * _UNITS[tokens[2].upper()]
+                elif keyword == '*R_UNIT':
+                    self.r_unit = float(tokens[1]) * _UNITS[tokens[2].upper()]
+                elif section == '*NAME_MAP':
+                    self.name_map[tokens[0]] = tokens[1]
+                elif not self.detail or netname is None:
+                    continue
+                elif section == '*CAP':
+                    if len(tokens) == 3:
+                        name, p, value = tokens
+                        n = '0'
+                    else:
+                        name, p, n, value = tokens[:4]
+                        n = self._name(n)
+                    self.parasitics.add_element(
+                        netname, 'c', name, self._name(p), n,
+                        _value(value) * self.c_unit)
+                elif section == '*RES':
+                    name, p, n, value = tokens[:4]
+                    self.parasitics.add_element(
+                        netname, 'r', name, self._name(p), self._name(n),
+                        _value(value) * self.r_unit)
+            except (IndexError, KeyError, ValueError):
+                raise spice.SyntaxError("invalid SPEF line [%s, %s]\n-> %s" %
+                                        (f.name, lineno, line.rstrip()))
+        return self.parasitics
+
+    def _name(self, name):
+        # *N[:pin] references to the name map
+        if name.startswith('*'):
+            ref, delim, pin = name.partition(self.delimiter)
+            name = self.name_map[ref] + delim + pin
+        name = name.replace('\\', '')
+        if self.divider != self.sep:
+            name = name.replace(self.divider, self.sep)
+        return name
+
+def _value(token):
+    # min:typ:max triplets are read as the typical value
+    values = token.split(':')
+    if len(values) == 3:
+        token = values[1]
+    return float(token)
@@ -3,14 +3,16 @@ Functions and classes to handle spice format
 
 Classes:
 
-    SpiceReader
-    SpiceWriter
+    Reader
+    Handler
+    Writer
 
 Functions:
 
-    read_spice_line(fileobj) -> list
-    split_spice_line(list) -> list
-    parse_spice_line(list) -> dic
+    Reader.read_line(fileobj) -> iterator of (line, filename, lineno)
+    Reader.read_statements(fileobj) -> iterator of
+                                       (pstmt, line, filename, lineno)
+    Reader.parse(fileobj, handler)
 
 """
 
@@ -18,8 +20,14 @@ Functions:
 from __future__ import absolute_import
 from __future__ import print_function
 
+import os
+import sys
 import time
 import re, collections
+import itertools
+import multiprocessing
+import threading
+from cStringIO import StringIO
 
 #-------------------------------------------------------------------------------
 class Utils(object):
@@ -38,6 +46,7 @@ RE_NUMBER = re.compile(_RE_NUMBER, re.IGNORECASE)
 RE_SPICE_SUFFIX = re.compile(_RE_SPICE_SUFFIX, re.IGNORECASE)
 RE_SPICE_NUMBER = re.compile(r'\s*(%s)(%s)?\s*' %
                              (_RE_NUMBER, _RE_SPICE_SUFFIX), re.IGNORECASE)
+RE_PLAIN_NUMBER = re.compile(r'%s$' % _RE_NUMBER, re.IGNORECASE)
 
 def spice_suffix_val(suffix):
     if suffix is None:
@@ -95,23 +104,19 @@ class Reader(object):
         self.current_scope = self._scope_stack.pop()
         return prev_scope
 
+    def _get_net(self, netname):
+        # node 0 is the global ground
+        if netname == '0' and '0' not in self.ckt.global_nets:
+            self.ckt.add_global('0')
+        return self.current_scope.get_net_else_add(netname)
+
     #---------------------------------------------------------------------------
     def read(self, f):
         from cktapps.core import CktObjAlreadyExists
 
         skip_stmt = False
 
-        for (line, fname, lineno) in self.read_line(f):
-            try:
-                tokens = self._tokenize(line)
-                pstmt = self._parse(tokens)
-
-            except SyntaxError, e:
-                raise SyntaxError("%s [%s, %s]\n-> %s" %
-                                  (e.args[0], fname, lineno, line))
-
-            if pstmt is None: continue
-
+        for (pstmt, line, fname, lineno) in self.read_statements(f):
             major, minor = pstmt['type']
 
             # Skip current subckt/macromodel if it has already been defined
@@ -120,9 +125,6 @@ class Reader(object):
                     skip_stmt = False
                 continue
 
-            # Skip comments for now
-            if major == 'comment': continue
-
             try:
                 self._process_stmt[major][minor](self, pstmt)
             except KeyError:
@@ -137,6 +139,61 @@ class Reader(object):
                 print("Warning: ignoring redefinition of cell %s [%s, %s]\n"
                       "-> %s" % (str(e), fname, lineno, line))
 
+    @classmethod
+    def read_statements(cls, f, skipcomments=True, includes=True):
+        """
+        Reads a Spice file statement-by-statement, without building anything.
+        Every invocation returns a tuple (pstmt, line, filename, lineno), pstmt
+        being the statement-tree of the (unwrapped) line (see _parse).
+
+        With includes, the statements of .include/.inc files are returned in
+        place, with their own filename and lineno. Relative paths are relative
+        to the directory of the including file.
+        """
+        for (line, fname, lineno) in cls.read_line(f):
+            try:
+                pstmt = cls._parse(cls._tokenize(line), skipcomments)
+            except SyntaxError, e:
+                raise SyntaxError("%s [%s, %s]\n-> %s" %
+                                  (e.args[0], fname, lineno, line))
+
+            if pstmt is None: continue
+
+            if includes and pstmt['type'] in (['control', 'include'],
+                                              ['control', 'inc']):
+                if len(pstmt['args']) != 2:
+                    raise SyntaxError(".include requires a file name "
+                                      "[%s, %s]\n-> %s" %
+                                      (fname, lineno, line))
+                path = os.path.join(os.path.dirname(fname), pstmt['args'][1])
+                with open(path) as included:
+                    for stmt in cls.read_statements(included, skipcomments,
+                                                    includes):
+                        yield stmt
+                continue
+
+            yield (pstmt, line, fname, lineno)
+
+    @classmethod
+    def parse(cls, f, handler, skipcomments=True, includes=True):
+        """
+        Reads a Spice file and calls back handler (see Handler) for each
+        statement, in file order. Nothing but the current statement is kept,
+        so memory use does not grow with the file.
+        """
+        callbacks = {}
+        for (pstmt, line, fname, lineno) in cls.read_statements(f,
+                                                               skipcomments,
+                                                               includes):
+            stmt_type = tuple(pstmt['type'])
+            try:
+                callback = callbacks[stmt_type]
+            except KeyError:
+                callback = callbacks[stmt_type] = getattr(
+                    handler, '%s_%s' % stmt_type, handler.default)
+            callback(pstmt, fname, lineno)
+        handler.end()
+
     @classmethod
     def read_line(cls, f):
         """
@@ -269,8 +326,26 @@ class Reader(object):
     def _process_param(self, pstmt):
         pass
 
+    def _process_global(self, pstmt):
+        for netname in pstmt['args'][1:]:
+            self.ckt.add_global(netname)
+
     def _process_r(self, pstmt):
-        pass
+        args = pstmt['args']
+        params = pstmt['kwargs']
+
+        if len(args) == 4:
+            instname, p, n, value = args
+        elif len(args) == 3 and 'r' in params:
+            instname, p, n = args
+            value = params['r']
+        else:
+            raise SyntaxError("resistor requires 2 nets and a value")
+
+        self._get_net(p)
+        self._get_net(n)
+        self.current_scope.add_resistor(instname, p, n,
+                                        eval_spice_number(value))
 
     def _process_c(self, pstmt):
         args = pstmt['args']
@@ -279,7 +354,7 @@ class Reader(object):
         instname = args[0]
         netnames = p, n = args[1:-1]
         cellname = 'c'
-        params['c'] = args[-1]
+        params['c'] = eval_spice_number(args[-1])
 
         inst = self.current_scope.add_instance(instname, cellname, params=params)
 
@@ -291,7 +366,7 @@ class Reader(object):
         portnames = ['p', 'n']
 
         for netname, portname in zip(netnames, portnames):
-            net = self.current_scope.add_net(netname)
+            net = self._get_net(netname)
             inst.add_pin(portname, net)
 
     def _process_m(self, pstmt):
@@ -315,7 +390,7 @@ class Reader(object):
         portnames = prim.portnames
 
         for netname, portname in zip(netnames, portnames):
-            net = self.current_scope.add_net(netname)
+            net = self._get_net(netname)
             inst.add_pin(portname, net)
 
     def _process_x(self, pstmt):
@@ -334,13 +409,14 @@ class Reader(object):
         inst.is_hierarchical = True
 
         for netname in netnames:
-            net = self.current_scope.add_net(netname)
+            net = self._get_net(netname)
             inst.add_pin(None, net)
 
     _process_stmt = {'control' : {'subckt'        : _process_subckt,
                                   'ends'          : _process_ends,
                                   'macromodel'    : _process_macromodel,
                                   'param'         : _process_param,
+                                  'global'        : _process_global,
                                  },
                      'element' : {'r' : _process_r,
                                   'c' : _process_c,
@@ -349,24 +425,158 @@ class Reader(object):
                                  }
                     }
 
+#-------------------------------------------------------------------------------
+class Handler(object):
+    """ Callbacks of Reader.parse
+
+    A statement of type [<major>, <minor>] is passed to the method
+    <major>_<minor>(pstmt, fname, lineno) of the handler, e.g. element_m()
+    for the 'm' elements or control_subckt() for the '.subckt' lines, or to
+    default() if there is none. end() is called after the last statement.
+    """
+
+    def default(self, pstmt, fname, lineno):
+        pass
+
+    def end(self):
+        pass
+
 #-------------------------------------------------------------------------------
 class Writer(object):
-    def __init__(self, cell):
+    """ Spice writer
+
+    Lines are collected and written to f (stdout by default) in chunks of
+    about buffer_size bytes. Nothing in the database is modified.
+
+    - write()           : the cell only, with its nested cell declarations
+    - write_hierarchy() : the cell and every cell below it, bottom-up, each
+                          once (with prims=True, the .macromodel of every
+                          prim used too)
+    - write_flat()      : the cell flattened, streamed from a walk of the
+                          hierarchy, with the device params evaluated
+    - write_sharded()   : same output as write(), with the instances
+                          formatted in shards by a pool of processes
+    """
+
+    def __init__(self, cell, f=None, buffer_size=1 << 20):
         self.cell = cell
-        self.file = None
-        self.indent_stack = []
+        self.file = f
+        self.buffer_size = buffer_size
+        self._lines = []
+        self._size = 0
+        self.reset_indent()
 
     def write(self):
-        self.emit_cell()
+        self.emit_cell(self.cell)
+        self.flush()
+
+    def write_hierarchy(self, prims=False):
+        used_prims = []
+        cells = []
+        self._walk(self.cell, used_prims, cells, set())
+        self.emit_globals()
+        if prims:
+            for prim in used_prims:
+                self.emit_prim(prim)
+        for cell in cells:
+            self.emit_cell(cell)
+        self.flush()
+
+    def write_flat(self, sep='/'):
+        cell = self.cell
+        self.emit_globals()
+        self.emit_header(cell)
+        self.indent()
+        self._emit_flat(cell, cell._build_ctx({}), '', {}, sep)
+        self.dedent()
+        self.emit_trailer(cell)
+        self.flush()
+
+    def write_sharded(self, jobs, shards=None, include=None):
+        """ Write the cell as write() does, its instances and resistors
+        split into shards (contiguous runs, 4 per job by default) that are
+        formatted by a pool of jobs processes.
+
+        The shards are written to f in order, so the output is identical to
+        that of write(). With include, shard i is written by its worker to
+        the file '<include>.<i>' instead, and f gets a '.include' line for
+        each, in its place. The included paths are relative to the directory
+        of f if it is a file on disk (as Reader resolves them), absolute
+        otherwise.
+        """
+        cell = self.cell
+        total = len(cell.instances) + len(cell.resistors)
+        if shards is None:
+            shards = jobs * 4
+        size = max(1, -(-total // shards))
+        ranges = [(start, min(start + size, total))
+                  for start in range(0, total, size)]
+        if include is None:
+            paths = [None] * len(ranges)
+        else:
+            paths = ['%s.%d' % (include, i) for i in range(len(ranges))]
+
+        self.emit_header(cell)
+        self.indent()
+        for nested in cell.cells.itervalues():
+            self.emit_cell(nested)
+
+        instances = list(cell.all_instances())
+        shards = zip(ranges, paths)
+        pool = None
+        try:
+            if jobs > 1 and len(ranges) > 1:
+                pool = _fork_pool(jobs, writer=self, instances=instances)
+                results = pool.imap(_write_shard, shards)
+            else:
+                results = (_format_shard(self, instances, shard)
+                           for shard in shards)
+            for path, text in zip(paths, results):
+                if path is None:
+                    self.flush()
+                    (self.file or sys.stdout).write(text)
+                else:
+                    self.emitln('.include "%s"' % self._include_path(path))
+            if pool is not None:
+                pool.close()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        self.dedent()
+        self.emit_trailer(cell)
+        self.flush()
+
+    def _include_path(self, path):
+        fname = getattr(self.file, 'name', None)
+        if isinstance(fname, basestring) and os.path.isfile(fname):
+            master_dir = os.path.dirname(os.path.abspath(fname))
+            return os.path.relpath(path, master_dir)
+        return os.path.abspath(path)
+
+    def emit_shard(self, start, stop, instances=None):
+        """ Emit the instances and resistors of the cell in [start, stop),
+        counting the instances first (instances: list of the cell instances,
+        if already made) """
+        if instances is None:
+            instances = list(self.cell.all_instances())
+        for inst in instances[start:stop]:
+            self.emit_instance(inst)
+        first = max(0, start - len(instances))
+        last = max(0, stop - len(instances))
+        self.emit_resistors(self.cell.resistors[first:last])
+
+    #---------------------------------------------------------------------------
+    def flush(self):
+        f = self.file or sys.stdout
+        f.write(''.join(self._lines))
+        self._lines = []
+        self._size = 0
 
     def reset_indent(self):
         self.indent_stack = []
         self.indent_pos = 0
-        self.new_line = True
-
-    def next_line(self):
-        print(file=self.file)
-        self.new_line = True
 
     def indent(self, by=1, width=4):
         self.indent_stack.append(self.indent_pos)
@@ -375,57 +585,190 @@ class Writer(object):
     def dedent(self):
         self.indent_pos = self.indent_stack.pop()
 
-    def emit(self, string, sep=' '):
-        if self.new_line:
-            prefix = ' ' * self.indent_pos
-            self.new_line = False
-        else:
-            prefix = sep
-
-        print(prefix + string, end='', file=self.file)
+    def emitln(self, line):
+        line = ' ' * self.indent_pos + line + '\n'
+        self._lines.append(line)
+        self._size += len(line)
+        if self._size >= self.buffer_size:
+            self.flush()
 
-    def emitln(self, string, sep=' '):
-        self.emit(string, sep)
-        self.next_line()
-
-    def emit_cell(self):
-        self.reset_indent()
-        self.emit_header()
-        self.emit_instances()
-        #self.emit_cells() # TODO: handle recursive cell decls.
-        self.emit_trailer()
-
-    def emit_header(self):
-        self.emit('.subckt')
-        self.emit(self.cell.name)
-        self.emit_ports()
-
-    def emit_trailer(self):
-        self.emit('.ends')
-        self.emitln(self.cell.name)
-
-    def emit_ports(self):
-        portnames = [port.name for port in self.cell.all_ports()]
-        self.emitln(' '.join(portnames))
-
-    def emit_instances(self):
-        for inst in self.cell.all_instances():
+    #---------------------------------------------------------------------------
+    def _walk(self, cell, prims, cells, done):
+        # prims and cells to write below cell, the cells in post-order; a
+        # cell declared inside another one is written with its outermost
+        # owner
+        done.add(cell)
+        for inst in cell.all_instances():
+            ref = inst.ref
+            if ref is None or ref in done:
+                continue
+            if inst.is_hierarchical:
+                self._walk(ref, prims, cells, done)
+            else:
+                done.add(ref)
+                prims.append(ref)
+        for nested in cell.cells.itervalues():
+            if nested not in done:
+                self._walk(nested, prims, cells, done)
+
+        unit = cell
+        while unit.owner is not None and unit.owner.owner is not None:
+            unit = unit.owner
+        if unit is cell:
+            cells.append(cell)
+        elif unit not in done:
+            self._walk(unit, prims, cells, done)
+
+    def emit_globals(self):
+        root = self.cell.root()
+        names = [name for name in getattr(root, 'global_nets', ())
+                 if name != '0']
+        if names:
+            self.emitln('.global ' + ' '.join(names))
+
+    def emit_prim(self, prim):
+        self.emitln(' '.join(['.macromodel', prim.name, prim.type] +
+                             list(prim.portnames) +
+                             _format_params(prim.params)))
+
+    def emit_cell(self, cell):
+        self.emit_header(cell)
+        self.indent()
+        for nested in cell.cells.itervalues():
+            self.emit_cell(nested)
+        self.emit_instances(cell)
+        self.emit_resistors(cell.resistors)
+        self.dedent()
+        self.emit_trailer(cell)
+
+    def emit_header(self, cell):
+        self.emitln(' '.join(['.subckt', cell.name] + list(cell.ports) +
+                             _format_params(cell.params)))
+
+    def emit_trailer(self, cell):
+        self.emitln('.ends ' + cell.name)
+
+    def emit_instances(self, cell):
+        for inst in cell.all_instances():
             self.emit_instance(inst)
 
-    def emit_instance(self, inst):
-        if inst.refname.lower() in ['c']: #, 'nch', 'pch']:
-            self.emit('c' + inst.name)
+    def emit_instance(self, inst, name=None, netnames=None, params=None):
+        if name is None:
+            name = inst.name
+        if netnames is None:
+            netnames = [name + '/' + portname if net is None else net.name
+                        for portname, net in _port_nets(inst)]
+        if params is None:
+            params = _format_params(inst.params)
+
+        if inst.refname.lower() == 'c':
+            if not name.lower().startswith('c'):
+                name = 'c' + name
+            value = [v for v in params if v.startswith('c=')]
+            self.emitln(' '.join([name] + netnames +
+                                 [value[0][2:] if value else '1']))
         else:
-            self.emit('x' + inst.name)
-
-        inst_netnames = [pin.net.name for pin in inst.all_pins()]
-        self.emit(' '.join(inst_netnames))
+            self.emitln(' '.join(['x' + name] + netnames + [inst.refname] +
+                                 params))
+
+    def emit_resistors(self, resistors, prefix='', netnames=None):
+        for res in resistors:
+            name = prefix + res.name
+            if not name.lower().startswith('r'):
+                name = 'r' + name
+            if netnames is None:
+                p, n = res.p, res.n
+            else:
+                p, n = netnames[res.p], netnames[res.n]
+            self.emitln('%s %s %s %s' % (name, p, n, res.value))
 
-        if inst.refname.lower() in ['c']: #, 'nch', 'pch']:
-            self.emitln(inst.params['c'])
-        else:
-            self.emit(inst.refname)
-            for param, val in inst.params.items():
-                self.emit('%s=%s' % (param, val))
-            self.emitln('', sep='')
+    #---------------------------------------------------------------------------
+    def _emit_flat(self, cell, cell_ctx, prefix, portmap, sep):
+        # portmap: {port name: flat net name} of this placement
+        def netname(net):
+            if net.name in portmap:
+                return portmap[net.name]
+            if net.is_global or not prefix:
+                return net.name
+            return prefix + net.name
+
+        for inst in cell.all_instances():
+            inst_ctx = inst._build_ctx(cell_ctx)
+            port_nets = _port_nets(inst)
+            if inst.is_hierarchical:
+                ref = inst.ref
+                child_portmap = dict((portname, netname(net))
+                                     for portname, net in port_nets
+                                     if net is not None)
+                self._emit_flat(ref, ref._build_ctx(inst_ctx),
+                                prefix + inst.name + sep, child_portmap, sep)
+            else:
+                params = ['%s=%s' % (name, _format_value(inst_ctx[name]))
+                          for name in inst.params]
+                netnames = [prefix + inst.name + sep + portname
+                            if net is None else netname(net)
+                            for portname, net in port_nets]
+                self.emit_instance(inst, prefix + inst.name, netnames, params)
+
+        if cell.resistors:
+            netnames = dict((net.name, netname(net))
+                            for net in cell.all_nets())
+            self.emit_resistors(cell.resistors, prefix, netnames)
 
+#-------------------------------------------------------------------------------
+# State shared with the write_sharded() workers (see _fork_pool). It is only
+# set while the pool is created, so the forked workers inherit the cell instead
+# of having it pickled to them.
+_shared = {}
+_shared_lock = threading.Lock()
+
+def _fork_pool(jobs, **shared):
+    # same as apps._fork_pool, which can't be imported here (apps imports
+    # core, which imports this module)
+    with _shared_lock:
+        _shared.update(shared)
+        try:
+            return multiprocessing.Pool(jobs)
+        finally:
+            _shared.clear()
+
+def _write_shard(shard):
+    return _format_shard(_shared['writer'], _shared['instances'], shard)
+
+def _format_shard(parent, instances, shard):
+    (start, stop), path = shard
+    if path is None:
+        f = StringIO()
+    else:
+        f = open(path, 'w')
+    try:
+        writer = Writer(parent.cell, f, parent.buffer_size)
+        writer.indent_pos = parent.indent_pos
+        writer.emit_shard(start, stop, instances)
+        writer.flush()
+        if path is None:
+            return f.getvalue()
+    finally:
+        f.close()
+
+def _port_nets(inst):
+    # [(port name, net)] of inst in port order, net being None for a port
+    # left unconnected (see Instance._bind_by_name). The writers give such a
+    # port a dangling net of its own, named as flattening would name it.
+    pins = inst.pins
+    if inst.ref is None or len(pins) >= len(inst.ref.ports):
+        return [(pin.port.name, pin.net) for pin in pins]
+    nets = dict((pin.port.name, pin.net) for pin in pins)
+    return [(portname, nets.get(portname)) for portname in inst.ref.ports]
+
+def _format_params(params):
+    return ['%s=%s' % (name, _format_value(param.value))
+            for name, param in params.items()]
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    value = str(value)
+    if RE_PLAIN_NUMBER.match(value):
+        return value
+    return '"%s"' % value
@@ -0,0 +1,339 @@
+"""
+Functions and classes to handle the structural verilog format
+
+Classes:
+
+    Reader
+
+Functions:
+
+    read_statements(fileobj) -> iterator of (tokens, filename, lineno)
+
+"""
+
+#-------------------------------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import print_function
+
+import collections
+import re
+
+#-------------------------------------------------------------------------------
+class SyntaxError(Exception): pass
+class ParserError(Exception): pass
+
+# escaped identifiers (up to the next white space), identifiers, sized and
+# plain numbers, and single character punctuation
+RE_TOKEN = re.compile(r"\\(\S+)|([A-Za-z_][\w$]*)|(\d*'[sS]?[bBoOdDhH]\s*\w+)"
+                      r"|(\d+)|(\S)")
+RE_BLOCK_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+
+_BASES = {'b': 2, 'o': 8, 'd': 10, 'h': 16}
+
+_NET_TYPES = ('wire', 'reg', 'tri', 'signed', 'supply0', 'supply1')
+
+#-------------------------------------------------------------------------------
+def read_statements(f):
+    """ Read a verilog file statement by statement. Every statement is
+    returned as a tuple (tokens, filename, lineno), the line number being
+    that of its first token. Statements end with ';', except 'endmodule'.
+
+    Escaped identifiers are returned without the backslash, and compiler
+    directives are skipped.
+    """
+    tokens = []
+    start = None
+    in_comment = False
+
+    for lineno, line in enumerate(f, 1):
+        if in_comment:
+            end = line.find('*/')
+            if end < 0:
+                continue
+            line = line[end + 2:]
+            in_comment = False
+        if line.lstrip().startswith('`'):
+            # compiler directive
+            continue
+        if '/' in line:
+            line = RE_BLOCK_COMMENT.sub(' ', line)
+            line = line.split('//', 1)[0]
+            begin = line.find('/*')
+            if begin >= 0:
+                line = line[:begin]
+                in_comment = True
+
+        for m in RE_TOKEN.finditer(line):
+            escaped, ident, sized, number, punct = m.groups()
+            if not tokens:
+                start = lineno
+            if punct == ';':
+                yield tokens, f.name, start
+                tokens = []
+            elif ident == 'endmodule':
+                if tokens:
+                    raise SyntaxError("missing ';' [%s, %s]" % (f.name,
+                                                                start))
+                yield [ident], f.name, lineno
+            elif sized is not None:
+                tokens.append(sized.replace(' ', '').replace('\t', ''))
+            else:
+                tokens.append(escaped or ident or number or punct)
+
+    if tokens:
+        raise SyntaxError("unexpected end of file [%s, %s]" % (f.name, start))
+
+#-------------------------------------------------------------------------------
+class _Module(object):
+    # per module reader state
+    def __init__(self, cell, portnames):
+        self.cell = cell
+        self.portnames = portnames
+        self.ranges = {}  # {name: (msb, lsb)} of the declared buses
+
+class Reader(object):
+    """ Structural verilog reader
+
+    Modules are read into cells of the Ckt root, with their instances
+    connected by name or by position. Buses are bit-blasted lazily: a
+    declaration only records the range, and a Net is added for a bit when
+    it is connected. Bus ports become one port per bit ('d[3]', 'd[2]',
+    ...), in declaration order. Assignments, parameters and other
+    behavioral statements are ignored.
+    """
+
+    def __init__(self, ckt):
+        self.ckt = ckt
+        self.module = None
+
+    #---------------------------------------------------------------------------
+    def read(self, f):
+        from cktapps.core import CktObjAlreadyExists
+
+        skip_module = False
+
+        for tokens, fname, lineno in read_statements(f):
+            keyword = tokens[0]
+
+            if skip_module:
+                if keyword == 'endmodule':
+                    skip_module = False
+                continue
+
+            try:
+                process = self._process_stmt.get(keyword)
+                if process is not None:
+                    process(self, tokens)
+                elif self.module is not None:
+                    self._process_instances(tokens)
+                else:
+                    raise ParserError("unexpected statement '%s'" % keyword)
+            except (SyntaxError, ParserError), e:
+                raise e.__class__("%s [%s, %s]" % (e.args[0], fname, lineno))
+            except IndexError:
+                raise SyntaxError("incomplete statement '%s' [%s, %s]" %
+                                  (keyword, fname, lineno))
+            except CktObjAlreadyExists, e:
+                skip_module = True
+                print("Warning: ignoring redefinition of cell %s [%s, %s]" %
+                      (str(e), fname, lineno))
+
+    #---------------------------------------------------------------------------
+    def _process_module(self, tokens):
+        if self.module is not None:
+            raise SyntaxError("nested module '%s'" % tokens[1])
+        name = tokens[1]
+        cell = self.ckt.add_cell(name, portnames=[], params={})
+
+        module = self.module = _Module(cell, [])
+        if len(tokens) > 2:
+            # non-ANSI (a, b, c) or ANSI (input a, output [3:0] b, c) header
+            if tokens[2] != '(':
+                raise SyntaxError("expected '(' after module '%s'" % name)
+            rng = None
+            for decl in _split(tokens[3:_match(tokens, 2)], ','):
+                if not decl:
+                    continue
+                if decl[0] in ('input', 'output', 'inout'):
+                    names = self._process_decl(decl)
+                    rng = module.ranges.get(names[0])
+                else:
+                    # same range as the previous ANSI declaration, if any
+                    names = decl
+                    if rng is not None:
+                        module.ranges[names[0]] = rng
+                module.portnames.extend(names)
+
+    def _process_decl(self, tokens):
+        """ Record the range of a declaration and return its names """
+        pos = 1
+        while pos < len(tokens) and tokens[pos] in _NET_TYPES:
+            pos += 1
+        rng = None
+        if pos < len(tokens) and tokens[pos] == '[':
+            rng = (int(tokens[pos + 1]), int(tokens[pos + 3]))
+            pos += 5
+        names = [name for name in tokens[pos:] if name != ',']
+        if rng is not None:
+            for name in names:
+                self.module.ranges[name] = rng
+        return names
+
+    def _process_endmodule(self, tokens):
+        module = self.module
+        if module is None:
+            raise SyntaxError("keyword 'endmodule' unexpected here")
+        self.module = None
+
+        cell = module.cell
+        nets = collections.OrderedDict()
+        for name in module.portnames:
+            for bit in self._bits(module, name):
+                cell.add_port(bit)
+                nets[bit] = cell.get_net_else_add(bit)
+        # port nets first, as in cells read from spice
+        nets.update(cell.nets)
+        cell.nets = nets
+
+    def _process_ignored(self, tokens):
+        pass
+
+    #---------------------------------------------------------------------------
+    def _process_instances(self, tokens):
+        # ref [#(params)] inst (conns) [, inst (conns)]...
+        refname = tokens[0]
+        pos = 1
+        params = collections.OrderedDict()
+        if tokens[pos] == '#':
+            end = _match(tokens, pos + 1)
+            for conn in _split(tokens[pos + 2:end], ','):
+                if len(conn) >= 4 and conn[0] == '.':
+                    params[conn[1]] = ''.join(conn[3:-1])
+            pos = end + 1
+
+        is_hierarchical = refname not in self.ckt.prims
+        while pos < len(tokens):
+            instname = tokens[pos]
+            if tokens[pos + 1] != '(':
+                raise SyntaxError("expected '(' after instance '%s'" %
+                                  instname)
+            end = _match(tokens, pos + 1)
+            inst = self.module.cell.add_instance(
+                instname, refname, params=collections.OrderedDict(params))
+            inst.is_hierarchical = is_hierarchical
+            self._connect(inst, tokens[pos + 2:end])
+            pos = end + 1
+            if pos < len(tokens) and tokens[pos] == ',':
+                pos += 1
+
+    def _connect(self, inst, tokens):
+        cell = self.module.cell
+        for conn in _split(tokens, ','):
+            if not conn:
+                continue
+            if conn[0] == '.':
+                # .port(expr)
+                portname = conn[1]
+                for netname in self._expr_bits(conn[3:-1]):
+                    inst.add_pin(portname, cell.get_net_else_add(netname))
+            else:
+                for netname in self._expr_bits(conn):
+                    inst.add_pin(None, cell.get_net_else_add(netname))
+
+    #---------------------------------------------------------------------------
+    def _expr_bits(self, tokens):
+        """ Net names of the bits of a connection, MSB first """
+        if not tokens:
+            return []
+        if tokens[0] == '{':
+            bits = []
+            for part in _split(tokens[1:_match(tokens, 0)], ','):
+                bits.extend(self._expr_bits(part))
+            return bits
+        if "'" in tokens[0]:
+            # constants are global tie-off nets
+            bits = _const_bits(tokens[0])
+            for bit in bits:
+                if bit not in self.ckt.global_nets:
+                    self.ckt.add_global(bit)
+            return bits
+        name = tokens[0]
+        if len(tokens) == 1:
+            return self._bits(self.module, name)
+        if tokens[1] != '[':
+            raise SyntaxError("unsupported expression '%s'" % ' '.join(tokens))
+        if tokens[3] == ':':
+            return _range_bits(name, int(tokens[2]), int(tokens[4]))
+        return ['%s[%s]' % (name, tokens[2])]
+
+    @staticmethod
+    def _bits(module, name):
+        rng = module.ranges.get(name)
+        if rng is None:
+            return [name]
+        return _range_bits(name, *rng)
+
+    _process_stmt = {'module'    : _process_module,
+                     'macromodule' : _process_module,
+                     'endmodule' : _process_endmodule,
+                     'input'     : _process_decl,
+                     'output'    : _process_decl,
+                     'inout'     : _process_decl,
+                     'wire'      : _process_decl,
+                     'reg'       : _process_decl,
+                     'tri'       : _process_decl,
+                     'supply0'   : _process_decl,
+                     'supply1'   : _process_decl,
+                     'assign'    : _process_ignored,
+                     'parameter' : _process_ignored,
+                     'localparam': _process_ignored,
+                     'defparam'  : _process_ignored,
+                    }
+
+#-------------------------------------------------------------------------------
+def _match(tokens, pos):
+    # position of the bracket closing the one at pos
+    closing = {'(': ')', '[': ']', '{': '}'}[tokens[pos]]
+    opening = tokens[pos]
+    depth = 0
+    for i in xrange(pos, len(tokens)):
+        if tokens[i] == opening:
+            depth += 1
+        elif tokens[i] == closing:
+            depth -= 1
+            if depth == 0:
+                return i
+    raise SyntaxError("unbalanced '%s'" % opening)
+
+def _split(tokens, sep):
+    # split on sep outside of brackets
+    parts = [[]]
+    depth = 0
+    for tok in tokens:
+        if tok in ('(', '[', '{'):
+            depth += 1
+        elif tok in (')', ']', '}'):
+            depth -= 1
+        if tok == sep and depth == 0:
+            parts.append([])
+        else:
+            parts[-1].append(tok)
+    return parts
+
+def _range_bits(name, msb, lsb):
+    step = -1 if msb >= lsb else 1
+    return ['%s[%d]' % (name, i) for i in xrange(msb, lsb + step, step)]
+
+def _const_bits(token):
+    # sized constant, e.g. 4'b10x1, as tie0/tie1/tiex/tiez nets (names that
+    # read back from spice, where quotes delimit expressions)
+    size, _, value = token.partition("'")
+    value = value.lstrip('sS')
+    base, digits = _BASES[value[0].lower()], value[1:].replace('_', '')
+    if base == 2:
+        bits = digits.lower()
+    else:
+        bits = bin(int(digits, base))[2:]
+    if size:
+        bits = bits[-int(size):].rjust(int(size), '0')
+    return ['tie' + bit for bit in bits]
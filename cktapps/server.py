@@ -0,0 +1,191 @@
+""" cktapps netlist query server
+
+Serves queries against a loaded (and linked) Ckt database, so that it is read
+only once. The protocol is line based JSON over a local UNIX or TCP socket:
+each request is a JSON object on one line,
+
+    {"query": "report_net", "cell": "buf", "top": 10}
+
+and is answered by one line, either {"result": ...} or {"error": "..."}.
+The queries are the public methods of Queries.
+"""
+
+#-------------------------------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import print_function
+
+import heapq
+import json
+import socket
+import SocketServer
+
+from cktapps import apps
+from cktapps import core
+
+#-------------------------------------------------------------------------------
+class QueryError(Exception): pass
+
+#-------------------------------------------------------------------------------
+class Queries(object):
+    """ Read-only queries on a linked Ckt
+
+    Nothing is flattened: net caps are computed hierarchically, so the
+    database stays unchanged between queries.
+    """
+
+    def __init__(self, ckt):
+        self.ckt = ckt
+
+    def cells(self):
+        """ Names of the cells declared at the root, top cells first """
+        topcells = self.ckt.get_topcells()
+        return ([cell.name for cell in topcells] +
+                [cell.name for cell in self.ckt.all_cells()
+                 if cell not in topcells])
+
+    def report_net(self, cell=None, top=None):
+        """ Rows of apps.NET_FIELDS (caps in fF), sorted by fanout """
+        rows = []
+        for netname, cwire, cload, cdriver in apps.hier_net_caps(
+                self.get_cell(cell)):
+            rows.append((netname, cwire*1e15, cload*1e15, cdriver*1e15,
+                         apps.fanout(cwire, cload, cdriver)))
+        if top is not None:
+            return heapq.nlargest(top, rows, key=lambda row: row[4])
+        return sorted(rows, key=lambda row: row[4], reverse=True)
+
+    def report_hierarchy(self, cell=None):
+        """ Rows of apps.HIERARCHY_FIELDS """
+        return list(apps.hierarchy_rows(self.get_cell(cell)))
+
+    def lookup(self, path, cell=None):
+        """ Ref, params and pin connections of the instance at path """
+        inst, _ = self._resolve(path, cell)
+        return dict(name=inst.name,
+                    ref=inst.refname,
+                    params=dict((name, param.value)
+                                for name, param in inst.params.items()),
+                    pins=[(pin.port.name, pin.net.name)
+                          for pin in inst.all_pins()])
+
+    def eval(self, path, param, cell=None):
+        """ Value of param in the ref context of the instance at path """
+        inst, inst_ctx = self._resolve(path, cell)
+        ref_ctx = inst.ref._build_ctx(inst_ctx)
+        try:
+            return ref_ctx[param]
+        except KeyError:
+            raise core.CktObjDoesNotExist("'%s' in: '%s'" % (param, inst))
+
+    #---------------------------------------------------------------------------
+    def get_cell(self, name=None):
+        if name is not None:
+            return self.ckt.get_cell(name)
+        topcells = self.ckt.get_topcells()
+        if topcells:
+            return topcells[0]
+        return self.ckt
+
+    def _resolve(self, path, cell=None, sep='/'):
+        # walk the instance path down from cell, evaluating the params of
+        # each instance in the context of the one above it
+        scope = self.get_cell(cell)
+        cell_ctx = scope._build_ctx({})
+        names = path.split(sep)
+        for depth, name in enumerate(names):
+            inst = scope.get_instance(name)
+            if not inst.is_linked:
+                raise core.LinkError("%r not linked yet" % inst)
+            inst_ctx = inst._build_ctx(cell_ctx)
+            if depth == len(names) - 1:
+                return inst, inst_ctx
+            if not inst.is_hierarchical:
+                raise core.CktObjDoesNotExist("'%s' in: '%s'" %
+                                              (sep.join(names[depth + 1:]),
+                                               inst))
+            scope = inst.ref
+            cell_ctx = scope._build_ctx(inst_ctx)
+
+    def handle(self, request):
+        """ Answer one decoded request """
+        try:
+            args = dict(request)
+            query = args.pop('query')
+            if query.startswith('_') or query in ('get_cell', 'handle'):
+                raise QueryError("unknown query '%s'" % query)
+            method = getattr(self, query, None)
+            if method is None:
+                raise QueryError("unknown query '%s'" % query)
+            args = dict((str(name), value) for name, value in args.items())
+            return dict(result=method(**args))
+        except Exception, e:
+            return dict(error="%s: %s" % (e.__class__.__name__, e))
+
+#-------------------------------------------------------------------------------
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+            except ValueError, e:
+                response = dict(error="ValueError: %s" % e)
+            else:
+                response = self.server.queries.handle(request)
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+class UnixQueryServer(SocketServer.ThreadingMixIn,
+                      SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, ckt, path):
+        SocketServer.UnixStreamServer.__init__(self, path, _RequestHandler)
+        self.queries = Queries(ckt)
+
+class TCPQueryServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, ckt, address):
+        SocketServer.TCPServer.__init__(self, address, _RequestHandler)
+        self.queries = Queries(ckt)
+
+def make_server(ckt, address):
+    """ Create a threaded query server for ckt
+
+    - address : UNIX socket path, or (host, port) tuple for TCP
+    """
+    if isinstance(address, tuple):
+        return TCPQueryServer(ckt, address)
+    return UnixQueryServer(ckt, address)
+
+#-------------------------------------------------------------------------------
+class Client(object):
+    """ Client for a query server at address (see make_server) """
+
+    def __init__(self, address):
+        if isinstance(address, tuple):
+            self.socket = socket.create_connection(address)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(address)
+        self.file = self.socket.makefile('rwb')
+
+    def query(self, query, **args):
+        args['query'] = query
+        self.file.write(json.dumps(args) + '\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise QueryError("connection closed by server")
+        response = json.loads(line)
+        if 'error' in response:
+            raise QueryError(response['error'])
+        return response['result']
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
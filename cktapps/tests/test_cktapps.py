@@ -1,14 +1,199 @@
 """ Test cktapps """
 
+import json
 import pytest
+import threading
 from StringIO import StringIO
 from collections import OrderedDict
 from textwrap import dedent
 
 from cktapps import core
+from cktapps import apps
+from cktapps import server
 from cktapps import Ckt
 from cktapps.formats import spice
-
+from cktapps.formats import verilog
+
+#-------------------------------------------------------------------------------
+# Netlists shared by several test classes
+
+def read_ckt(netlist, supply_nets=()):
+    """ Read and link a spice netlist string """
+    f = StringIO(netlist)
+    f.name = "<string>"
+    ckt = Ckt(supply_nets=supply_nets)
+    ckt.read_spice(f)
+    ckt.link()
+    return ckt
+
+HIER_NETLIST = dedent(
+    """\
+    .macromodel c c p n c=1
+    .macromodel pch_mac pmos d g s b m=1 cg="m*w*l*0.05"
+    .macromodel nch_mac nmos d g s b m=1 cg="m*w*l*0.05"
+
+    .subckt pinv a y vdd vss wp=1 wn=1
+    xmp y a vdd vdd pch_mac w=wp l=1
+    xmn y a vss vss nch_mac W=wn l=1
+    c1 y vss 1e-15
+    .ends
+
+    .subckt inv a y vdd vss wp=1 wn=1
+    xi0 a y vdd vss pinv wp=wp wn=wn
+    .ends
+
+    .subckt buf a y vdd vss wp=2 wn=2
+    xi0 a n vdd vss inv wp=wp wn=wn
+    xi1 n y vdd vss inv wp="2*wp" wn="2*wn"
+    c1 n vss 2e-15
+    .ends
+
+    .subckt top a y vdd vss
+    xb0 a n1 vdd vss buf
+    xb1 n1 n2 vdd vss buf wp=3
+    xi0 n2 y vdd vss pinv
+    mn0 n2 a vss vss nch_mac w=1 l=2
+    .ends
+    """)
+
+def make_hier_ckt():
+    return read_ckt(HIER_NETLIST)
+
+RC_NETLIST = dedent(
+    """\
+    .macromodel c c p n c=1
+    .macromodel pch_mac pmos d g s b m=1 cg="m*w*l*0.05"
+    .macromodel nch_mac nmos d g s b m=1 cg="m*w*l*0.05"
+    .subckt inv a y vdd vss
+    xmp y:1 a:1 vdd vdd pch_mac w=2 l=1
+    xmn y:2 a:2 vss vss nch_mac w=1 l=1
+    r1 a a:1 10
+    r2 a:1 a:2 10
+    r3 y y:1 5
+    ry2 y:1 y:2 r=5
+    c1 a:1 0 1f
+    c2 a:2 0 2f
+    c3 y:1 vss 1f
+    c4 y:2 vss 1f
+    c5 y:1 y:2 1f
+    c6 a:2 y:2 0.5f
+    rpu y vdd 1k
+    .ends
+    .subckt top a y vdd vss
+    x1 a n vdd vss inv
+    x2 n y vdd vss inv
+    .ends
+    """)
+
+def make_rc_ckt():
+    return read_ckt(RC_NETLIST)
+
+NESTED_NETLIST = dedent(
+    """\
+    .macromodel c c p n c=1
+    .subckt leaf a
+    c1 a k 1
+    .ends
+    .subckt mid a
+    x1 a leaf
+    .ends
+    .subckt top a
+    x1 a mid
+    x2 a mid
+    .ends
+    """)
+
+def make_nested_ckt():
+    return read_ckt(NESTED_NETLIST)
+
+LIBRARY_NETLIST = dedent(
+    """\
+    .macromodel c c p n c=1
+    .macromodel nch_mac nmos d g s b m=1 cg="m*w*l*0.05"
+    .subckt leaf a b
+    c1 a k 1e-15
+    xm1 b a k k nch_mac w=1 l=1
+    .ends
+    .subckt leaf_copy a b
+    c1 a k 1e-15
+    xm1 b a k k nch_mac w=1 l=1
+    .ends
+    .subckt top a b
+    x1 a n leaf
+    x2 n b leaf_copy
+    .ends
+    """)
+
+def make_library_ckt():
+    return read_ckt(LIBRARY_NETLIST)
+
+GLOBAL_NETLIST = dedent(
+    """\
+    .macromodel pch_mac pmos d g s b m=1 cg="m*w*l*0.05"
+    .macromodel nch_mac nmos d g s b m=1 cg="m*w*l*0.05"
+    .subckt inv a y
+    mp y a vdd vdd pch_mac w=2 l=1
+    mn y a vss vss nch_mac w=1 l=1
+    .ends
+    .subckt buf a y
+    x1 a n inv
+    x2 n y inv
+    .ends
+    .subckt top a y
+    x1 a n buf
+    x2 n y buf
+    .ends
+    """)
+
+def make_global_ckt(supply_nets=(), header=".global vdd\n"):
+    return read_ckt(header + GLOBAL_NETLIST, supply_nets)
+
+VERILOG_LIB = dedent(
+    """\
+    .global vdd vss
+    .macromodel pch_mac pmos d g s b m=1 cg="m*w*l*0.05"
+    .macromodel nch_mac nmos d g s b m=1 cg="m*w*l*0.05"
+    .subckt inv a y
+    xmp y a vdd vdd pch_mac w=2 l=1
+    xmn y a vss vss nch_mac w=1 l=1
+    .ends
+    """)
+
+VERILOG_NETLIST = dedent(
+    """\
+    // gate level netlist
+    `timescale 1ns/1ps
+    module reg4 (input clk, input [3:0] d, output [3:0] q);
+      wire [3:0] n;
+      inv u0 (.a(d[0]), .y(n[0])), u1 (.y(n[1]), .a(d[1]));
+      inv u2 (d[2], n[2]);
+      inv \u3[0] (.a(d[3]), .y(n[3])); /* escaped
+      name */
+      buf4 ub (.a(n), .y(q));
+      assign foo = bar;
+    endmodule
+
+    module buf4 (a, y);
+      input [3:0] a;
+      output [3:0] y;
+      inv b0 (.a(a[0]), .y(y[0]));
+      inv b1 (.a({a[1]}), .y(y[1]));
+      inv b2 (.a(1'b0), .y());
+    endmodule
+    """)
+
+def make_verilog_ckt():
+    ckt = Ckt()
+    f = StringIO(VERILOG_LIB)
+    f.name = "<lib>"
+    ckt.read_spice(f)
+    f = StringIO(VERILOG_NETLIST)
+    f.name = "<string>"
+    ckt.read_verilog(f)
+    ckt.link()
+    return ckt
+
+#-------------------------------------------------------------------------------
 class TestSpiceReadLine:
     def test_simple(self):
         f = StringIO("a b\n"
@@ -683,3 +868,1544 @@ class TestL4HierarchicalParams:
 
         i1_i0_mp = buf.get_instance('i1/i0/mp')
         assert i1_i0_mp.eval_ref_param('w') == 4.0
+
+class TestHierarchy:
+    def make_ckt(self):
+        f = StringIO(dedent(
+            """\
+            .macromodel pch_mac pmos d g s b m=1 cg="m*w*l*0.05"
+            .macromodel nch_mac nmos d g s b m=1 cg="m*w*l*0.05"
+
+            .subckt pinv a y vdd vss w=2 l=2.0
+            xmp y a vdd vdd pch_mac w="2*W" l=1.0
+            xmn y a vss vss nch_mac W=w     l=1.0
+            .ends
+
+            .subckt buf a y vdd vss
+            xi1 a n vdd vss pinv
+            xi2 n y vdd vss pinv w=3 l=3
+            .ends
+
+            .subckt top a y vdd vss
+            xb1 a n vdd vss buf
+            xi1 n y vdd vss pinv
+            .ends
+            """))
+        f.name = "<string>"
+        ckt = Ckt()
+        ckt.read_spice(f)
+        ckt.link()
+        return ckt
+
+    def test_edges(self):
+        ckt = self.make_ckt()
+        hier = ckt.hierarchy()
+        pinv, buf, top = [ckt.get_cell(n) for n in ('pinv', 'buf', 'top')]
+        assert hier.children(top) == OrderedDict([(buf, 1), (pinv, 1)])
+        assert hier.children(buf) == OrderedDict([(pinv, 2)])
+        assert hier.children(pinv) == OrderedDict()
+        assert hier.parents[pinv] == OrderedDict([(buf, 2), (top, 1)])
+
+    def test_order_and_depth(self):
+        ckt = self.make_ckt()
+        hier = ckt.hierarchy()
+        pinv, buf, top = [ckt.get_cell(n) for n in ('pinv', 'buf', 'top')]
+        assert hier.topological_order(top) == [top, buf, pinv]
+        assert hier.reverse_topological_order(top) == [pinv, buf, top]
+        assert hier.topological_order(buf) == [buf, pinv]
+        assert hier.depth[top] == 0
+        assert hier.depth[buf] == 1
+        assert hier.depth[pinv] == 2
+
+    def test_topcells(self):
+        ckt = self.make_ckt()
+        assert ckt.get_topcells() == [ckt.get_cell('top')]
+
+    def test_cached_and_invalidated(self):
+        ckt = self.make_ckt()
+        hier = ckt.hierarchy()
+        assert ckt.hierarchy() is hier
+        ckt.get_cell('top').del_instance('b1')
+        assert ckt.hierarchy() is not hier
+        assert ckt.get_topcells() == [ckt.get_cell('buf'),
+                                      ckt.get_cell('top')]
+
+    def test_flattened_copy_keeps_cache(self):
+        ckt = self.make_ckt()
+        hier = ckt.hierarchy()
+        flat = ckt.get_cell('top').flattened()
+        flat.del_instance(list(flat.instances)[0])
+        assert ckt.hierarchy() is hier
+
+    def test_cycle(self):
+        f = StringIO(dedent(
+            """\
+            .subckt c1 a
+            xi a c2
+            .ends
+            .subckt c2 a
+            xi a c1
+            .ends
+            """))
+        f.name = "<string>"
+        ckt = Ckt()
+        ckt.read_spice(f)
+        with pytest.raises(core.LinkError) as e:
+            ckt.link()
+        assert e.value.message == "cyclic cell hierarchy: /c1, /c2"
+
+class TestHierarchyStats:
+    def make_ckt(self):
+        f = StringIO(dedent(
+            """\
+            .macromodel c c p n c=1
+            .macromodel pch_mac pmos d g s b m=1 cg="m*w*l*0.05"
+            .macromodel nch_mac nmos d g s b m=1 cg="m*w*l*0.05"
+
+            .subckt pinv a y vdd vss w=2 l=2.0
+            xmp y a vdd vdd pch_mac w="2*W" l=1.0 m=2
+            xmn y a vss vss nch_mac W=w     l=1.0
+            c1 y vss 1e-15
+            .ends
+
+            .subckt buf a y vdd vss
+            xi1 a n vdd vss pinv
+            xi2 n y vdd vss pinv m=3
+            .ends
+
+            .subckt top a y vdd vss
+            xb1 a n vdd vss buf
+            xb2 n y vdd vss buf
+            xi1 n y vdd vss pinv
+            .ends
+            """))
+        f.name = "<string>"
+        ckt = Ckt()
+        ckt.read_spice(f)
+        ckt.link()
+        return ckt
+
+    def test_devices(self):
+        ckt = self.make_ckt()
+        stats = apps.HierarchyStats(ckt.get_cell('top'))
+        pinv, buf = ckt.get_cell('pinv'), ckt.get_cell('buf')
+        assert stats.devices[pinv] == {'pch_mac': 2, 'nch_mac': 1, 'c': 1}
+        assert stats.devices[buf] == {'pch_mac': 8, 'nch_mac': 4, 'c': 4}
+        assert stats.totals() == {'pch_mac': 18, 'nch_mac': 9, 'c': 9}
+
+    def test_occurrences(self):
+        ckt = self.make_ckt()
+        top = ckt.get_cell('top')
+        stats = apps.HierarchyStats(top)
+        assert stats.occurrences[top] == 1
+        assert stats.occurrences[ckt.get_cell('buf')] == 2
+        assert stats.occurrences[ckt.get_cell('pinv')] == 5
+
+    def test_summary_depth(self, capsys):
+        ckt = self.make_ckt()
+        # a longer path to buf and pinv from another top cell
+        f = StringIO(dedent(
+            """\
+            .subckt wrap a y vdd vss
+            x1 a y vdd vss buf
+            .ends
+            .subckt wrap2 a y vdd vss
+            x1 a y vdd vss wrap
+            .ends
+            """))
+        f.name = "<string>"
+        ckt.read_spice(f)
+        ckt.link()
+        top = ckt.get_cell('top')
+        depths = ckt.hierarchy().depths(top)
+        assert depths == {top: 0, ckt.get_cell('buf'): 1,
+                          ckt.get_cell('pinv'): 2}
+        apps.report_hierarchy_summary(top)
+        out = capsys.readouterr()[0]
+        assert "  /buf        1            2        16  " in out
+        assert "  /pinv       2            5         4  " in out
+
+class TestHierNetCaps:
+    def make_ckt(self):
+        return make_hier_ckt()
+
+    def test_matches_flatten(self):
+        ckt = self.make_ckt()
+        top = ckt.get_cell('top')
+        hier = dict((row[0], row[1:]) for row in apps.hier_net_caps(top))
+        top.ungroup(flatten=True)
+        flat = dict((row[0], row[1:]) for row in apps.net_caps(top))
+        assert sorted(hier) == sorted(flat)
+        for netname, caps in flat.items():
+            assert hier[netname] == pytest.approx(caps)
+
+    def test_does_not_flatten(self):
+        ckt = self.make_ckt()
+        top = ckt.get_cell('top')
+        rows = list(apps.hier_net_caps(top))
+        assert [row[0] for row in rows][:4] == ['a', 'y', 'vdd', 'vss']
+        assert 'b1/n' in [row[0] for row in rows]
+        assert top.get_instance('b0').is_hierarchical
+
+class TestRefParamCache:
+    def make_ckt(self):
+        return make_hier_ckt()
+
+    def test_eval(self):
+        ckt = self.make_ckt()
+        top = ckt.get_cell('top')
+        top.ungroup(flatten=True)
+        cache = apps.RefParamCache()
+        for inst in top.all_instances():
+            name = 'c' if inst.refname == 'c' else 'cg'
+            assert cache.eval(inst, name) == inst.eval_ref_param(name)
+        assert cache.misses == 11
+        assert cache.hits == 7
+        assert cache.hit_rate() == 7.0/18
+
+    def test_missing(self):
+        ckt = self.make_ckt()
+        inst = ckt.get_cell('top').get_instance('mn0')
+        cache = apps.RefParamCache()
+        with pytest.raises(core.CktObjDoesNotExist):
+            cache.eval(inst, 'xx')
+
+    def test_net_caps(self):
+        ckt = self.make_ckt()
+        top = ckt.get_cell('top')
+        top.ungroup(flatten=True)
+        cache = apps.RefParamCache()
+        list(apps.net_caps(top, cache=cache))
+        assert cache.misses == 11
+        assert cache.hits == 36
+
+@pytest.mark.skipif(apps.numpy is None, reason="requires numpy")
+class TestVectorNetCaps:
+    def test_matches_net_caps(self):
+        ckt = make_hier_ckt()
+        top = ckt.get_cell('top')
+        top.ungroup(flatten=True)
+        rows = list(apps.net_caps(top))
+        vrows = list(apps.vector_net_caps(top))
+        assert [row[0] for row in vrows] == [row[0] for row in rows]
+        for row, vrow in zip(rows, vrows):
+            assert vrow[1:] == pytest.approx(row[1:])
+
+    def test_unconnected_ports(self):
+        ckt = make_verilog_ckt()
+        flat = ckt.get_cell('reg4').flattened()
+        flat.get_instance('ub/b2/mp').pins.pop(0)
+        rows = list(apps.net_caps(flat))
+        vrows = list(apps.vector_net_caps(flat))
+        for row, vrow in zip(rows, vrows):
+            assert vrow[0] == row[0]
+            assert vrow[1:] == pytest.approx(row[1:])
+
+    def test_non_numeric_params(self):
+        ckt = make_hier_ckt()
+        top = ckt.get_cell('top').flattened()
+        top.get_instance('mn0').add_param('tag', "'slow'")
+        rows = list(apps.net_caps(top))
+        vrows = list(apps.vector_net_caps(top))
+        for row, vrow in zip(rows, vrows):
+            assert vrow[1:] == pytest.approx(row[1:])
+
+class TestReportNet:
+    def make_cell(self):
+        ckt = make_hier_ckt()
+        top = ckt.get_cell('top')
+        top.ungroup(flatten=True)
+        return top
+
+    def report_nets(self, capsys, **kwargs):
+        apps.report_net(self.make_cell(), 'lib', ['netlist'], **kwargs)
+        out = capsys.readouterr()[0]
+        table = out.split('\n\n')[-1].splitlines()
+        return [line.split()[0] for line in table[3:-1]]
+
+    def test_sorted(self, capsys):
+        nets = self.report_nets(capsys)
+        assert len(nets) == 8
+        assert nets[:4] == ['b0/n', 'b1/n', 'n1', 'n2']
+
+    def test_top(self, capsys):
+        assert self.report_nets(capsys, top=3) == ['b0/n', 'b1/n', 'n1']
+
+    def test_stream(self, capsys):
+        nets = self.report_nets(capsys, stream=True)
+        assert nets == ['a', 'y', 'vdd', 'vss', 'n1', 'n2', 'b0/n', 'b1/n']
+
+    def test_top_stream(self):
+        with pytest.raises(ValueError):
+            apps.report_net(self.make_cell(), 'lib', ['netlist'], top=3,
+                            stream=True)
+
+class TestWriteRows:
+    rows = [('n1', 1.0, 2.0, 0.5, 6.0), ('n2', 1.5, 0.0, 0.0, 0.0)]
+
+    def test_csv(self):
+        f = StringIO()
+        apps.write_rows(f, 'csv', apps.NET_FIELDS, iter(self.rows),
+                        chunk_size=1)
+        assert f.getvalue() == ("net,cwire,cload,cdriver,fanout\n"
+                                "n1,1.0,2.0,0.5,6.0\n"
+                                "n2,1.5,0.0,0.0,0.0\n")
+
+    def test_jsonl(self):
+        f = StringIO()
+        apps.write_rows(f, 'jsonl', apps.NET_FIELDS, iter(self.rows))
+        lines = f.getvalue().splitlines()
+        assert len(lines) == 2
+        assert lines[0] == ('{"net": "n1", "cwire": 1.0, "cload": 2.0, '
+                            '"cdriver": 0.5, "fanout": 6.0}')
+
+    @pytest.mark.skipif(apps.numpy is None, reason="requires numpy")
+    def test_npz(self, tmpdir):
+        path = str(tmpdir.join('rows.npz'))
+        apps.write_rows(path, 'npz', apps.NET_FIELDS, iter(self.rows))
+        data = apps.numpy.load(path)
+        assert list(data['net']) == ['n1', 'n2']
+        assert list(data['fanout']) == [6.0, 0.0]
+
+    def test_bad_format(self):
+        with pytest.raises(ValueError):
+            apps.write_rows(StringIO(), 'xml', apps.NET_FIELDS, self.rows)
+
+    def test_hierarchy_rows(self):
+        ckt = make_hier_ckt()
+        rows = list(apps.hierarchy_rows(ckt.get_cell('buf')))
+        assert rows[:3] == [('i0', 'inv', 0), ('i0/i0', 'pinv', 1),
+                            ('i0/i0/mp', 'pch_mac', 2)]
+
+class TestParallelNetCaps:
+    def test_matches_net_caps(self):
+        ckt = make_hier_ckt()
+        top = ckt.get_cell('top')
+        top.ungroup(flatten=True)
+        assert (list(apps.parallel_net_caps(top, jobs=2)) ==
+                list(apps.net_caps(top)))
+
+    def test_partitions(self):
+        ckt = make_hier_ckt()
+        top = ckt.get_cell('top')
+        top.ungroup(flatten=True)
+        rows = apps.parallel_net_caps(top, jobs=2,
+                                      partitions=[['y', 'vss'], ['a']])
+        # in net order, whatever the partitions
+        assert rows == [row for row in apps.net_caps(top)
+                        if row[0] in ('a', 'y', 'vss')]
+
+    def test_interleaved(self):
+        ckt = make_hier_ckt()
+        top = ckt.get_cell('top')
+        flat = top.flattened()
+        buf = ckt.get_cell('buf').flattened()
+        rows = apps.parallel_net_caps(flat, jobs=2)
+        buf_rows = apps.parallel_net_caps(buf, jobs=2)
+        assert rows == list(apps.net_caps(flat))
+        assert buf_rows == list(apps.net_caps(buf))
+        assert apps._shared == {}
+
+class TestIncrementalNetCaps:
+    def make_cell(self):
+        ckt = make_hier_ckt()
+        top = ckt.get_cell('top')
+        top.ungroup(flatten=True)
+        return top
+
+    def check(self, caps, cell):
+        rows = list(caps.rows())
+        assert [row[0] for row in rows] == [net.name for net in
+                                            cell.all_nets()]
+        for row, fresh in zip(rows, apps.net_caps(cell)):
+            assert row[1:] == pytest.approx(fresh[1:], abs=1e-12)
+
+    def test_initial(self):
+        cell = self.make_cell()
+        self.check(apps.IncrementalNetCaps(cell), cell)
+
+    def test_del_instance(self):
+        cell = self.make_cell()
+        caps = apps.IncrementalNetCaps(cell)
+        cell.del_instance('b0/i1/i0/mp')
+        cell.del_instance('b1/c1')
+        self.check(caps, cell)
+
+    def test_add_instance(self):
+        cell = self.make_cell()
+        caps = apps.IncrementalNetCaps(cell)
+        inst = cell.add_instance('mn1', 'nch_mac', params={'w': '4', 'l': '1'})
+        inst.ref = cell.root().get_prim('nch_mac')
+        inst.is_linked = True
+        for portname, netname in zip('dgsb', ('y', 'n1', 'vss', 'vss')):
+            inst.add_pin(portname, cell.get_net(netname))
+        assert caps.get('n1')[1] == pytest.approx(0.25 + 0.2)
+        self.check(caps, cell)
+
+    def test_set_param(self):
+        cell = self.make_cell()
+        caps = apps.IncrementalNetCaps(cell)
+        before = caps.get('vss')
+        mn = cell.get_instance('b1/i0/i0/mn')
+        mn.add_param('w', '10')
+        assert mn.eval_ref_param('w') == 10
+        assert mn.eval_ref_param('cg') == 0.5
+        cell.get_instance('mn0').add_param('l', '3')
+        assert caps.get('vss')[2] == pytest.approx(before[2] + 0.4 + 0.05)
+        self.check(caps, cell)
+
+    def test_set_param_library(self):
+        ckt = make_hier_ckt()
+        top = ckt.get_cell('top')
+        expected = list(apps.net_caps(top.flattened()))
+        flat = top.flattened()
+        caps = apps.IncrementalNetCaps(flat)
+        flat.get_instance('b1/i0/i0/mn').add_param('w', '10')
+        flat.get_instance('mn0').add_param('l', '3')
+        self.check(caps, flat)
+        # the library cells and the other placements are left unchanged
+        assert ckt.get_cell('pinv').get_instance('mn').params['w'].value == 'wn'
+        assert top.get_instance('mn0').params['l'].value == '2'
+        assert flat.get_instance('b0/i0/i0/mn').eval_ref_param('cg') == 0.1
+        assert list(apps.net_caps(top.flattened())) == expected
+
+    def test_close(self):
+        cell = self.make_cell()
+        caps = apps.IncrementalNetCaps(cell)
+        before = caps.get('vss')
+        caps.close()
+        cell.del_instance('mn0')
+        assert caps.get('vss') == before
+
+class TestQueryServer:
+    def make_ckt(self):
+        return make_hier_ckt()
+
+    def test_queries(self):
+        queries = server.Queries(self.make_ckt())
+        assert queries.cells()[0] == 'top'
+        assert queries.report_net(cell='buf', top=1)[0][0] == 'n'
+        assert queries.eval('b1/i1/i0/mp', 'w') == 6
+        assert queries.eval('b1/i1/i0/mp', 'cg') == pytest.approx(0.3)
+        assert queries.lookup('b1/c1')['pins'] == [('p', 'n'), ('n', 'vss')]
+
+    def test_handle_errors(self):
+        queries = server.Queries(self.make_ckt())
+        assert 'error' in queries.handle({'query': '_resolve'})
+        assert 'error' in queries.handle({'query': 'lookup', 'path': 'b9'})
+        assert queries.handle({'query': 'eval', 'path': 'mn0',
+                               'param': 'l'}) == {'result': 2}
+
+    def test_client(self, tmpdir):
+        path = str(tmpdir.join('ckt.sock'))
+        srv = server.make_server(self.make_ckt(), path)
+        thread = threading.Thread(target=srv.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            client = server.Client(path)
+            rows = client.query('report_net', top=2)
+            assert [row[0] for row in rows] == ['b0/n', 'b1/n']
+            with pytest.raises(server.QueryError):
+                client.query('eval', path='mn0', param='xx')
+            assert client.query('report_hierarchy', cell='inv') == [
+                ['i0', 'pinv', 0], ['i0/mp', 'pch_mac', 1],
+                ['i0/mn', 'nch_mac', 1], ['i0/c1', 'c', 1]]
+            client.close()
+        finally:
+            srv.shutdown()
+            srv.server_close()
+
+class TestFlattened:
+    def make_ckt(self):
+        return make_nested_ckt()
+
+    def test_flattened(self):
+        ckt = self.make_ckt()
+        top = ckt.get_cell('top')
+        flat = top.flattened()
+        assert list(flat.instances) == ['1/1/c1', '2/1/c1']
+        assert list(flat.nets) == ['a', '1/1/k', '2/1/k']
+        assert list(top.instances) == ['1', '2']
+        assert list(top.nets) == ['a']
+
+    def test_ungroup_keeps_children(self):
+        ckt = self.make_ckt()
+        ckt.get_cell('top').ungroup(flatten=True)
+        assert list(ckt.get_cell('mid').nets) == ['a']
+        assert list(ckt.get_cell('mid').instances) == ['1']
+
+class TestNetGraph:
+    def make_graph(self):
+        top = make_hier_ckt().get_cell('top')
+        return apps.NetGraph(top.flattened())
+
+    def test_fanout(self):
+        graph = self.make_graph()
+        cone = graph.fanout('a')
+        assert list(cone.nets.items()) == [
+            ('a', 0), ('n2', 1), ('b0/n', 1), ('y', 2), ('n1', 2),
+            ('b1/n', 3)]
+        assert cone.devices['mn0'] == 1
+        assert cone.devices['b1/i1/i0/mn'] == 4
+        assert 'vss' not in cone.nets
+
+    def test_fanin(self):
+        graph = self.make_graph()
+        cone = graph.fanin('y', depth=2)
+        assert list(cone.nets.items()) == [
+            ('y', 0), ('n2', 1), ('a', 2), ('b1/n', 2)]
+        assert list(cone.devices) == ['i0/mp', 'i0/mn', 'mn0',
+                                      'b1/i1/i0/mp', 'b1/i1/i0/mn']
+
+    def test_stop(self):
+        graph = self.make_graph()
+        cone = graph.fanout('a', stop=graph.stop_nets(['n1']))
+        assert list(cone.nets) == ['a', 'n2', 'b0/n', 'y']
+        cone = graph.fanout('a', depth=1, stop=graph.stop_nets(pattern=None))
+        assert list(cone.nets) == ['a', 'n2', 'vss', 'b0/n', 'vdd']
+
+    def test_channels(self):
+        f = StringIO(dedent(
+            """\
+            .macromodel pch_mac pmos d g s b m=1 cg="m*w*l*0.05"
+            .macromodel nch_mac nmos d g s b m=1 cg="m*w*l*0.05"
+            .subckt tgate a en enb y vdd vss
+            mp1 x a vdd vdd pch_mac w=1 l=1
+            mn1 x a vss vss nch_mac w=1 l=1
+            mp2 z enb x vdd pch_mac w=1 l=1
+            mn2 x en z vss nch_mac w=1 l=1
+            mp3 y z vdd vdd pch_mac w=1 l=1
+            mn3 y z vss vss nch_mac w=1 l=1
+            .ends
+            """))
+        f.name = "<string>"
+        ckt = Ckt()
+        ckt.read_spice(f)
+        ckt.link()
+        graph = apps.NetGraph(ckt.get_cell('tgate'))
+        # by default the cone stops at the pass gate
+        assert list(graph.fanout('a').nets.items()) == [('a', 0), ('x', 1)]
+        cone = graph.fanout('a', channels=True)
+        assert list(cone.nets.items()) == [('a', 0), ('x', 1), ('z', 2),
+                                           ('y', 3)]
+        assert cone.devices['mn2'] == 2
+
+    def test_components(self):
+        f = StringIO(dedent(
+            """\
+            .macromodel pch_mac pmos d g s b m=1 cg="m*w*l*0.05"
+            .macromodel nch_mac nmos d g s b m=1 cg="m*w*l*0.05"
+            .subckt nand a b y vdd vss
+            mp1 y a vdd vdd pch_mac w=1 l=1
+            mp2 y b vdd vdd pch_mac w=1 l=1
+            mn1 y a k vss nch_mac w=1 l=1
+            mn2 k b vss vss nch_mac w=1 l=1
+            mp3 z y vdd vdd pch_mac w=1 l=1
+            mn3 z y vss vss nch_mac w=1 l=1
+            .ends
+            """))
+        f.name = "<string>"
+        ckt = Ckt()
+        ckt.read_spice(f)
+        ckt.link()
+        cell = ckt.get_cell('nand')
+        comps = apps.NetGraph(cell).components()
+        assert [comp.devices for comp in comps] == [
+            ['mp1', 'mp2', 'mn1', 'mn2'], ['mp3', 'mn3']]
+        assert comps[0].nets == ['y', 'k']
+        assert comps[0].inputs == ['a', 'b']
+        assert comps[0].outputs == ['y']
+        assert comps[1].inputs == ['y']
+        assert comps[1].outputs == []
+
+    def test_ccc_partitions(self):
+        ckt = make_hier_ckt()
+        top = ckt.get_cell('top')
+        top.ungroup(flatten=True)
+        partitions = apps.ccc_partitions(top, 2)
+        assert partitions[0][0] == 'n2'
+        assert sorted(sum(partitions, [])) == sorted(top.nets)
+        assert (sorted(apps.parallel_net_caps(top, 2, partitions)) ==
+                sorted(apps.net_caps(top)))
+
+class TestGlobalNets:
+    def make_ckt(self, supply_nets=(), header=".global vdd\n"):
+        return make_global_ckt(supply_nets, header)
+
+    def test_flatten(self):
+        ckt = self.make_ckt()
+        vdd = ckt.global_nets['vdd']
+        assert ckt.get_cell('inv').get_net('vdd') is vdd
+        assert not ckt.get_cell('inv').get_net('vss').is_global
+
+        flat = ckt.get_cell('top').flattened()
+        assert flat.get_net('vdd') is vdd
+        assert 'vss' not in flat.nets
+        assert '1/1/vss' in flat.nets
+        pins = [pin for inst in flat.all_instances()
+                for pin in inst.all_pins() if pin.net is vdd]
+        assert len(pins) == 8
+
+    def test_supply_nets(self):
+        ckt = self.make_ckt(supply_nets=['vss'], header="")
+        assert ckt.is_global('vss')
+        assert list(ckt.global_nets) == ['vss']
+        flat = ckt.get_cell('top').flattened()
+        assert [name for name in flat.nets if name.endswith('vss')] == ['vss']
+
+    def test_hier_net_caps(self):
+        ckt = self.make_ckt(supply_nets=['vss'])
+        top = ckt.get_cell('top')
+        hier = dict((row[0], row[1:]) for row in apps.hier_net_caps(top))
+        flat = dict((row[0], row[1:])
+                    for row in apps.net_caps(top.flattened()))
+        assert sorted(hier) == sorted(flat)
+        for name in flat:
+            assert hier[name] == pytest.approx(flat[name])
+        assert hier['vdd'][2] == pytest.approx(4*0.1)
+
+class TestSupplyNets:
+    def make_flat(self):
+        return make_hier_ckt().get_cell('top').flattened()
+
+    def test_skip(self):
+        flat = self.make_flat()
+        summary = OrderedDict()
+        rows = list(apps.net_caps(flat, supplies=apps.SupplyNets(),
+                                  summary=summary))
+        assert [row[0] for row in rows] == ['a', 'y', 'n1', 'n2', 'b0/n',
+                                            'b1/n']
+        assert rows == [row for row in apps.net_caps(flat)
+                        if row[0] not in ('vdd', 'vss')]
+        assert summary == OrderedDict([('vdd', [5, 0, 0]),
+                                       ('vss', [6, 0, 7])])
+
+    def test_max_pins(self):
+        flat = self.make_flat()
+        summary = OrderedDict()
+        supplies = apps.SupplyNets(names=['a'], pattern=None, max_pins=5)
+        rows = list(apps.net_caps(flat, supplies=supplies, summary=summary))
+        assert [row[0] for row in rows] == ['y', 'vdd', 'n1']
+        assert list(summary) == ['a', 'vss', 'n2', 'b0/n', 'b1/n']
+        assert summary['n2'] == [3, 2, 1]
+
+    def test_parallel(self):
+        flat = self.make_flat()
+        supplies = apps.SupplyNets()
+        assert (sorted(apps.parallel_net_caps(flat, 2, supplies=supplies)) ==
+                sorted(apps.net_caps(flat, supplies=supplies)))
+
+    def test_report_net(self, capsys):
+        flat = self.make_flat()
+        with pytest.raises(ValueError):
+            apps.report_net(flat, 'lib', ['netlist'], hierarchical=True,
+                            supplies=apps.SupplyNets())
+        apps.report_net(flat, 'lib', ['netlist'], supplies=apps.SupplyNets(),
+                        summarize_supplies=True)
+        out = capsys.readouterr()[0]
+        assert "Supply nets" in out
+        assert "  vss         6       0      7  " in out
+
+    def test_report_net_format(self, capsys):
+        flat = self.make_flat()
+        f = StringIO()
+        apps.report_net(flat, 'lib', ['netlist'], supplies=apps.SupplyNets(),
+                        summarize_supplies=True, format='csv', f=f)
+        assert 'vss' not in f.getvalue()
+        out, err = capsys.readouterr()
+        assert out == ''
+        assert "  vss         6       0      7  " in err
+
+class TestMergeParallelDevices:
+    def make_ckt(self):
+        f = StringIO(dedent(
+            """\
+            .macromodel c c p n c=1
+            .macromodel pch_mac pmos d g s b m=1 cg="m*w*l*0.05"
+            .macromodel nch_mac nmos d g s b m=1 cg="m*w*l*0.05"
+            .macromodel sq_mac nmos d g s b m=1 cg="m*m*w*0.05"
+            .subckt inv a y vdd vss wn=1
+            xmp1 y a vdd vdd pch_mac w=2 l=1
+            xmp2 vdd a y vdd pch_mac w=2 l=1 m=2
+            xmn1 y a vss vss nch_mac w=wn l=1
+            xmn2 y a vss vss nch_mac w=1 l=1
+            xmn3 y a vss vss nch_mac w=2 l=1
+            xms1 y a vss vss sq_mac w=1
+            xms2 y a vss vss sq_mac w=1
+            c1 y vss 1e-15
+            .ends
+            .subckt top a y vdd vss
+            x1 a y vdd vss inv
+            .ends
+            """))
+        f.name = "<string>"
+        ckt = Ckt()
+        ckt.read_spice(f)
+        ckt.link()
+        return ckt
+
+    def test_merge(self):
+        top = self.make_ckt().get_cell('top')
+        top.ungroup(flatten=True)
+        before = list(apps.net_caps(top))
+        merged = apps.merge_parallel_devices(top)
+        assert merged == OrderedDict([('1/mp1', ['1/mp1', '1/mp2']),
+                                      ('1/mn1', ['1/mn1', '1/mn2'])])
+        assert list(top.instances) == ['1/mp1', '1/mn1', '1/mn3', '1/ms1',
+                                       '1/ms2', '1/c1']
+        assert top.get_instance('1/mp1').params['m'].value == '3'
+        after = list(apps.net_caps(top))
+        for row, expected in zip(after, before):
+            assert row[0] == expected[0]
+            assert row[1:] == pytest.approx(expected[1:])
+
+    def test_merge_w(self):
+        top = self.make_ckt().get_cell('top')
+        top.ungroup(flatten=True)
+        merged = apps.merge_parallel_devices(top, by='w')
+        assert merged == OrderedDict([('1/mn1', ['1/mn1', '1/mn2', '1/mn3']),
+                                      ('1/ms1', ['1/ms1', '1/ms2'])])
+        assert top.get_instance('1/mn1').eval_ref_param('w') == 4
+
+    def test_library_unchanged(self):
+        f = StringIO(dedent(
+            """\
+            .macromodel nch_mac nmos d g s b m=1 cg="m*w*l"
+            .subckt cell a vss
+            xm1 vss a vss vss nch_mac w=2 l=1
+            xm2 vss a vss vss nch_mac w=2 l=1
+            .ends
+            .subckt top a b vss
+            x1 a vss cell
+            x2 b vss cell
+            .ends
+            """))
+        f.name = "<string>"
+        ckt = Ckt()
+        ckt.read_spice(f)
+        ckt.link()
+        top = ckt.get_cell('top')
+        flat = top.flattened()
+        merged = apps.merge_parallel_devices(flat)
+        assert list(merged) == ['1/m1', '2/m1']
+        assert 'm' not in ckt.get_cell('cell').get_instance('m1').params
+        for cell in (flat, top.flattened()):
+            rows = dict((row[0], row[1:]) for row in apps.net_caps(cell))
+            assert rows['a'] == rows['b'] == (0, 4, 0)
+
+class TestReduceRC:
+    def make_ckt(self):
+        return make_rc_ckt()
+
+    def test_read(self):
+        ckt = self.make_ckt()
+        inv = ckt.get_cell('inv')
+        assert inv.resistors[:2] == [core.Resistor('r1', 'a', 'a:1', '10'),
+                                     core.Resistor('r2', 'a:1', 'a:2', '10')]
+        assert inv.resistors[3].value == '5'
+        assert inv.resistors[4].value == '1000.0'
+        assert inv.get_net('0') is ckt.global_nets['0']
+
+    def test_flatten(self):
+        top = self.make_ckt().get_cell('top').flattened()
+        assert len(top.resistors) == 10
+        assert top.resistors[2] == core.Resistor('1/r3', 'n', '1/y:1', '5')
+        assert '0' in top.nets and '1/0' not in top.nets
+        assert '1/y:1' in top.nets
+
+    def test_reduce(self):
+        top = self.make_ckt().get_cell('top').flattened()
+        rc = apps.reduce_rc(top, keep_tree=True)
+        assert rc.nets == OrderedDict([
+            ('a', ['a', '1/a:1', '1/a:2']),
+            ('y', ['y', '2/y:1', '2/y:2']),
+            ('n', ['n', '1/y:1', '1/y:2', '2/a:1', '2/a:2'])])
+        assert [res.name for res in rc.resistors['n']] == [
+            '1/r3', '1/ry2', '2/r1', '2/r2']
+        assert [res.name for res in top.resistors] == ['1/rpu', '2/rpu']
+        assert list(top.nets) == ['a', 'y', 'vdd', 'vss', 'n', '0']
+        assert list(top.instances) == [
+            '1/mp', '1/mn', '1/c1', '1/c3', '1/c6',
+            '2/mp', '2/mn', '2/c1', '2/c3', '2/c6']
+        caps = dict((row[0], row[1:]) for row in apps.net_caps(top))
+        assert caps['a'] == pytest.approx((3.5e-15, 0.15, 0))
+        # c5 (y:1 to y:2) is shorted out
+        assert caps['n'] == pytest.approx((6e-15, 0.15, 0.15))
+        assert caps['0'] == pytest.approx((6e-15, 0, 0))
+
+    def test_library_unchanged(self):
+        ckt = self.make_ckt()
+        top = ckt.get_cell('top')
+        apps.reduce_rc(top.flattened())
+        inv = ckt.get_cell('inv')
+        assert inv.get_instance('c1').params['c'].value == '1e-15'
+        assert len(inv.resistors) == 5
+        caps = dict((row[0], row[1:]) for row in
+                    apps.net_caps(top.flattened()))
+        assert caps['1/a:1'] == pytest.approx((1e-15, 0.1, 0))
+
+    def test_supplies(self):
+        top = read_ckt(dedent(
+            """\
+            .macromodel c c p n c=1
+            .macromodel nch_mac nmos d g s b m=1
+            .subckt top a y vdd vss vddx
+            xmn y a vss vss nch_mac
+            xmp y a vdd:1 vdd:1 nch_mac
+            rv vdd vdd:1 1
+            rb vdd vss 1meg
+            rsw vdd vddx 10
+            c1 y vss 1f
+            c2 y vdd 2f
+            c3 y vdd:1 4f
+            .ends
+            """)).get_cell('top')
+        rc = apps.reduce_rc(top)
+        assert rc.nets == OrderedDict([('vdd', ['vdd', 'vdd:1'])])
+        assert [res.name for res in top.resistors] == ['rb', 'rsw']
+        assert list(top.nets) == ['a', 'y', 'vdd', 'vss', 'vddx']
+        mp = top.get_instance('mp')
+        assert [pin.net.name for pin in mp.all_pins()] == [
+            'y', 'a', 'vdd', 'vdd']
+        mn = top.get_instance('mn')
+        assert [pin.net.name for pin in mn.all_pins()] == [
+            'y', 'a', 'vss', 'vss']
+        caps = [(inst.name, [pin.net.name for pin in inst.all_pins()])
+                for inst in top.all_instances() if inst.refname == 'c']
+        assert caps == [('c1', ['y', 'vss']), ('c2', ['y', 'vdd'])]
+        assert (float(top.get_instance('c2').params['c'].value) ==
+                pytest.approx(6e-15))
+
+class TestParasitics:
+    dspf = dedent(
+        """\
+        *|DSPF 1.3
+        *|DESIGN "top"
+        *|DIVIDER .
+        *|GROUND_NET vss
+        .SUBCKT top a y vdd vss
+        *|NET n1 0.004PF
+        *|P (n1 B 0.0)
+        *|I (b0.i1.i0.mp:d b0.i1.i0.mp d B 0.0)
+        Cn1_1 n1:1 vss 0.003PF
+        Cn1_2 n1:1 n2:1 1fF
+        Rn1_1 n1 n1:1 12.5
+        *|NET b0.n 2e-15
+        C1 b0.n:1 vss 2e-15
+
+        * Instance Section
+        Xmn0 n2 a vss vss nch_mac
+        .ENDS
+        """)
+
+    spef = dedent(
+        """\
+        *SPEF "IEEE 1481-1998"
+        *DESIGN "top"
+        *DIVIDER /
+        *DELIMITER :
+        *C_UNIT 1 FF
+        *R_UNIT 1 KOHM
+
+        *NAME_MAP
+        *1 n1
+        *2 b0/n
+
+        *D_NET *1 4.0
+        *CONN
+        *P n1 B
+        *CAP
+        1 *1:1 3.0 // grounded
+        2 *1:1 n2:1 0.9:1.0:1.1
+        *RES
+        1 *1 *1:1 0.0125
+        *END
+
+        *D_NET *2 2
+        *END
+        """)
+
+    def read(self, format, detail=True):
+        ckt = make_hier_ckt()
+        top = ckt.get_cell('top')
+        f = StringIO(getattr(self, format))
+        f.name = "<string>"
+        getattr(ckt, 'read_' + format)(f, top, detail=detail)
+        return top
+
+    @pytest.mark.parametrize('format', ['dspf', 'spef'])
+    def test_read(self, format):
+        parasitics = self.read(format).parasitics
+        assert list(parasitics.caps) == ['n1', 'b0/n']
+        assert parasitics.caps['n1'] == pytest.approx(4e-15)
+        assert parasitics.caps['b0/n'] == pytest.approx(2e-15)
+        details = parasitics.details['n1']
+        assert [(e.type, e.p, e.n) for e in details] == [
+            ('c', 'n1:1', '0'), ('c', 'n1:1', 'n2:1'), ('r', 'n1', 'n1:1')]
+        assert [e.value for e in details] == pytest.approx(
+            [3e-15, 1e-15, 12.5])
+
+    def test_no_detail(self):
+        parasitics = self.read('spef', detail=False).parasitics
+        assert len(parasitics.caps) == 2
+        assert parasitics.details == {}
+
+    def test_report_net(self):
+        top = self.read('dspf')
+        flat = top.flattened()
+        schematic = dict((row[0], row[1]) for row in apps.net_caps(flat))
+        f = StringIO()
+        apps.report_net(flat, 'lib', ['netlist'], format='jsonl', f=f)
+        cwire = dict((row['net'], row['cwire'])
+                     for row in map(json.loads, f.getvalue().splitlines()))
+        assert cwire['n1'] == pytest.approx(4.0)
+        assert cwire['b0/n'] == pytest.approx(2.0)
+        assert cwire['n2'] == pytest.approx(schematic['n2']*1e15)
+
+class TestVerilog:
+    def make_ckt(self):
+        return make_verilog_ckt()
+
+    def test_read_statements(self):
+        f = StringIO("module m (a); // c\n  inv \\x[0] (.a(a));\nendmodule\n")
+        f.name = "<string>"
+        assert list(verilog.read_statements(f)) == [
+            (['module', 'm', '(', 'a', ')'], "<string>", 1),
+            (['inv', 'x[0]', '(', '.', 'a', '(', 'a', ')', ')'], "<string>", 2),
+            (['endmodule'], "<string>", 3)]
+
+    def test_ports(self):
+        ckt = self.make_ckt()
+        reg4 = ckt.get_cell('reg4')
+        assert list(reg4.ports) == ['clk', 'd[3]', 'd[2]', 'd[1]', 'd[0]',
+                                    'q[3]', 'q[2]', 'q[1]', 'q[0]']
+        # bus bits are only added when connected
+        assert list(reg4.nets)[9:] == ['n[0]', 'n[1]', 'n[2]', 'n[3]']
+        assert ckt.get_topcells() == [reg4]
+
+    def test_connections(self):
+        ckt = self.make_ckt()
+        reg4 = ckt.get_cell('reg4')
+        def conns(inst):
+            return [(pin.port.name, pin.net.name) for pin in inst.all_pins()]
+        assert conns(reg4.get_instance('u1')) == [('a', 'd[1]'), ('y', 'n[1]')]
+        assert conns(reg4.get_instance('u2')) == [('a', 'd[2]'), ('y', 'n[2]')]
+        assert conns(reg4.get_instance('u3[0]')) == [('a', 'd[3]'),
+                                                     ('y', 'n[3]')]
+        assert conns(reg4.get_instance('ub'))[:2] == [('a[3]', 'n[3]'),
+                                                      ('a[2]', 'n[2]')]
+        buf4 = ckt.get_cell('buf4')
+        assert conns(buf4.get_instance('b2')) == [('a', 'tie0')]
+        assert buf4.get_net('tie0').is_global
+
+    def test_flatten(self):
+        ckt = self.make_ckt()
+        flat = ckt.get_cell('reg4').flattened()
+        assert len(flat.instances) == 14
+        caps = dict((row[0], row[1:]) for row in apps.net_caps(flat))
+        assert caps['n[0]'] == pytest.approx((0, 0.15, 0.15))
+        assert caps['vdd'] == pytest.approx((0, 0, 0.7))
+        assert 'tie0' in caps
+
+    def test_params(self):
+        f = StringIO("module m (a, y);\n"
+                     "  inv #(.w(2), .l(1), .nf(4), .m(2)) x (.a(a), .y(y));\n"
+                     "endmodule\n")
+        f.name = "<string>"
+        ckt = Ckt()
+        ckt.read_verilog(f)
+        inst = ckt.get_cell('m').get_instance('x')
+        assert list(inst.params) == ['w', 'l', 'nf', 'm']
+        assert inst.params['m'].value == '2'
+
+    def test_errors(self):
+        f = StringIO("module m (a);\n  inv x (.a(a);\nendmodule\n")
+        f.name = "<string>"
+        with pytest.raises(verilog.SyntaxError):
+            Ckt().read_verilog(f)
+
+class TestSpiceStatements:
+    text = dedent(
+        """\
+        * library
+        .macromodel nch_mac nmos d g s b w=1 l=1 m=1
+        .macromodel pch_mac pmos d g s b w=1 l=1 m=1
+        .subckt inv a y vdd vss
+        m1 y a vss vss nch_mac w=2u
+        + m=2
+        xm2 y a vdd vdd pch_mac w=3u
+        .ends
+        .subckt top a y vdd vss
+        xi1 a y vdd vss inv
+        m3 y y vss vss nch_mac w=1u $ load
+        .ends
+        """)
+
+    def test_read_statements(self):
+        f = StringIO(self.text)
+        f.name = "<string>"
+        stmts = [(pstmt['type'], pstmt['args'][0], fname, lineno)
+                 for pstmt, line, fname, lineno
+                 in spice.Reader.read_statements(f)]
+        assert stmts == [
+            (['control', 'macromodel'], '.macromodel', '<string>', 2),
+            (['control', 'macromodel'], '.macromodel', '<string>', 3),
+            (['control', 'subckt'], '.subckt', '<string>', 4),
+            (['element', 'm'], 'm1', '<string>', 6),
+            (['element', 'x'], 'xm2', '<string>', 7),
+            (['control', 'ends'], '.ends', '<string>', 8),
+            (['control', 'subckt'], '.subckt', '<string>', 9),
+            (['element', 'x'], 'xi1', '<string>', 10),
+            (['element', 'm'], 'm3', '<string>', 11),
+            (['control', 'ends'], '.ends', '<string>', 12)]
+
+    def test_syntax_error(self):
+        f = StringIO("m1 a b c d nch w= 1 2\n")
+        f.name = "<string>"
+        with pytest.raises(spice.SyntaxError) as e:
+            list(spice.Reader.read_statements(f))
+        assert "[<string>, 1]" in str(e.value)
+
+    def test_parse(self):
+        class ModelStats(spice.Handler):
+            def __init__(self):
+                self.models = set()
+                self.subckts = []
+                self.count = {}
+                self.width = {}
+                self.ended = False
+
+            def control_macromodel(self, pstmt, fname, lineno):
+                self.models.add(pstmt['args'][1])
+
+            def control_subckt(self, pstmt, fname, lineno):
+                self.subckts.append(pstmt['args'][1])
+
+            def element_m(self, pstmt, fname, lineno):
+                model = pstmt['args'][-1]
+                kwargs = pstmt['kwargs']
+                self.count[model] = self.count.get(model, 0) + 1
+                self.width[model] = (self.width.get(model, 0) +
+                                     float(kwargs['w']) *
+                                     float(kwargs.get('m', 1)))
+
+            def element_x(self, pstmt, fname, lineno):
+                # transistors can be instantiated as x elements too
+                if pstmt['args'][-1] in self.models:
+                    self.element_m(pstmt, fname, lineno)
+
+            def end(self):
+                self.ended = True
+
+        f = StringIO(self.text)
+        f.name = "<string>"
+        stats = ModelStats()
+        spice.Reader.parse(f, stats)
+        assert stats.subckts == ['inv', 'top']
+        assert stats.count == {'nch_mac': 2, 'pch_mac': 1}
+        assert stats.width == pytest.approx({'nch_mac': 5e-6,
+                                             'pch_mac': 3e-6})
+        assert stats.ended
+
+    def test_include(self, tmpdir):
+        tmpdir.join('lib.sp').write(dedent(
+            """\
+            .macromodel nch_mac nmos d g s b
+            .macromodel c c p n c=1
+            """))
+        tmpdir.mkdir('cells').join('inv.sp').write(dedent(
+            """\
+            .subckt inv a y vss
+            m1 y a vss vss nch_mac
+            .ends
+            """))
+        top = tmpdir.join('top.sp')
+        top.write(dedent(
+            """\
+            .include lib.sp
+            .inc "cells/inv.sp"
+            .subckt top a y vss
+            xi1 a y vss inv
+            c1 y vss 1f
+            .ends
+            """))
+        with open(str(top)) as f:
+            stmts = [(fname, lineno) for pstmt, line, fname, lineno
+                     in spice.Reader.read_statements(f)]
+        assert stmts == [(str(tmpdir.join('lib.sp')), 1),
+                         (str(tmpdir.join('lib.sp')), 2),
+                         (str(tmpdir.join('cells', 'inv.sp')), 1),
+                         (str(tmpdir.join('cells', 'inv.sp')), 2),
+                         (str(tmpdir.join('cells', 'inv.sp')), 3),
+                         (str(top), 3), (str(top), 4), (str(top), 5),
+                         (str(top), 6)]
+        ckt = Ckt()
+        with open(str(top)) as f:
+            ckt.read_spice(f)
+        ckt.link()
+        assert [cell.name for cell in ckt.get_topcells()] == ['top']
+
+    def test_sharded_include(self, tmpdir, monkeypatch):
+        ckt = make_rc_ckt()
+        flat = ckt.get_cell('top').flattened()
+        monkeypatch.chdir(tmpdir)
+        tmpdir.mkdir('out')
+        with open('out/lib.sp', 'w') as f:
+            writer = spice.Writer(flat, f)
+            for prim in ckt.all_prims():
+                writer.emit_prim(prim)
+            writer.flush()
+        with open('out/top.sp', 'w') as f:
+            ckt.write_spice(flat, f, jobs=2, include='out/top.sp.flat')
+        with open('out/top.sp') as f:
+            assert '.include "top.sp.flat.0"' in f.read()
+        ckt2 = Ckt()
+        for path in ('out/lib.sp', 'out/top.sp'):
+            with open(path) as f:
+                ckt2.read_spice(f)
+        ckt2.link()
+        assert (sorted(apps.net_caps(ckt2.get_cell('top'))) ==
+                sorted(apps.net_caps(flat)))
+
+class TestSpiceWriter:
+    def read(self, text):
+        return read_ckt(text)
+
+    def assert_caps_equal(self, rows, expected):
+        rows = sorted(rows)
+        expected = sorted(expected)
+        assert [row[0] for row in rows] == [row[0] for row in expected]
+        for row, exp in zip(rows, expected):
+            assert row[1:] == pytest.approx(exp[1:])
+
+    def test_write(self):
+        ckt = make_hier_ckt()
+        f = StringIO()
+        ckt.write_spice(ckt.get_cell('buf'), f)
+        assert f.getvalue() == dedent(
+            """\
+            .subckt buf a y vdd vss wp=2 wn=2
+                xi0 a n vdd vss inv wp="wp" wn="wn"
+                xi1 n y vdd vss inv wp="2*wp" wn="2*wn"
+                c1 n vss 2e-15
+            .ends buf
+            """)
+
+    def test_hierarchy(self):
+        ckt = make_hier_ckt()
+        top = ckt.get_cell('top')
+        f = StringIO()
+        ckt.write_spice(top, f, hierarchical=True, prims=True)
+        text = f.getvalue()
+        assert [line.split()[1] for line in text.splitlines()
+                if line.startswith('.')] == [
+            'pch_mac', 'nch_mac', 'c', 'pinv', 'pinv', 'inv', 'inv',
+            'buf', 'buf', 'top', 'top']
+        ckt2 = self.read(text)
+        self.assert_caps_equal(apps.net_caps(ckt2.get_cell('top').flattened()),
+                               apps.net_caps(top.flattened()))
+
+    def test_nested_cells(self):
+        ckt = self.read(dedent(
+            """\
+            .macromodel c c p n c=1
+            .subckt leaf a
+            c1 a 0 1
+            .ends
+            .subckt outer a
+            .subckt inner a
+            x1 a leaf
+            .ends
+            x1 a inner
+            .ends
+            .subckt top a
+            x1 a outer
+            .ends
+            """))
+        f = StringIO()
+        ckt.write_spice(ckt.get_cell('top'), f, hierarchical=True)
+        assert f.getvalue() == dedent(
+            """\
+            .subckt leaf a
+                c1 a 0 1
+            .ends leaf
+            .subckt outer a
+                .subckt inner a
+                    x1 a leaf
+                .ends inner
+                x1 a inner
+            .ends outer
+            .subckt top a
+                x1 a outer
+            .ends top
+            """)
+
+    def test_flat(self):
+        for ckt in (make_hier_ckt(), make_rc_ckt(),
+                    make_global_ckt()):
+            top = ckt.get_cell('top')
+            instances = list(top.instances)
+            prims = StringIO()
+            spice.Writer(top, prims).write_hierarchy(prims=True)
+            f = StringIO()
+            ckt.write_spice(top, f, flatten=True)
+            assert list(top.instances) == instances
+            ckt2 = self.read(prims.getvalue().split('.subckt')[0] +
+                             f.getvalue())
+            self.assert_caps_equal(apps.net_caps(ckt2.get_cell('top')),
+                                   apps.net_caps(top.flattened()))
+
+    def test_unconnected_ports(self):
+        ckt = make_verilog_ckt()
+        reg4 = ckt.get_cell('reg4')
+        f = StringIO()
+        ckt.write_spice(ckt.get_cell('buf4'), f)
+        assert 'xb2 tie0 b2/y inv\n' in f.getvalue()
+
+        f = StringIO()
+        ckt.write_spice(reg4, f, hierarchical=True, prims=True)
+        ckt2 = self.read(f.getvalue())
+        self.assert_caps_equal(apps.net_caps(ckt2.get_cell('reg4').flattened()),
+                               apps.net_caps(reg4.flattened()))
+
+        f = StringIO()
+        ckt.write_spice(reg4, f, flatten=True)
+        assert 'xub/b2/mp ub/b2/y tie0 vdd vdd pch_mac' in f.getvalue()
+
+    def test_buffered(self):
+        class File(object):
+            def __init__(self):
+                self.chunks = []
+            def write(self, data):
+                self.chunks.append(data)
+        ckt = make_hier_ckt()
+        f = File()
+        spice.Writer(ckt.get_cell('top'), f, buffer_size=200).write_flat()
+        assert len(f.chunks) > 3
+        assert all(len(chunk) < 300 for chunk in f.chunks)
+        assert ''.join(f.chunks).count('\n') == 20
+
+class TestShardedWriter:
+    def make_cell(self):
+        ckt = make_rc_ckt()
+        return ckt, ckt.get_cell('top').flattened()
+
+    def serial(self, cell):
+        f = StringIO()
+        spice.Writer(cell, f).write()
+        return f.getvalue()
+
+    def test_concatenated(self):
+        ckt, flat = self.make_cell()
+        expected = self.serial(flat)
+        assert flat.resistors
+        for jobs, shards in [(1, None), (2, None), (2, 3), (3, 100)]:
+            f = StringIO()
+            spice.Writer(flat, f).write_sharded(jobs, shards)
+            assert f.getvalue() == expected
+            assert spice._shared == {}
+
+    def test_include(self, tmpdir):
+        ckt, flat = self.make_cell()
+        path = str(tmpdir.join('top.sp'))
+        f = StringIO()
+        ckt.write_spice(flat, f, jobs=2, include=path)
+        lines = []
+        for line in f.getvalue().splitlines(True):
+            if line.strip().startswith('.include'):
+                included = line.split('"')[1]
+                assert included.startswith(path + '.')
+                lines.append(open(included).read())
+            else:
+                lines.append(line)
+        assert len(tmpdir.listdir()) == f.getvalue().count('.include') > 1
+        assert ''.join(lines) == self.serial(flat)
+
+    def test_write_spice(self):
+        ckt, flat = self.make_cell()
+        f = StringIO()
+        ckt.write_spice(flat, f, jobs=2)
+        assert f.getvalue() == self.serial(flat)
+        with pytest.raises(core.CktObjValueError):
+            ckt.write_spice(flat, f, flatten=True, jobs=2)
+
+class TestRunReports:
+    def test_flatten_once(self, capsys, monkeypatch):
+        ckt = make_nested_ckt()
+        flattened = []
+        orig = core.Cell.flattened
+        def count_flattened(cell, *args, **kwargs):
+            flattened.append(cell.name)
+            return orig(cell, *args, **kwargs)
+        monkeypatch.setattr(core.Cell, 'flattened', count_flattened)
+
+        apps.run_reports(ckt, [('hierarchy', None), ('net', None),
+                               ('net', 'top'), ('net', 'mid'),
+                               ('summary', 'top')])
+        assert flattened == ['top', 'mid']
+        assert list(ckt.get_cell('top').instances) == ['1', '2']
+        out = capsys.readouterr()[0]
+        assert out.count('Report : net') == 3
+
+    def test_unknown(self):
+        ckt = make_nested_ckt()
+        with pytest.raises(ValueError):
+            apps.run_reports(ckt, [('fanout', None)])
+
+class TestCharacterizeCells:
+    def make_ckt(self):
+        return make_library_ckt()
+
+    def test_struct_hash(self):
+        ckt = self.make_ckt()
+        leaf, leaf_copy, top = [ckt.get_cell(name) for name in
+                                ('leaf', 'leaf_copy', 'top')]
+        assert leaf.struct_hash() == leaf_copy.struct_hash()
+        assert leaf.struct_hash() != top.struct_hash()
+        leaf_copy.get_instance('m1').add_param('w', '2')
+        assert leaf.struct_hash() != leaf_copy.struct_hash()
+
+    def test_characterize(self, monkeypatch):
+        ckt = self.make_ckt()
+        characterized = []
+        orig = apps._characterize_cell
+        def count_characterize(cellname, ckt=None):
+            characterized.append(cellname)
+            return orig(cellname, ckt)
+        monkeypatch.setattr(apps, '_characterize_cell', count_characterize)
+
+        cache = {}
+        results = apps.characterize_cells(ckt, cache=cache)
+        assert list(results) == ['leaf', 'leaf_copy', 'top']
+        assert characterized == ['leaf', 'top']
+        assert results['leaf'] == results['leaf_copy']
+        assert results['top'] == list(apps.net_caps(
+            ckt.get_cell('top').flattened()))
+        assert list(ckt.get_cell('top').instances) == ['1', '2']
+
+        results = apps.characterize_cells(ckt, 'leaf.*', cache=cache)
+        assert list(results) == ['leaf', 'leaf_copy']
+        assert characterized == ['leaf', 'top']
+
+    def test_alternation(self):
+        ckt = self.make_ckt()
+        assert list(apps.characterize_cells(ckt, 'leaf|top')) == [
+            'leaf', 'top']
+
+    def test_parallel(self):
+        ckt = self.make_ckt()
+        assert (apps.characterize_cells(ckt, jobs=2) ==
+                apps.characterize_cells(ckt))
+
+class TestStructHash:
+    def make_ckt(self):
+        f = StringIO(dedent(
+            """\
+            .macromodel c c p n c=1
+            .macromodel nch_mac nmos d g s b m=1 cg="m*w*l*0.05"
+            .subckt leaf a b
+            c1 a k 1e-15
+            xm1 b a k k nch_mac w=1.0 l='1'
+            .ends
+            .subckt renamed x y
+            ca x internal 1fF
+            xmb y x internal internal nch_mac w=1 l=1
+            .ends
+            .subckt swapped a b
+            c1 b k 1e-15
+            xm1 a b k k nch_mac w=1 l=1
+            .ends
+            .subckt top a b
+            x1 a n leaf
+            x2 n b renamed
+            .ends
+            """))
+        f.name = "<string>"
+        ckt = Ckt()
+        ckt.read_spice(f)
+        ckt.link()
+        return ckt
+
+    def test_names(self):
+        ckt = self.make_ckt()
+        leaf, renamed, swapped = [ckt.get_cell(name) for name in
+                                  ('leaf', 'renamed', 'swapped')]
+        assert leaf.struct_hash() != renamed.struct_hash()
+        assert (leaf.struct_hash(names=False) ==
+                renamed.struct_hash(names=False))
+        assert (leaf.struct_hash(names=False) !=
+                swapped.struct_hash(names=False))
+
+    def test_order_and_globals(self):
+        f = StringIO(dedent(
+            """\
+            .macromodel c c p n c=1
+            .macromodel nch_mac nmos d g s b m=1
+            .subckt leaf a b
+            c1 a k 1e-15
+            xm1 b a k vss nch_mac
+            r1 b k 10
+            .ends
+            .subckt reordered a b
+            r1 b k 10
+            xm1 b a k vss nch_mac
+            c1 a k 1e-15
+            .ends
+            .subckt local a b
+            c1 a k 1e-15
+            xm1 b a k vdd nch_mac
+            r1 b k 10
+            .ends
+            .subckt global a b
+            c1 a k 1e-15
+            xm1 b a k vdd nch_mac
+            r1 b k 10
+            .ends
+            """))
+        f.name = "<string>"
+        ckt = Ckt()
+        ckt.read_spice(f)
+        ckt.link()
+        ckt.get_cell('global').get_net('vdd').is_global = True
+        leaf, reordered, local, global_ = [
+            ckt.get_cell(name)
+            for name in ('leaf', 'reordered', 'local', 'global')]
+        for names in (True, False):
+            assert (leaf.struct_hash(names=names) ==
+                    reordered.struct_hash(names=names))
+            assert (local.struct_hash(names=names) !=
+                    global_.struct_hash(names=names))
+
+    def test_memo(self):
+        ckt = self.make_ckt()
+        memo = {}
+        top = ckt.get_cell('top')
+        digest = top.struct_hash(memo)
+        assert memo[(top, True)] == digest
+        assert (ckt.get_cell('leaf'), True) in memo
+
+    def test_duplicate_cells(self, capsys):
+        ckt = self.make_ckt()
+        # nothing is hashed or printed while reading
+        assert capsys.readouterr()[0] == ''
+        assert ckt.duplicate_cells() == OrderedDict([('renamed', 'leaf')])
+
+    def test_duplicate_cells_read_order(self):
+        # the same cells, with the refs declared after their users
+        text = dedent(
+            """\
+            .macromodel c c p n c=1
+            .subckt top1 a
+            x1 a leaf1
+            .ends
+            .subckt top2 a
+            x1 a leaf2
+            .ends
+            .subckt leaf1 a
+            c1 a 0 1
+            .ends
+            .subckt leaf2 a
+            c1 a 0 1
+            .ends
+            """)
+        f = StringIO(text)
+        f.name = "<string>"
+        ckt = Ckt()
+        ckt.read_spice(f)
+        ckt.link()
+        assert ckt.duplicate_cells() == OrderedDict([('top2', 'top1'),
+                                                     ('leaf2', 'leaf1')])
+
+    def test_report_cache(self, capsys, monkeypatch):
+        ckt = make_library_ckt()
+        flattened = []
+        orig = core.Cell.flattened
+        def count_flattened(cell, *args, **kwargs):
+            flattened.append(cell.name)
+            return orig(cell, *args, **kwargs)
+        monkeypatch.setattr(core.Cell, 'flattened', count_flattened)
+
+        apps.run_reports(ckt, [('net', 'leaf'), ('net', 'leaf_copy')])
+        assert flattened == ['leaf']
+        out = capsys.readouterr()[0]
+        assert 'Cell   : leaf_copy' in out
+
+class TestDiffCkts:
+    netlist = dedent(
+        """\
+        .macromodel c c p n c=1
+        .macromodel nch_mac nmos d g s b m=1 cg="m*w*l*0.05"
+        .subckt leaf a b
+        c1 a k 1e-15
+        xm1 b a k k nch_mac w=1 l=1
+        .ends
+        .subckt mid a b
+        x1 a b leaf
+        .ends
+        .subckt top a b
+        x1 a n mid
+        x2 n b mid
+        .ends
+        """)
+
+    def make_ckt(self, netlist):
+        f = StringIO(netlist)
+        f.name = "<string>"
+        ckt = Ckt()
+        ckt.read_spice(f)
+        ckt.link()
+        return ckt
+
+    def test_same(self):
+        old = self.make_ckt(self.netlist)
+        new = self.make_ckt(self.netlist.replace('w=1 ', 'w=1.0 '))
+        assert list(apps.diff_ckts(old, new)) == []
+
+    def test_changes(self, monkeypatch):
+        old = self.make_ckt(self.netlist)
+        new = self.make_ckt(self.netlist
+                            .replace('c1 a k 1e-15', 'c1 a k 2e-15')
+                            .replace('x2 n b mid', 'x3 n b mid')
+                            + ".subckt extra a\n.ends\n")
+        compared = []
+        orig = apps._diff_cell
+        def count_diff_cell(name, old, new):
+            compared.append(name)
+            return orig(name, old, new)
+        monkeypatch.setattr(apps, '_diff_cell', count_diff_cell)
+
+        diffs = list(apps.diff_ckts(old, new))
+        assert compared == ['/leaf', '/mid', '/top']
+        assert diffs == [
+            dict(cell='/leaf', change='param', instance='c1', param='c',
+                 old='1e-15', new='2e-15'),
+            dict(cell='/top', change='instance_removed', instance='2'),
+            dict(cell='/top', change='instance_added', instance='3',
+                 new='mid'),
+            dict(cell='/extra', change='cell_added'),
+        ]
+
+    def test_prims(self):
+        old = self.make_ckt(self.netlist)
+        new = self.make_ckt(self.netlist
+                            .replace('*0.05"', '*0.06"')
+                            .replace('.macromodel c c p n c=1',
+                                     '.macromodel c c p n c=1\n'
+                                     '.macromodel pch_mac pmos d g s b'))
+        assert list(apps.diff_ckts(old, new)) == [
+            dict(prim='/pch_mac', change='prim_added'),
+            dict(prim='/nch_mac', change='param', param='cg',
+                 old='m*w*l*0.05', new='m*w*l*0.06'),
+        ]
+
+    def test_write(self):
+        old = self.make_ckt(self.netlist)
+        new = self.make_ckt(self.netlist.replace('xm1 b a k k',
+                                                 'xm1 b a a k'))
+        f = StringIO()
+        apps.write_diffs(f, apps.diff_ckts(old, new))
+        assert f.getvalue() == (
+            '{"cell": "/leaf", "change": "pins", "instance": "m1", '
+            '"new": [["d", "b"], ["g", "a"], ["s", "a"], ["b", "k"]], '
+            '"old": [["d", "b"], ["g", "a"], ["s", "k"], ["b", "k"]]}\n')